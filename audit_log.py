@@ -0,0 +1,195 @@
+# audit_log.py
+import asyncio
+import datetime
+import json
+import logging
+import os
+import queue
+import sqlite3
+from contextlib import closing
+from logging.handlers import QueueHandler, QueueListener
+
+from config import AUDIT_DIRECTORY, AUDIT_MAX_BYTES, AUDIT_FSYNC_BATCH
+from shards import Shards
+
+INDEX_FILE = "index.db"
+
+
+def _segment_path(directory, segment):
+    return os.path.join(directory, f"audit-{segment:06d}.jsonl")
+
+
+def _segments(directory):
+    found = []
+    for name in os.listdir(directory):
+        if name.startswith("audit-") and name.endswith(".jsonl"):
+            found.append(int(name[len("audit-"):-len(".jsonl")]))
+    return sorted(found)
+
+
+class AuditFileHandler(logging.Handler):
+    """
+    Appends audit entries as JSON lines to numbered segment files and indexes
+    each line's position by user_id and txid in a small SQLite table.
+
+    Runs on the QueueListener thread. Lines are fsynced in batches: whenever
+    the queue runs dry or AUDIT_FSYNC_BATCH entries are waiting, whichever
+    comes first. The index is committed only after the lines it points to
+    are on disk. A segment is closed once it reaches max_bytes and the next
+    number is started, so index entries never go stale.
+    """
+
+    def __init__(self, directory, records, max_bytes, fsync_batch):
+        super().__init__()
+        self.directory = directory
+        self.records = records
+        self.max_bytes = max_bytes
+        self.fsync_batch = fsync_batch
+        self.stream = None
+        self.segment = None
+        self.index = None
+        self.unsynced = 0
+
+    def _open(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.index = sqlite3.connect(os.path.join(self.directory, INDEX_FILE), check_same_thread=False)
+        self.index.execute("PRAGMA journal_mode=WAL")
+        self.index.execute("CREATE TABLE IF NOT EXISTS entries (segment INTEGER, offset INTEGER, user_id TEXT, txid TEXT)")
+        self.index.execute("CREATE INDEX IF NOT EXISTS entries_user ON entries (user_id)")
+        self.index.execute("CREATE INDEX IF NOT EXISTS entries_txid ON entries (txid)")
+        segments = _segments(self.directory)
+        self.segment = segments[-1] if segments else 1
+        self.stream = open(_segment_path(self.directory, self.segment), "ab")
+
+    def _rotate(self):
+        self._sync()
+        self.stream.close()
+        self.segment += 1
+        self.stream = open(_segment_path(self.directory, self.segment), "ab")
+
+    def _sync(self):
+        if self.stream is None:
+            return
+        self.stream.flush()
+        os.fsync(self.stream.fileno())
+        self.index.commit()
+        self.unsynced = 0
+
+    def emit(self, record):
+        try:
+            if self.stream is None:
+                self._open()
+            elif self.stream.tell() >= self.max_bytes:
+                self._rotate()
+            entry = record.audit
+            offset = self.stream.tell()
+            self.stream.write((json.dumps(entry, ensure_ascii=False) + "\n").encode("utf-8"))
+            self.index.execute(
+                "INSERT INTO entries VALUES (?, ?, ?, ?)",
+                (self.segment, offset, str(entry["user_id"]), entry["txid"])
+            )
+            self.unsynced += 1
+            if self.unsynced >= self.fsync_batch or self.records.empty():
+                self._sync()
+        except Exception:
+            self.handleError(record)
+
+    def close(self):
+        if self.stream is not None:
+            self._sync()
+            self.stream.close()
+            self.index.close()
+            self.stream = None
+        super().close()
+
+
+def read_history(directory, user_id=None, txid=None, limit=20):
+    """Return the newest `limit` entries for a user or a txid, oldest first, using the index"""
+    path = os.path.join(directory, INDEX_FILE)
+    if not os.path.exists(path):
+        return []
+    column, value = ("txid", txid) if txid is not None else ("user_id", str(user_id))
+    with closing(sqlite3.connect(path)) as index:
+        rows = index.execute(
+            f"SELECT segment, offset FROM entries WHERE {column} = ? ORDER BY rowid DESC LIMIT ?",
+            (value, limit)
+        ).fetchall()
+
+    entries = []
+    for segment, offset in reversed(rows):
+        with open(_segment_path(directory, segment), "rb") as f:
+            f.seek(offset)
+            entries.append(json.loads(f.readline()))
+    return entries
+
+
+class AuditLog:
+    """
+    Append-only transaction audit trail, kept apart from the application log.
+
+    record() only puts the entry on an in-memory queue; the file writes,
+    fsyncs and index updates happen on a QueueListener thread, so the event
+    loop never waits on the disk. Under sharding each shard writes its own
+    directory and history() asks all of them.
+    """
+    _directory = AUDIT_DIRECTORY
+    _logger = None
+    _listener = None
+    _handler = None
+
+    @staticmethod
+    def configure(directory):
+        """Write to a different directory (must be called before the first record)"""
+        AuditLog._directory = directory
+
+    @staticmethod
+    def start():
+        records = queue.SimpleQueue()
+        AuditLog._handler = AuditFileHandler(AuditLog._directory, records, AUDIT_MAX_BYTES, AUDIT_FSYNC_BATCH)
+        AuditLog._listener = QueueListener(records, AuditLog._handler)
+        AuditLog._logger = logging.getLogger("telebot.audit")
+        AuditLog._logger.propagate = False
+        AuditLog._logger.setLevel(logging.INFO)
+        AuditLog._logger.handlers = [QueueHandler(records)]
+        AuditLog._listener.start()
+
+    @staticmethod
+    def record(action, user_id, txid, amount, status):
+        """Queue an audit entry; never blocks on I/O"""
+        if AuditLog._listener is None:
+            AuditLog.start()
+        entry = {
+            "ts": datetime.datetime.now().isoformat(timespec="seconds"),
+            "action": action,
+            "user_id": str(user_id),
+            "txid": txid,
+            "amount": amount,
+            "status": status,
+        }
+        AuditLog._logger.info(action, extra={"audit": entry})
+
+    @staticmethod
+    def stop():
+        """Write out everything still queued, fsync and close the files (called on shutdown)"""
+        if AuditLog._listener is None:
+            return
+        AuditLog._listener.stop()
+        AuditLog._handler.close()
+        AuditLog._logger.handlers = []
+        AuditLog._listener = None
+        AuditLog._handler = None
+
+    @staticmethod
+    async def local_history(user_id=None, txid=None, limit=20):
+        return await asyncio.to_thread(read_history, AuditLog._directory, user_id, txid, limit)
+
+    @staticmethod
+    async def history(user_id=None, txid=None, limit=20):
+        """Audit entries for a user or a txid across all shards, oldest first"""
+        if Shards.count == 1:
+            return await AuditLog.local_history(user_id, txid, limit)
+        parts = await Shards.gather("audit.history", user_id, txid, limit)
+        return sorted((entry for part in parts for entry in part), key=lambda entry: entry["ts"])[-limit:]
+
+
+Shards.register("audit.history", AuditLog.local_history)
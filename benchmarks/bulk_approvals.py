@@ -0,0 +1,70 @@
+# benchmarks/bulk_approvals.py
+"""
+Clear a backlog of pending deposits with one /approveall and check the result.
+
+Deposits are spread over --users users; every one has an admin alert on
+record, so the run also queues one alert edit and one user notification
+per deposit through the Notifier.
+
+    python -m benchmarks.bulk_approvals --deposits 1000 --users 200
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from audit_log import AuditLog
+from benchmarks.fakes import FakeBot, make_text_update, make_context
+from command_handlers import CommandHandlers
+from data_manager import DataManager
+from ledger import Ledger
+from notifier import Notifier
+from pending_queue import PendingQueue
+from storage import create_store
+from config import ADMINS
+
+AMOUNT = 100
+
+
+async def seed(deposits, users):
+    for i in range(deposits):
+        user_id = str(500000 + i % users)
+        txn = {"crypto": "Bitcoin", "txid": f"bulk{i:08d}", "amount": AMOUNT, "status": "pending", "timestamp": ""}
+        await Ledger.append(user_id, txn)
+        await PendingQueue.add(user_id, txn)
+        await PendingQueue.remember_alert(txn["txid"], ADMINS[0], i + 1)
+
+
+async def run(deposits, users):
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store("json", tmp, os.path.join(tmp, "bulk.db")))
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+        await seed(deposits, users)
+        bot = FakeBot()
+
+        update = make_text_update(ADMINS[0], "/approveall", bot)
+        started = time.perf_counter()
+        await CommandHandlers.approve_all(update, make_context(bot))
+        elapsed = time.perf_counter() - started
+
+        balances = [await Ledger.balance(str(500000 + u)) for u in range(users)]
+        queued = Notifier.pending()
+        await Notifier.stop(timeout=0)
+        await Ledger.close()
+        await DataManager.close()
+        AuditLog.stop()
+
+    print(f"approved {deposits} deposits for {users} users in {elapsed * 1000:.1f} ms")
+    print(f"pending={await PendingQueue.count()} total credited={sum(balances)} queued notifications/edits={queued}")
+    assert sum(balances) == deposits * AMOUNT, "balance drifted"
+    print("OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--deposits", type=int, default=1000)
+    parser.add_argument("--users", type=int, default=200)
+    args = parser.parse_args()
+    asyncio.run(run(args.deposits, args.users))
@@ -0,0 +1,79 @@
+# benchmarks/coupons.py
+"""
+Coupon redemption under load: --codes coupons are created in one batch,
+--users users race to redeem a coupon with --max-uses uses, and --guesses
+random codes are tried as a brute-force attacker would.
+
+Checks that exactly --max-uses redemptions succeed and are credited, and
+reports redemption latency, the cost of rejecting a guess and how many
+guesses got past the Bloom filter to a store lookup.
+
+    python -m benchmarks.coupons --codes 20000 --users 500 --max-uses 100 --guesses 50000
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from audit_log import AuditLog
+from benchmarks.fakes import percentile
+from coupons import Coupons, _digest
+from data_manager import DataManager
+from ledger import Ledger
+from storage import create_store
+
+AMOUNT = 5
+
+
+async def redeem(user_id, code, latencies, results):
+    started = time.perf_counter()
+    result, _, _ = await Coupons.redeem(user_id, code)
+    latencies.append(time.perf_counter() - started)
+    results[result] = results.get(result, 0) + 1
+
+
+async def run(codes, users, max_uses, guesses):
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store("json", tmp, os.path.join(tmp, "coupons.db")))
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+
+        batch = Coupons.generate(codes)
+        started = time.perf_counter()
+        await Coupons.create(batch, AMOUNT, 1, 0)
+        await Coupons.create(["RACE-CODE"], AMOUNT, max_uses, 0)
+        create_elapsed = time.perf_counter() - started
+
+        latencies, results = [], {}
+        await asyncio.gather(*(redeem(800000 + u, "race-code", latencies, results) for u in range(users)))
+        credited = sum([await Ledger.balance(str(800000 + u)) for u in range(users)])
+
+        # Every guess comes from its own user, so the per-user failure limit doesn't hide the lookup cost
+        past_filter = sum(Coupons._may_exist(_digest(code)) for code in Coupons.generate(guesses))
+        guess_latencies, guess_results = [], {}
+        for i, code in enumerate(Coupons.generate(guesses)):
+            await redeem(900000 + i, code, guess_latencies, guess_results)
+
+        await Ledger.close()
+        await DataManager.close()
+        AuditLog.stop()
+
+    print(f"created {codes} coupons in {create_elapsed * 1000:.1f} ms")
+    print(f"race for {max_uses} uses by {users} users: {results} credited=${credited}")
+    print("  redeem: " + " ".join(f"p{pct}={percentile(latencies, pct) * 1000:.3f}ms" for pct in (50, 95, 99)))
+    print(f"{guesses} guesses: {guess_results}, {past_filter} got past the Bloom filter")
+    print("  reject: " + " ".join(f"p{pct}={percentile(guess_latencies, pct) * 1e6:.1f}us" for pct in (50, 95, 99)))
+    assert results.get("ok") == min(users, max_uses) and credited == min(users, max_uses) * AMOUNT, "coupon oversubscribed"
+    assert guess_results.get("ok", 0) == 0, "a guessed code was accepted"
+    print("OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--codes", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--max-uses", type=int, default=100)
+    parser.add_argument("--guesses", type=int, default=50000)
+    args = parser.parse_args()
+    asyncio.run(run(args.codes, args.users, args.max_uses, args.guesses))
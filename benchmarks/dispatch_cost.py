@@ -0,0 +1,45 @@
+# benchmarks/dispatch_cost.py
+"""
+Measure the per-update cost of picking a handler in MessageHandlers.route.
+
+Each case is a (user_data, text) pair covering a fixed button, the global
+Back button, a catalog-driven fallback, a modal state and unknown input.
+
+    python -m benchmarks.dispatch_cost --iterations 200000
+"""
+import argparse
+import time
+
+from message_handlers import MessageHandlers
+
+CASES = [
+    ("main button", {"menu": "main"}, "💸 Balance Top Ups"),
+    ("back button", {"menu": "services"}, "Back ↩️"),
+    ("catalog fallback", {"menu": "giftcard"}, "Amazon"),
+    ("deposit state", {"menu": "topups", "expecting_tx": "Bitcoin"}, "0x" + "ab" * 32),
+    ("admin note state", {"menu": "main", "awaiting_note_for": "1_abc"}, "checked on chain"),
+    ("unknown text", {"menu": "main"}, "hello there"),
+]
+
+
+def measure(user_data, text, iterations):
+    route = MessageHandlers.route
+    started = time.perf_counter()
+    for _ in range(iterations):
+        route(user_data, text)
+    return (time.perf_counter() - started) / iterations
+
+
+def run(iterations):
+    print(f"iterations={iterations}")
+    for name, user_data, text in CASES:
+        handler = MessageHandlers.route(user_data, text)
+        cost = measure(user_data, text, iterations)
+        print(f"  {name:<18} {cost * 1e9:8.1f} ns/update -> {handler.__qualname__}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--iterations", type=int, default=200000)
+    args = parser.parse_args()
+    run(args.iterations)
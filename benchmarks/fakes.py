@@ -0,0 +1,69 @@
+# benchmarks/fakes.py
+"""Minimal stand-ins for telegram Update/Context objects so handlers can be driven offline."""
+import asyncio
+import itertools
+from types import SimpleNamespace
+
+_message_ids = itertools.count(1)
+
+
+class FakeBot:
+    """Records outgoing calls instead of talking to the Bot API"""
+
+    def __init__(self, latency=0.0):
+        self.latency = latency
+        self.sent = 0
+
+    async def send_message(self, chat_id, text, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        return SimpleNamespace(chat_id=chat_id, message_id=next(_message_ids), text=text)
+
+    async def edit_message_text(self, text, chat_id=None, message_id=None, **kwargs):
+        if self.latency:
+            await asyncio.sleep(self.latency)
+        self.sent += 1
+        return SimpleNamespace(chat_id=chat_id, message_id=message_id, text=text)
+
+
+def _replying(bot):
+    async def reply_text(text, **kwargs):
+        return await bot.send_message(None, text, **kwargs)
+    return reply_text
+
+
+def make_user(user_id):
+    return SimpleNamespace(id=user_id, username=f"user{user_id}", first_name="Bench", last_name=None)
+
+
+def make_text_update(user_id, text, bot):
+    user = make_user(user_id)
+    message = SimpleNamespace(text=text, from_user=user, chat_id=user_id, reply_text=_replying(bot))
+    return SimpleNamespace(message=message, effective_user=user, effective_chat=SimpleNamespace(id=user_id), callback_query=None)
+
+
+def make_callback_update(user_id, data, bot):
+    user = make_user(user_id)
+
+    async def answer(*args, **kwargs):
+        return True
+
+    async def edit_message_text(text, **kwargs):
+        return await bot.send_message(user_id, text, **kwargs)
+
+    query = SimpleNamespace(data=data, from_user=user, answer=answer, edit_message_text=edit_message_text)
+    return SimpleNamespace(message=None, effective_user=user, effective_chat=SimpleNamespace(id=user_id), callback_query=query)
+
+
+def make_context(bot, user_data=None, args=None):
+    return SimpleNamespace(bot=bot, user_data={} if user_data is None else user_data, args=args or [])
+
+
+def percentile(samples, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not samples:
+        return 0.0
+    ordered = sorted(samples)
+    index = max(0, min(len(ordered) - 1, int(round(pct / 100 * len(ordered))) - 1))
+    return ordered[index]
@@ -0,0 +1,117 @@
+# benchmarks/flood.py
+"""
+Flood test: --spammers users each fire --presses updates at once (every
+text twice in a row, like a hammered button) while --users ordinary users
+walk the menus, all through the real Application against the stub Bot API.
+
+Reports how many spam updates reached a handler, what was shed and why,
+and the Bot API calls and file writes the spam cost; checks that every
+ordinary user got all their replies. --off disables flood control for a
+before/after comparison.
+
+    python -m benchmarks.flood --spammers 20 --presses 200 --users 100
+    python -m benchmarks.flood --spammers 20 --presses 200 --users 100 --off
+"""
+import argparse
+import asyncio
+import os
+import sys
+import tempfile
+import time
+
+SPAM_TEXTS = ["💸 Balance Top Ups", "Available balance", "Back ↩️", "🎁 Gift Card"]
+MENU_SCRIPT = ["/start", "💸 Balance Top Ups", "Available balance", "Back ↩️", "🎁 Gift Card", "Back ↩️"]
+
+
+def body(user_id, text):
+    from benchmarks.webhook_load import synthetic_update
+
+    update = synthetic_update(user_id, text)
+    if text.startswith("/"):
+        update["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(text)}]
+    return update
+
+
+async def feed(application, bodies, concurrent):
+    from telegram import Update
+
+    updates = [Update.de_json(b, application.bot) for b in bodies]
+    if concurrent:
+        await asyncio.gather(*(application.process_update(update) for update in updates))
+    else:
+        for update in updates:
+            await application.process_update(update)
+
+
+async def run(args):
+    import config
+    import main
+    from audit_log import AuditLog
+    from benchmarks.stub_bot_api import StubBotApi
+    from benchmarks.suite import DiskCounter
+    from data_manager import DataManager
+    from flood_control import UPDATES_SHED
+    from ledger import Ledger
+    from notifier import Notifier
+    from storage import create_store
+
+    stub = StubBotApi()
+    await stub.start()
+    disk = DiskCounter()
+    disk.install()
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store("json", tmp, os.path.join(tmp, "flood.db")))
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+        config.BOT_API_URL = stub.base_url
+        main.BOT_TOKEN = main.BOT_TOKEN or "123456:stub"
+        application = main.build_application()
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        try:
+            spammers = [700000 + s for s in range(args.spammers)]
+            users = [710000 + u for u in range(args.users)]
+            spam = [[body(user_id, SPAM_TEXTS[(i // 2) % len(SPAM_TEXTS)]) for i in range(args.presses)] for user_id in spammers]
+            walks = [[body(user_id, text) for text in MENU_SCRIPT] for user_id in users]
+            writes_before, _ = disk.snapshot()
+            started = time.perf_counter()
+            await asyncio.gather(
+                *(feed(application, bodies, True) for bodies in spam),
+                *(feed(application, bodies, False) for bodies in walks),
+            )
+            elapsed = time.perf_counter() - started
+            writes = disk.snapshot()[0] - writes_before
+        finally:
+            await Notifier.stop(timeout=0)
+            await application.stop()
+            await application.shutdown()
+            await application.post_shutdown(application)
+    await stub.stop()
+
+    shed = {dict(key)["reason"]: value for key, value in UPDATES_SHED.values.items()}
+    spam_sent = args.spammers * args.presses
+    spam_replies = sum(stub.sent_to[user_id] for user_id in spammers)
+    starved = [user_id for user_id in users if stub.sent_to[user_id] < len(MENU_SCRIPT)]
+    print(f"flood control {'off' if args.off else 'on'}: {elapsed * 1000:.0f} ms")
+    print(f"  spam updates={spam_sent} shed={sum(shed.values())} {shed}")
+    print(f"  replies to spammers={spam_replies} ({spam_replies / max(spam_sent, 1):.2f} per update), file writes={writes}")
+    print(f"  ordinary users={len(users)} missing replies={len(starved)}")
+    assert not starved, "ordinary users were shed"
+    print("OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--spammers", type=int, default=20)
+    parser.add_argument("--presses", type=int, default=200)
+    parser.add_argument("--users", type=int, default=100)
+    parser.add_argument("--off", action="store_true", help="run without per-user limits or debouncing")
+    args = parser.parse_args()
+    if args.off:
+        # Must be set before the project modules read config, hence the imports inside run()
+        os.environ.update(FLOOD_USER_RATE="0", FLOOD_DEBOUNCE="0", FLOOD_MAX_WAITING=str(sys.maxsize))
+    from metrics import configure_logging
+
+    configure_logging()
+    asyncio.run(run(args))
@@ -0,0 +1,57 @@
+# benchmarks/handler_latency.py
+"""
+Measure MessageHandlers.handle latency with many concurrent simulated users.
+
+    python -m benchmarks.handler_latency --users 500 --backend json [--no-cache]
+"""
+import argparse
+import asyncio
+import tempfile
+import time
+import os
+
+from audit_log import AuditLog
+from benchmarks.fakes import FakeBot, make_text_update, make_context, percentile
+from data_manager import DataManager
+from ledger import Ledger
+from message_handlers import MessageHandlers
+from storage import create_store
+
+SCRIPT = ["💸 Balance Top Ups", "Available balance", "Back ↩️", "🎁 Gift Card", "Back ↩️"]
+
+
+async def simulate_user(user_id, bot, latencies):
+    context = make_context(bot)
+    for text in SCRIPT:
+        update = make_text_update(user_id, text, bot)
+        started = time.perf_counter()
+        await MessageHandlers.handle(update, context)
+        latencies.append(time.perf_counter() - started)
+
+
+async def run(users, backend, cached):
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store(backend, tmp, os.path.join(tmp, "bench.db")), cached=cached)
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+        bot = FakeBot()
+        latencies = []
+        started = time.perf_counter()
+        await asyncio.gather(*(simulate_user(100000 + i, bot, latencies) for i in range(users)))
+        elapsed = time.perf_counter() - started
+        await Ledger.close()
+        await DataManager.close()
+        AuditLog.stop()
+
+    print(f"backend={backend} cached={cached} users={users} updates={len(latencies)} elapsed={elapsed:.2f}s")
+    for pct in (50, 95, 99):
+        print(f"  p{pct}: {percentile(latencies, pct) * 1000:.2f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--no-cache", dest="cached", action="store_false", help="bypass the write-back cache")
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.backend, args.cached))
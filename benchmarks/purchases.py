@@ -0,0 +1,93 @@
+# benchmarks/purchases.py
+"""
+Checkout rush: --buyers users try to buy the same gift card at once while
+only --codes codes are in stock. One in --poor buyers can't afford it and
+one in --abandon stops after reserving a code, which has to expire and go
+back on sale.
+
+Checks that no code is sold twice, that every sale is debited exactly
+once, and that stock adds up afterwards; reports checkout latency.
+
+    python -m benchmarks.purchases --buyers 500 --codes 300
+"""
+import os
+
+# Short reservations so abandoned ones expire during the run; set before the project modules read config
+os.environ.setdefault("RESERVATION_TTL", "0.5")
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+from audit_log import AuditLog
+from benchmarks.fakes import percentile
+from data_manager import DataManager
+from inventory import Inventory
+from ledger import Ledger
+from purchases import Purchases
+from storage import create_store
+
+PRODUCT = "Amazon"
+PRICE = 25
+FUNDS = 100
+
+
+async def buy(user_id, poor, abandon, latencies, results, codes):
+    if abandon:
+        # A checkout that dies after reserving: the code has to come back once the reservation expires
+        reservation = await Inventory.reserve(Inventory.item(PRODUCT), user_id)
+        outcome = "abandoned" if reservation else "sold_out"
+        results[outcome] = results.get(outcome, 0) + 1
+        return
+    started = time.perf_counter()
+    result, order = await Purchases.buy(user_id, Inventory.item(PRODUCT))
+    latencies.append(time.perf_counter() - started)
+    results[result] = results.get(result, 0) + 1
+    if result == "ok":
+        codes.append(order["code"])
+
+
+async def run(buyers, stock, poor, abandon):
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store("json", tmp, os.path.join(tmp, "purchases.db")))
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+        users = [str(600000 + b) for b in range(buyers)]
+        await Ledger.credit_many([
+            (user_id, {"crypto": "Bitcoin", "txid": f"fund{user_id}", "amount": FUNDS if b % poor else PRICE - 1, "timestamp": ""})
+            for b, user_id in enumerate(users)
+        ])
+        await Inventory.add_codes(PRODUCT, PRICE, [f"CODE-{c:06d}" for c in range(stock)])
+
+        latencies, results, codes = [], {}, []
+        started = time.perf_counter()
+        await asyncio.gather(*(
+            buy(user_id, b % poor == 0, b % abandon == 1, latencies, results, codes) for b, user_id in enumerate(users)
+        ))
+        elapsed = time.perf_counter() - started
+
+        await asyncio.sleep(float(os.environ["RESERVATION_TTL"]) + 0.1)
+        after = await Inventory.stock(PRODUCT)
+        spent = sum(FUNDS if b % poor else PRICE - 1 for b in range(buyers)) - sum([await Ledger.balance(u) for u in users])
+        await Ledger.close()
+        await DataManager.close()
+        AuditLog.stop()
+
+    print(f"buyers={buyers} codes={stock} in {elapsed * 1000:.1f} ms: {results}")
+    print("  checkout: " + " ".join(f"p{pct}={percentile(latencies, pct) * 1000:.2f}ms" for pct in (50, 95, 99)))
+    print(f"  after expiry: {after}, debited ${spent}")
+    assert len(codes) == len(set(codes)), "a code was sold twice"
+    assert round(spent, 2) == len(codes) * PRICE, "debits don't match the sales"
+    assert after["sold"] == len(codes) and after["available"] + after["sold"] == stock and after["reserved"] == 0, "stock doesn't add up"
+    print("OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--buyers", type=int, default=500)
+    parser.add_argument("--codes", type=int, default=300)
+    parser.add_argument("--poor", type=int, default=10, help="every n-th buyer can't afford the price")
+    parser.add_argument("--abandon", type=int, default=7, help="every n-th buyer stops after reserving")
+    args = parser.parse_args()
+    asyncio.run(run(args.buyers, args.codes, args.poor, args.abandon))
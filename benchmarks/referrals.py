@@ -0,0 +1,100 @@
+# benchmarks/referrals.py
+"""
+Referral load: --referees users join through /start ref_<id> links of
+--referrers users (skewed, a few referrers bring most of them), every
+referee makes a deposit that is approved in one bulk settle, then the
+leaderboard is queried.
+
+Reports /start latency with a referral payload, the cost of a leaderboard
+query, and checks the maintained leaderboard and the bonuses credited
+against a full scan of the per-referrer counters.
+
+    python -m benchmarks.referrals --referrers 500 --referees 20000
+"""
+import argparse
+import asyncio
+import os
+import random
+import tempfile
+import time
+
+from audit_log import AuditLog
+from benchmarks.fakes import FakeBot, make_text_update, make_context, percentile
+from callback_handlers import CallbackHandlers, TransactionStatus
+from command_handlers import CommandHandlers
+from config import REFERRAL_REWARD_RATE, REFERRAL_LEADERBOARD_SIZE
+from data_manager import DataManager
+from ledger import Ledger
+from notifier import Notifier
+from referrals import Referrals
+from storage import create_store
+
+AMOUNT = 100
+
+
+async def join(referee, referrer, bot, latencies):
+    update = make_text_update(referee, f"/start ref_{referrer}", bot)
+    started = time.perf_counter()
+    await CommandHandlers.start(update, make_context(bot, args=[f"ref_{referrer}"]))
+    latencies.append(time.perf_counter() - started)
+
+
+async def run(referrers, referees):
+    random.seed(7)
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store("json", tmp, os.path.join(tmp, "referrals.db")))
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+        bot = FakeBot()
+
+        owners = [str(300000 + r) for r in range(referrers)]
+        weights = [1 / (r + 1) for r in range(referrers)]
+        assigned = {str(400000 + i): random.choices(owners, weights)[0] for i in range(referees)}
+        latencies = []
+        for referee, referrer in assigned.items():
+            await join(referee, referrer, bot, latencies)
+
+        items = []
+        for referee in assigned:
+            txn = {"crypto": "Bitcoin", "txid": f"reftx{referee}", "amount": AMOUNT, "status": "pending", "timestamp": ""}
+            await Ledger.append(referee, txn)
+            items.append((referee, txn["txid"]))
+        started = time.perf_counter()
+        await CallbackHandlers.settle_many(items, TransactionStatus.APPROVED)
+        settle_elapsed = time.perf_counter() - started
+
+        started = time.perf_counter()
+        for _ in range(1000):
+            leaders = await Referrals.leaderboard()
+        query_elapsed = (time.perf_counter() - started) / 1000
+
+        started = time.perf_counter()
+        counters = [(r, await Referrals.stats(r)) for r in owners]
+        scanned = sorted(
+            ((r, s["referees"], s["rewards"]) for r, s in counters if s["referees"]),
+            key=Referrals.rank_key, reverse=True,
+        )[:REFERRAL_LEADERBOARD_SIZE]
+        scan_elapsed = time.perf_counter() - started
+
+        bonuses = sum([await Ledger.balance(r) for r in owners])
+        await Notifier.stop(timeout=0)
+        await Ledger.close()
+        await DataManager.close()
+        AuditLog.stop()
+
+    print(f"referrers={referrers} referees={referees}")
+    print("  /start ref_<id>: " + " ".join(f"p{pct}={percentile(latencies, pct) * 1000:.2f}ms" for pct in (50, 95, 99)))
+    print(f"  bulk approval with bonuses: {settle_elapsed * 1000:.1f} ms for {len(items)} deposits")
+    print(f"  leaderboard query: {query_elapsed * 1e6:.1f} us (full scan of the counters: {scan_elapsed * 1000:.1f} ms)")
+    print(f"  bonuses credited: ${bonuses:.2f}")
+    assert leaders == scanned, "leaderboard differs from a full scan"
+    assert round(bonuses, 2) == round(referees * round(AMOUNT * REFERRAL_REWARD_RATE, 2), 2), "bonuses drifted"
+    print("OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--referrers", type=int, default=500)
+    parser.add_argument("--referees", type=int, default=20000)
+    args = parser.parse_args()
+    asyncio.run(run(args.referrers, args.referees))
@@ -0,0 +1,73 @@
+# benchmarks/shard_scaling.py
+"""
+Measure how update throughput scales with the number of shard processes.
+
+Each shard runs a stand-in application that spends --work-ms of CPU per
+update (roughly what JSON handling plus a handler costs), so the numbers
+show the routing/IPC overhead and the multi-core speed-up, not network time.
+
+    python -m benchmarks.shard_scaling --updates 20000 --shards 1 2 4
+"""
+import argparse
+import time
+
+from benchmarks.webhook_load import synthetic_update, TEXTS
+from sharding import ShardPool
+
+WORK_SECONDS = 0.001
+
+
+class BusyApplication:
+    """Stand-in for telegram.ext.Application that burns CPU instead of calling handlers"""
+    bot = None
+    post_init = None
+    post_shutdown = None
+
+    async def initialize(self):
+        pass
+
+    async def start(self):
+        pass
+
+    async def stop(self):
+        pass
+
+    async def shutdown(self):
+        pass
+
+    async def process_update(self, update):
+        deadline = time.perf_counter() + WORK_SECONDS
+        while time.perf_counter() < deadline:
+            pass
+
+
+def busy_application():
+    return BusyApplication()
+
+
+def measure(shards, updates, users):
+    pool = ShardPool(busy_application, shards, queue_size=4096, concurrency=4)
+    pool.start()
+    time.sleep(1.0)  # let the spawned interpreters finish importing before timing
+
+    started = time.perf_counter()
+    for i in range(updates):
+        pool.route(synthetic_update(100000 + i % users, TEXTS[i % len(TEXTS)]), block=True)
+    processed = pool.stop()
+    elapsed = time.perf_counter() - started
+    return elapsed, processed
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--updates", type=int, default=20000)
+    parser.add_argument("--users", type=int, default=1000)
+    parser.add_argument("--shards", type=int, nargs="+", default=[1, 2, 4])
+    args = parser.parse_args()
+
+    baseline = None
+    for shards in args.shards:
+        elapsed, processed = measure(shards, args.updates, args.users)
+        throughput = args.updates / elapsed
+        baseline = baseline or throughput
+        print(f"shards={shards}: {throughput:.0f} updates/s ({throughput / baseline:.2f}x), per shard {processed}")
@@ -0,0 +1,100 @@
+# benchmarks/startup.py
+"""
+Cold-start benchmark: launch `python main.py` in polling mode against the
+stub Bot API, with one /start already waiting, and time
+
+  polling  process launch -> first getUpdates call (bot accepts updates)
+  reply    process launch -> reply to that /start (time to first update)
+
+--deposits seeds the ledger beforehand so warm-up has real work to do.
+
+    python -m benchmarks.startup --runs 5 --deposits 20000
+"""
+import argparse
+import asyncio
+import os
+import signal
+import statistics
+import sys
+import tempfile
+import time
+
+from benchmarks.stub_bot_api import StubBotApi
+from benchmarks.webhook_load import synthetic_update
+
+REPO = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+
+async def seed(data_directory, deposits):
+    """Write `deposits` pending transactions to a ledger in data_directory (in this process)"""
+    from ledger import Ledger
+
+    Ledger.configure(os.path.join(data_directory, "ledger"))
+    for i in range(deposits):
+        txn = {"crypto": "Bitcoin", "txid": f"seed{i:08d}", "amount": 100, "status": "pending", "timestamp": ""}
+        await Ledger.append(str(700000 + i % 1000), txn)
+    await Ledger.close()
+
+
+async def wait_for(condition, timeout):
+    deadline = time.perf_counter() + timeout
+    while not condition():
+        if time.perf_counter() > deadline:
+            raise TimeoutError("bot did not get there in time")
+        await asyncio.sleep(0.002)
+    return time.perf_counter()
+
+
+async def launch(stub, tmp, timeout):
+    body = synthetic_update(100001, "/start")
+    body["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": 6}]
+    stub.updates = [body]
+    stub.calls.clear()
+    env = dict(
+        os.environ,
+        BOT_TOKEN="123456:stub",
+        BOT_API_URL=stub.base_url,
+        BOT_MODE="polling",
+        DATA_DIRECTORY=os.path.join(tmp, "user_data"),
+        AUDIT_DIRECTORY=os.path.join(tmp, "audit"),
+        LOG_LEVEL="WARNING",
+    )
+
+    started = time.perf_counter()
+    process = await asyncio.create_subprocess_exec(sys.executable, "main.py", cwd=REPO, env=env,
+                                                   stdout=asyncio.subprocess.DEVNULL)
+    try:
+        polling = await wait_for(lambda: stub.calls["getUpdates"] > 0, timeout)
+        replied = await wait_for(lambda: stub.calls["sendMessage"] > 0, timeout)
+    finally:
+        process.send_signal(signal.SIGINT)
+        await process.wait()
+    return polling - started, replied - started
+
+
+async def run(runs, deposits, timeout):
+    stub = StubBotApi()
+    await stub.start()
+    polling, replies = [], []
+    with tempfile.TemporaryDirectory() as tmp:
+        if deposits:
+            await seed(os.path.join(tmp, "user_data"), deposits)
+        for _ in range(runs):
+            first_poll, first_reply = await launch(stub, tmp, timeout)
+            polling.append(first_poll)
+            replies.append(first_reply)
+            print(f"  polling after {first_poll * 1000:.0f} ms, first reply after {first_reply * 1000:.0f} ms")
+    await stub.stop()
+
+    print(f"runs={runs} seeded deposits={deposits}")
+    print(f"  polling:     median {statistics.median(polling) * 1000:.0f} ms  min {min(polling) * 1000:.0f} ms")
+    print(f"  first reply: median {statistics.median(replies) * 1000:.0f} ms  min {min(replies) * 1000:.0f} ms")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--runs", type=int, default=5)
+    parser.add_argument("--deposits", type=int, default=0, help="ledger records to seed before the first run")
+    parser.add_argument("--timeout", type=float, default=60.0)
+    args = parser.parse_args()
+    asyncio.run(run(args.runs, args.deposits, args.timeout))
@@ -0,0 +1,74 @@
+# benchmarks/stress_approvals.py
+"""
+Fire concurrent approvals for the same pending deposits, in the current and
+the legacy callback formats, and check that every deposit is credited exactly once.
+
+    python -m benchmarks.stress_approvals --deposits 200 --admins 5
+"""
+import argparse
+import asyncio
+import os
+import tempfile
+import time
+
+from audit_log import AuditLog
+from benchmarks.fakes import FakeBot, make_callback_update, make_context
+from callback_codec import CallbackCodec
+from callback_handlers import CallbackHandlers
+from data_manager import DataManager
+from ledger import Ledger
+from pending_queue import PendingQueue
+from storage import create_store
+from config import ADMINS
+
+USER_ID = "424242"
+AMOUNT = 100
+
+
+async def seed(deposits):
+    for i in range(deposits):
+        txn = {"crypto": "Bitcoin", "txid": f"stress{i:08d}", "amount": AMOUNT, "status": "pending", "timestamp": ""}
+        await Ledger.append(USER_ID, txn)
+        await PendingQueue.add(USER_ID, txn)
+
+
+async def run(deposits, admins):
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store("json", tmp, os.path.join(tmp, "stress.db")))
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+        await seed(deposits)
+        bot = FakeBot(latency=0.001)
+
+        presses = []
+        for i in range(deposits):
+            txid = f"stress{i:08d}"
+            formats = [(await CallbackCodec.encode(USER_ID, txid, "approve"))["approve"], f"approve|{USER_ID}|{txid}", f"approve_{USER_ID}_{txid}"]
+            for admin in range(admins):
+                update = make_callback_update(ADMINS[admin % len(ADMINS)], formats[admin % len(formats)], bot)
+                presses.append(CallbackHandlers.handle_callback(update, make_context(bot)))
+
+        started = time.perf_counter()
+        await asyncio.gather(*presses)
+        elapsed = time.perf_counter() - started
+
+        approved = sum(1 for txn in await Ledger.transactions(USER_ID) if txn["status"] == "approved")
+        balance = await Ledger.balance(USER_ID)
+        await Ledger.close()
+        await DataManager.close()
+        AuditLog.stop()
+
+    expected = deposits * AMOUNT
+    print(f"{len(presses)} approval presses in {elapsed:.2f}s ({len(presses) / elapsed:.0f}/s)")
+    print(f"approved={approved}/{deposits} balance={balance} expected={expected} pending={await PendingQueue.count()}")
+    assert approved == deposits, "some deposits were not approved"
+    assert balance == expected, "balance drifted: lost update or double credit"
+    print("OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--deposits", type=int, default=200)
+    parser.add_argument("--admins", type=int, default=5)
+    args = parser.parse_args()
+    asyncio.run(run(args.deposits, args.admins))
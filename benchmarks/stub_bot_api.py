@@ -0,0 +1,112 @@
+# benchmarks/stub_bot_api.py
+"""
+A local stand-in for api.telegram.org so the real python-telegram-bot stack can be
+load-tested offline. Every method succeeds with a plausible result and is counted;
+getUpdates hands out whatever was put on `updates`.
+
+    python -m benchmarks.stub_bot_api --port 8081 --latency-ms 20
+    BOT_API_URL=http://127.0.0.1:8081/bot python main.py
+"""
+import argparse
+import asyncio
+import itertools
+import json
+import time
+from collections import Counter
+
+from aiohttp import web
+
+BOT_USER = {"id": 1, "is_bot": True, "first_name": "Stub", "username": "stub_bot",
+            "can_join_groups": False, "can_read_all_group_messages": False, "supports_inline_queries": False}
+
+
+class StubBotApi:
+    """Answers /bot<token>/<method> like the Bot API would, optionally after `latency` seconds"""
+
+    def __init__(self, host="127.0.0.1", port=0, latency=0.0):
+        self.host = host
+        self.port = port
+        self.latency = latency
+        self.calls = Counter()
+        self.sent_to = Counter()  # chat id -> sendMessage calls
+        self.updates = []  # update bodies waiting to be fetched with getUpdates
+        self.runner = None
+        self._message_ids = itertools.count(1)
+
+    @property
+    def base_url(self):
+        return f"http://{self.host}:{self.port}/bot"
+
+    def _message(self, params):
+        chat_id = int(params.get("chat_id") or 0)
+        message_id = int(params.get("message_id") or next(self._message_ids))
+        return {
+            "message_id": message_id,
+            "date": int(time.time()),
+            "chat": {"id": chat_id, "type": "private"},
+            "from": BOT_USER,
+            "text": params.get("text", ""),
+        }
+
+    async def handle(self, request):
+        method = request.match_info["method"]
+        self.calls[method] += 1
+        if request.content_type == "application/json":
+            params = await request.json()
+        else:
+            params = dict(await request.post())
+        if self.latency:
+            await asyncio.sleep(self.latency)
+
+        if method == "getMe":
+            result = BOT_USER
+        elif method == "getUpdates":
+            offset = int(params.get("offset") or 0)
+            self.updates = [body for body in self.updates if body["update_id"] >= offset]
+            if not self.updates:
+                # A short stand-in for long polling, so idle pollers don't spin
+                await asyncio.sleep(min(float(params.get("timeout") or 0), 0.05))
+            result = list(self.updates)
+        elif method in ("sendMessage", "editMessageText"):
+            result = self._message(params)
+            if method == "sendMessage":
+                self.sent_to[result["chat"]["id"]] += 1
+        else:
+            result = True
+        return web.json_response({"ok": True, "result": result}, dumps=json.dumps)
+
+    async def start(self):
+        app = web.Application()
+        app.router.add_post("/bot{token}/{method}", self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        site = web.TCPSite(self.runner, self.host, self.port)
+        await site.start()
+        if not self.port:
+            self.port = site._server.sockets[0].getsockname()[1]
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+async def serve(port, latency):
+    stub = StubBotApi(port=port, latency=latency)
+    await stub.start()
+    print(f"Stub Bot API listening on {stub.base_url}")
+    try:
+        await asyncio.Event().wait()
+    finally:
+        await stub.stop()
+        print(dict(stub.calls))
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--port", type=int, default=8081)
+    parser.add_argument("--latency-ms", type=float, default=0.0)
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.port, args.latency_ms / 1000))
+    except KeyboardInterrupt:
+        pass
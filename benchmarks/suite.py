@@ -0,0 +1,270 @@
+# benchmarks/suite.py
+"""
+End-to-end load test: the real Application from main.build_application(),
+talking to benchmarks/stub_bot_api.py instead of Telegram, fed synthetic
+Update JSON through Application.process_update.
+
+Scenarios:
+  menu_browsing   every user walks the menus (/start, top ups, balance, gift cards)
+  deposit_storm   every user opens a deposit method and submits --deposits TXIDs
+  approval_burst  the admins press Approve on every pending deposit at once
+
+For each one it reports throughput, p50/p95/p99 handler latency, Bot API
+calls and file writes/fsyncs per update, and saves everything as JSON so
+runs on different commits can be compared:
+
+    python -m benchmarks.suite --users 200 --output results.json
+    python -m benchmarks.suite --users 200 --baseline results.json
+"""
+import os
+import sys
+
+# Measure the handlers rather than flood control (benchmarks/flood.py covers that); set before config is read
+os.environ.setdefault("FLOOD_USER_RATE", "0")
+os.environ.setdefault("FLOOD_MAX_WAITING", str(sys.maxsize))
+
+import argparse
+import asyncio
+import datetime
+import itertools
+import json
+import platform
+import subprocess
+import tempfile
+import time
+
+from telegram import Update
+
+import config
+import main
+from audit_log import AuditLog
+from benchmarks.fakes import percentile
+from benchmarks.stub_bot_api import StubBotApi
+from benchmarks.webhook_load import synthetic_update
+from callback_codec import CallbackCodec
+from data_manager import DataManager
+from ledger import Ledger
+from metrics import configure_logging
+from notifier import Notifier
+from pending_queue import PendingQueue
+from storage import create_store
+
+STUB_TOKEN = "123456:stub"
+MENU_SCRIPT = ["/start", "💸 Balance Top Ups", "Available balance", "Back ↩️", "🎁 Gift Card", "Amazon", "Back ↩️"]
+DEPOSIT_METHOD = "Bitcoin (BTC) Deposit"
+_callback_ids = itertools.count(1)
+
+
+class DiskCounter:
+    """Counts files opened for writing, os.write calls and fsyncs anywhere in the process"""
+
+    def __init__(self):
+        self.writes = 0
+        self.fsyncs = 0
+
+    def install(self):
+        write_flags = os.O_WRONLY | os.O_RDWR | os.O_APPEND | os.O_CREAT
+
+        def audit(event, args):
+            if event == "open":
+                path, mode, flags = args
+                if isinstance(path, (str, bytes)) and (any(c in (mode or "") for c in "wax+") or flags & write_flags):
+                    self.writes += 1
+
+        real_write, real_fsync = os.write, os.fsync
+
+        def write(fd, data):
+            self.writes += 1
+            return real_write(fd, data)
+
+        def fsync(fd):
+            self.fsyncs += 1
+            return real_fsync(fd)
+
+        sys.addaudithook(audit)
+        os.write, os.fsync = write, fsync
+
+    def snapshot(self):
+        return self.writes, self.fsyncs
+
+
+def command_update(user_id, text):
+    body = synthetic_update(user_id, text)
+    command = text.split()[0]
+    body["message"]["entities"] = [{"type": "bot_command", "offset": 0, "length": len(command)}]
+    return body
+
+
+def text_update(user_id, text):
+    return command_update(user_id, text) if text.startswith("/") else synthetic_update(user_id, text)
+
+
+def callback_update(user_id, data):
+    body = synthetic_update(user_id, "🚨 New Transaction Submitted!")
+    return {
+        "update_id": body["update_id"],
+        "callback_query": {
+            "id": str(next(_callback_ids)),
+            "from": body["message"]["from"],
+            "chat_instance": "bench",
+            "data": data,
+            "message": body["message"],
+        },
+    }
+
+
+class Scenario:
+    """Runs per-user scripts of update bodies concurrently and collects the numbers"""
+
+    def __init__(self, application, stub, disk):
+        self.application = application
+        self.stub = stub
+        self.disk = disk
+
+    async def _feed(self, bodies, latencies, errors):
+        for body in bodies:
+            update = Update.de_json(body, self.application.bot)
+            started = time.perf_counter()
+            try:
+                await self.application.process_update(update)
+            except Exception:
+                errors.append(body["update_id"])
+            latencies.append(time.perf_counter() - started)
+
+    async def run(self, name, scripts):
+        latencies, errors = [], []
+        calls_before = sum(self.stub.calls.values())
+        writes_before, fsyncs_before = self.disk.snapshot()
+        started = time.perf_counter()
+        await asyncio.gather(*(self._feed(script, latencies, errors) for script in scripts))
+        elapsed = time.perf_counter() - started
+        writes, fsyncs = self.disk.snapshot()
+        updates = len(latencies)
+
+        result = {
+            "updates": updates,
+            "errors": len(errors),
+            "elapsed_s": round(elapsed, 4),
+            "throughput_per_s": round(updates / elapsed, 1) if elapsed else 0.0,
+            "latency_ms": {f"p{pct}": round(percentile(latencies, pct) * 1000, 3) for pct in (50, 95, 99)},
+            "bot_api_calls": sum(self.stub.calls.values()) - calls_before,
+            "file_writes_per_update": round((writes - writes_before) / max(updates, 1), 3),
+            "fsyncs_per_update": round((fsyncs - fsyncs_before) / max(updates, 1), 3),
+        }
+        latency = result["latency_ms"]
+        print(f"{name:15} updates={updates} errors={len(errors)} {result['throughput_per_s']}/s "
+              f"p50={latency['p50']}ms p95={latency['p95']}ms p99={latency['p99']}ms "
+              f"api={result['bot_api_calls']} writes/update={result['file_writes_per_update']} "
+              f"fsyncs/update={result['fsyncs_per_update']}")
+        return result
+
+
+def menu_scripts(users):
+    return [[text_update(100000 + u, text) for text in MENU_SCRIPT] for u in range(users)]
+
+
+def deposit_scripts(users, deposits):
+    scripts = []
+    for u in range(users):
+        user_id = 200000 + u
+        script = []
+        for d in range(deposits):
+            script.append(text_update(user_id, "💸 Balance Top Ups"))
+            script.append(text_update(user_id, DEPOSIT_METHOD))
+            script.append(text_update(user_id, f"benchtx{user_id}x{d:04d}"))
+            script.append(text_update(user_id, "Back ↩️"))
+        scripts.append(script)
+    return scripts
+
+
+async def approval_scripts():
+    """Spread Approve presses for every pending deposit over the admins"""
+    entries = await PendingQueue.select()
+    scripts = [[] for _ in config.ADMINS]
+    for i, entry in enumerate(entries):
+        data = (await CallbackCodec.encode(entry["user_id"], entry["txid"], "approve"))["approve"]
+        scripts[i % len(scripts)].append(callback_update(config.ADMINS[i % len(config.ADMINS)], data))
+    return scripts
+
+
+def git_commit():
+    try:
+        return subprocess.run(["git", "rev-parse", "HEAD"], capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(results, baseline_path):
+    with open(baseline_path, encoding="utf-8") as f:
+        baseline = json.load(f)
+    print(f"\nagainst {baseline_path} ({baseline.get('commit') or 'unknown commit'}):")
+    for name, current in results["scenarios"].items():
+        before = baseline.get("scenarios", {}).get(name)
+        if not before:
+            continue
+        throughput = (current["throughput_per_s"] / before["throughput_per_s"] - 1) * 100 if before["throughput_per_s"] else 0.0
+        p95 = (current["latency_ms"]["p95"] / before["latency_ms"]["p95"] - 1) * 100 if before["latency_ms"]["p95"] else 0.0
+        print(f"  {name:15} throughput {throughput:+.1f}%  p95 {p95:+.1f}%  "
+              f"fsyncs/update {before['fsyncs_per_update']} -> {current['fsyncs_per_update']}")
+
+
+async def run(args):
+    stub = StubBotApi(latency=args.api_latency_ms / 1000)
+    await stub.start()
+    disk = DiskCounter()
+    disk.install()
+
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store(args.backend, tmp, os.path.join(tmp, "suite.db")))
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+        config.BOT_API_URL = stub.base_url
+        main.BOT_TOKEN = main.BOT_TOKEN or STUB_TOKEN
+        application = main.build_application()
+
+        await application.initialize()
+        await application.post_init(application)
+        await application.start()
+        scenario = Scenario(application, stub, disk)
+        try:
+            scenarios = {
+                "menu_browsing": await scenario.run("menu_browsing", menu_scripts(args.users)),
+                "deposit_storm": await scenario.run("deposit_storm", deposit_scripts(args.users, args.deposits)),
+            }
+            scenarios["approval_burst"] = await scenario.run("approval_burst", await approval_scripts())
+            left = await PendingQueue.count()
+        finally:
+            await Notifier.stop(timeout=0)
+            await application.stop()
+            await application.shutdown()
+            await application.post_shutdown(application)
+        await stub.stop()
+
+    results = {
+        "commit": git_commit(),
+        "timestamp": datetime.datetime.now().isoformat(timespec="seconds"),
+        "python": platform.python_version(),
+        "params": {"users": args.users, "deposits": args.deposits, "backend": args.backend, "api_latency_ms": args.api_latency_ms},
+        "scenarios": scenarios,
+        "bot_api_calls": dict(stub.calls),
+    }
+    print(f"pending after approval burst: {left}")
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as f:
+            json.dump(results, f, indent=2)
+        print(f"results written to {args.output}")
+    if args.baseline:
+        compare(results, args.baseline)
+    return results
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--deposits", type=int, default=2, help="deposits submitted per user in deposit_storm")
+    parser.add_argument("--backend", choices=["json", "sqlite"], default="json")
+    parser.add_argument("--api-latency-ms", type=float, default=0.0, help="delay the stub adds to every Bot API call")
+    parser.add_argument("--output", help="write the results as JSON to this file")
+    parser.add_argument("--baseline", help="compare against a previous --output file")
+    configure_logging()
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,97 @@
+# benchmarks/verification_latency.py
+"""
+Submit deposits through MessageHandlers with the mock verification provider
+and measure how long each one waits until it is approved automatically.
+
+Half the payments are already confirmed when the TXID is submitted; the
+other half reach enough confirmations --confirm-after seconds later, so the
+polling backoff is part of the measurement.
+
+    python -m benchmarks.verification_latency --users 200 --confirm-after 0.5
+"""
+import os
+
+# Poll fast enough for a short run; must be set before the project modules read config
+os.environ.setdefault("VERIFY_POLL_INTERVAL", "0.05")
+os.environ.setdefault("VERIFY_MAX_BACKOFF", "0.4")
+
+import argparse
+import asyncio
+import tempfile
+import time
+
+from audit_log import AuditLog
+from benchmarks.fakes import FakeBot, make_text_update, make_context, percentile
+from catalog_manager import CatalogManager
+from data_manager import DataManager
+from ledger import Ledger
+from message_handlers import MessageHandlers
+from notifier import Notifier
+from pending_queue import PendingQueue
+from storage import create_store
+from verification import Verifier, MockProvider
+
+COIN = "Bitcoin"
+WALLET = "bc1qbenchwallet"
+AMOUNT = 100
+
+
+async def submit(user_id, bot, submitted):
+    txid = f"verify{user_id:08d}"
+    context = make_context(bot, {"expecting_tx": COIN})
+    await MessageHandlers.handle(make_text_update(user_id, txid, bot), context)
+    submitted[txid] = (str(user_id), time.perf_counter())
+
+
+async def run(users, confirm_after):
+    with tempfile.TemporaryDirectory() as tmp:
+        DataManager.use_store(create_store("json", tmp, os.path.join(tmp, "verify.db")))
+        Ledger.configure(os.path.join(tmp, "ledger"))
+        AuditLog.configure(os.path.join(tmp, "audit"))
+        provider = MockProvider(os.path.join(tmp, "mock_payments.json"))
+        Verifier.register(COIN, provider)
+        await CatalogManager.update(wallets={COIN: WALLET})
+        bot = FakeBot()
+        await Verifier.start(bot)
+
+        late = [f"verify{600000 + u:08d}" for u in range(users) if u % 2]
+        for u in range(0, users, 2):
+            provider.confirm(f"verify{600000 + u:08d}", AMOUNT, address=WALLET)
+
+        submitted = {}
+        started = time.perf_counter()
+        await asyncio.gather(*(submit(600000 + u, bot, submitted) for u in range(users)))
+        await asyncio.sleep(confirm_after)
+        for txid in late:
+            provider.confirm(txid, AMOUNT, address=WALLET)
+
+        waits = {}
+        while len(waits) < users and time.perf_counter() - started < 30 + confirm_after:
+            for txid, (user_id, at) in submitted.items():
+                if txid not in waits and (await Ledger.find(user_id, txid))["status"] == "approved":
+                    waits[txid] = time.perf_counter() - at
+            await asyncio.sleep(0.01)
+
+        balances = sum([await Ledger.balance(user_id) for user_id, _ in submitted.values()])
+        left = await PendingQueue.count()
+        await Verifier.stop()
+        await Notifier.stop(timeout=0)
+        await Ledger.close()
+        await DataManager.close()
+        AuditLog.stop()
+
+    early = [wait for txid, wait in waits.items() if txid not in late]
+    delayed = [wait for txid, wait in waits.items() if txid in late]
+    print(f"users={users} approved={len(waits)} still pending={left} credited=${balances:.2f}")
+    for name, samples in (("confirmed at submission", early), (f"confirmed after {confirm_after}s", delayed)):
+        print(f"  {name}: " + " ".join(f"p{pct}={percentile(samples, pct) * 1000:.1f}ms" for pct in (50, 95, 99)))
+    assert len(waits) == users and balances == users * AMOUNT, "not every deposit was approved exactly once"
+    print("OK")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument("--users", type=int, default=200)
+    parser.add_argument("--confirm-after", type=float, default=0.5)
+    args = parser.parse_args()
+    asyncio.run(run(args.users, args.confirm_after))
@@ -0,0 +1,106 @@
+# benchmarks/webhook_load.py
+"""
+POST synthetic Telegram Update JSON at a webhook endpoint and report throughput.
+
+Against a running bot (BOT_MODE=webhook):
+    python -m benchmarks.webhook_load --url http://127.0.0.1:8443/telegram --secret $WEBHOOK_SECRET
+
+Offline, against an in-process WebhookServer whose application just sleeps
+for --work-ms per update (measures the server and queueing alone):
+    python -m benchmarks.webhook_load --updates 20000 --concurrency 16
+"""
+import argparse
+import asyncio
+import itertools
+import time
+
+import aiohttp
+
+from benchmarks.fakes import percentile
+from webhook import WebhookServer, SECRET_HEADER
+
+TEXTS = ["💸 Balance Top Ups", "Available balance", "Back ↩️", "🎁 Gift Card", "Back ↩️"]
+_update_ids = itertools.count(1)
+
+
+def synthetic_update(user_id, text):
+    """Build the JSON body Telegram would POST for a private text message"""
+    update_id = next(_update_ids)
+    user = {"id": user_id, "is_bot": False, "first_name": "Load", "username": f"load{user_id}"}
+    return {
+        "update_id": update_id,
+        "message": {
+            "message_id": update_id,
+            "date": int(time.time()),
+            "chat": {"id": user_id, "type": "private", "first_name": "Load"},
+            "from": user,
+            "text": text,
+        },
+    }
+
+
+class SleepyApplication:
+    """Stand-in for telegram.ext.Application that only simulates handler work"""
+
+    def __init__(self, work_seconds):
+        self.bot = None
+        self.work_seconds = work_seconds
+        self.processed = 0
+
+    async def process_update(self, update):
+        await asyncio.sleep(self.work_seconds)
+        self.processed += 1
+
+
+async def post_updates(url, secret, updates, users, clients):
+    latencies = []
+    statuses = {}
+    headers = {SECRET_HEADER: secret} if secret else {}
+    bodies = iter(synthetic_update(100000 + i % users, TEXTS[i % len(TEXTS)]) for i in range(updates))
+
+    async with aiohttp.ClientSession(headers=headers) as session:
+        async def client():
+            for body in bodies:
+                started = time.perf_counter()
+                async with session.post(url, json=body) as response:
+                    statuses[response.status] = statuses.get(response.status, 0) + 1
+                latencies.append(time.perf_counter() - started)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(client() for _ in range(clients)))
+        elapsed = time.perf_counter() - started
+    return latencies, statuses, elapsed
+
+
+async def run(args):
+    server = None
+    url = args.url
+    if url is None:
+        application = SleepyApplication(args.work_ms / 1000)
+        server = WebhookServer(application, "127.0.0.1", args.port, "/telegram", args.secret, args.queue_size, args.concurrency)
+        await server.start()
+        url = f"http://127.0.0.1:{args.port}/telegram"
+
+    latencies, statuses, elapsed = await post_updates(url, args.secret, args.updates, args.users, args.clients)
+    if server is not None:
+        await server.stop()
+
+    print(f"POSTed {args.updates} updates in {elapsed:.2f}s ({args.updates / elapsed:.0f} req/s), statuses={statuses}")
+    for pct in (50, 95, 99):
+        print(f"  p{pct} accept latency: {percentile(latencies, pct) * 1000:.2f} ms")
+    if server is not None:
+        print(f"  processed={application.processed} rejected(503)={server.rejected}")
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument("--url", help="webhook URL of a running bot (default: start an in-process server)")
+    parser.add_argument("--secret", default=None)
+    parser.add_argument("--updates", type=int, default=10000)
+    parser.add_argument("--users", type=int, default=500)
+    parser.add_argument("--clients", type=int, default=64, help="concurrent HTTP connections")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--queue-size", type=int, default=1000)
+    parser.add_argument("--concurrency", type=int, default=16, help="in-process server workers")
+    parser.add_argument("--work-ms", type=float, default=2.0, help="simulated handler time per update")
+    asyncio.run(run(parser.parse_args()))
@@ -0,0 +1,123 @@
+# cache.py
+import asyncio
+import logging
+from collections import OrderedDict
+
+from storage import BaseStore
+
+logger = logging.getLogger(__name__)
+
+
+class CachedStore(BaseStore):
+    """
+    Write-back LRU cache in front of another store.
+
+    Reads are served from memory after the first miss, writes only mark the
+    document dirty, and a background task coalesces all dirty documents into
+    one write per key every flush_interval seconds.
+    """
+
+    def __init__(self, backend, max_entries=10000, flush_interval=2.0):
+        self.backend = backend
+        self.max_entries = max_entries
+        self.flush_interval = flush_interval
+        self._entries = OrderedDict()
+        self._dirty = set()
+        self._evicted = {}  # dirty documents pushed out of the LRU, waiting for the next flush
+        self._flush_lock = asyncio.Lock()
+        self._flusher = None
+        self.hits = 0
+        self.misses = 0
+
+    async def get(self, key):
+        if key in self._entries:
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return self._entries[key]
+        if key in self._evicted:
+            self.hits += 1
+            doc = self._evicted.pop(key)
+            self._dirty.add(key)
+            self._remember(key, doc)
+            return doc
+
+        self.misses += 1
+        doc = await self.backend.get(key)
+        # Another coroutine may have written the key while we were waiting on the backend
+        if key in self._entries:
+            return self._entries[key]
+        if doc is not None:
+            self._remember(key, doc)
+        return doc
+
+    async def put(self, key, doc):
+        self._evicted.pop(key, None)
+        self._remember(key, doc)
+        self._dirty.add(key)
+        self._ensure_flusher()
+
+    async def delete(self, key):
+        self._entries.pop(key, None)
+        self._evicted.pop(key, None)
+        self._dirty.discard(key)
+        await self.backend.delete(key)
+
+    async def keys(self, prefix=""):
+        keys = set(await self.backend.keys(prefix))
+        keys.update(k for k in self._dirty if k.startswith(prefix))
+        keys.update(k for k in self._evicted if k.startswith(prefix))
+        return sorted(keys)
+
+    def _remember(self, key, doc):
+        self._entries[key] = doc
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.max_entries:
+            old_key, old_doc = self._entries.popitem(last=False)
+            if old_key in self._dirty:
+                self._dirty.discard(old_key)
+                self._evicted[old_key] = old_doc
+
+    def _ensure_flusher(self):
+        if self._flusher is None or self._flusher.done():
+            self._flusher = asyncio.get_running_loop().create_task(self._flush_loop())
+
+    async def _flush_loop(self):
+        while self._dirty or self._evicted:
+            await asyncio.sleep(self.flush_interval)
+            # Shielded so close() cancelling the loop never abandons a half-written batch
+            await asyncio.shield(self.flush())
+
+    async def flush(self):
+        """Write every dirty document to the backend"""
+        async with self._flush_lock:
+            pending = {key: self._entries[key] for key in self._dirty if key in self._entries}
+            pending.update(self._evicted)
+            self._dirty.clear()
+            self._evicted.clear()
+            if not pending:
+                return
+
+            results = await asyncio.gather(
+                *(self.backend.put(key, doc) for key, doc in pending.items()),
+                return_exceptions=True,
+            )
+            for (key, doc), result in zip(pending.items(), results):
+                if isinstance(result, Exception):
+                    logger.error(f"Failed to flush {key}: {result}")
+                    # Keep it dirty so the next flush retries it
+                    if key in self._entries:
+                        self._dirty.add(key)
+                    else:
+                        self._evicted[key] = doc
+
+    async def close(self):
+        """Stop the background flusher and force a final flush"""
+        if self._flusher is not None:
+            self._flusher.cancel()
+            try:
+                await self._flusher
+            except asyncio.CancelledError:
+                pass
+            self._flusher = None
+        await self.flush()
+        await self.backend.close()
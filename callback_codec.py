@@ -0,0 +1,176 @@
+# callback_codec.py
+import base64
+import hashlib
+import heapq
+import secrets
+import time
+
+from config import CALLBACK_TOKEN_TTL
+from data_manager import DataManager
+from shards import Shards
+
+VERSION = "1"
+META_KEY = "cbtok_meta"
+
+# Tokens are keyed, so nobody can derive the token of a transaction; a new key per
+# process only means buttons sent after a restart get a new registry entry
+_KEY = secrets.token_bytes(32)
+
+# action -> single-letter code used in version 1 callback data
+ACTION_CODES = {
+    "approve": "a",
+    "reject": "r",
+    "note": "n",
+    "cancel_note": "c",
+}
+CODE_ACTIONS = {code: action for action, code in ACTION_CODES.items()}
+
+# Matches every format handle_callback decodes: version 1 plus the pre-codec buttons still in admins' chats
+CALLBACK_PATTERN = r"^(1\||(approve|reject|note)[|_]|cancel_note_)"
+
+
+def _token(user_id, txid):
+    """12-character handle derived from the transaction, so every button for it shares one registry entry"""
+    digest = hashlib.blake2b(f"{user_id}:{txid}".encode("utf-8"), digest_size=9, key=_KEY).digest()
+    return base64.urlsafe_b64encode(digest).decode("ascii")
+
+
+class CallbackTokens:
+    """
+    Registry of opaque transaction handles: token -> (user_id, txid).
+
+    Entries are spread over store documents by the token's first character
+    and cached in memory once read, so issue and resolve are a dict lookup.
+    Each entry lives CALLBACK_TOKEN_TTL seconds after it was last issued;
+    expired entries are dropped when met on lookup, when their bucket is
+    loaded, and from the top of a heap of expiry times on every issue.
+    When sharded, the registry lives on the coordinator shard.
+    """
+    _buckets = {}            # store key -> {token: [user_id, txid, expires]}
+    _expiry = []             # heap of (expires, token); re-issues leave stale pairs that eviction skips
+    _legacy_until = None     # epoch after which pre-codec buttons are no longer accepted
+
+    @staticmethod
+    def _bucket_key(token):
+        return f"cbtok_{ord(token[0]):02x}"
+
+    @staticmethod
+    async def _bucket(key):
+        bucket = CallbackTokens._buckets.get(key)
+        if bucket is None:
+            doc = await DataManager.store().get(key) or {}
+            now = time.time()
+            live = {token: entry for token, entry in doc.items() if entry[2] > now}
+            # A concurrent caller may have loaded the same bucket while we were waiting
+            bucket = CallbackTokens._buckets.setdefault(key, live)
+            if bucket is live:
+                # Loaded buckets can hold entries that expire before ones already issued, hence a heap
+                for token, entry in live.items():
+                    heapq.heappush(CallbackTokens._expiry, (entry[2], token))
+                if len(live) < len(doc):
+                    await DataManager.store().put(key, bucket)
+        return bucket
+
+    @staticmethod
+    async def _evict(now):
+        dirty = set()
+        expiry = CallbackTokens._expiry
+        while expiry and expiry[0][0] <= now:
+            expires, token = heapq.heappop(expiry)
+            key = CallbackTokens._bucket_key(token)
+            bucket = CallbackTokens._buckets.get(key, {})
+            # Only drop the entry if it wasn't re-issued since this pair was pushed
+            entry = bucket.get(token)
+            if entry is not None and entry[2] <= expires:
+                del bucket[token]
+                dirty.add(key)
+        for key in dirty:
+            await DataManager.store().put(key, CallbackTokens._buckets[key])
+
+    @staticmethod
+    async def issue(user_id, txid):
+        """Return the token for a transaction, registering it or extending its lifetime"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("callback_tokens.issue", user_id, txid)
+        token = _token(user_id, txid)
+        key = CallbackTokens._bucket_key(token)
+        bucket = await CallbackTokens._bucket(key)
+        now = time.time()
+        expires = now + CALLBACK_TOKEN_TTL
+        bucket[token] = [str(user_id), txid, expires]
+        heapq.heappush(CallbackTokens._expiry, (expires, token))
+        await DataManager.store().put(key, bucket)
+        await CallbackTokens._evict(now)
+        return token
+
+    @staticmethod
+    async def resolve(token):
+        """(user_id, txid) for a token, or None if it is unknown or expired"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("callback_tokens.resolve", token)
+        entry = (await CallbackTokens._bucket(CallbackTokens._bucket_key(token))).get(token)
+        if entry is None or entry[2] <= time.time():
+            return None
+        return entry[0], entry[1]
+
+    @staticmethod
+    async def legacy_accepted():
+        """
+        True while buttons sent before the codec could still be live: for
+        CALLBACK_TOKEN_TTL after the first start that used the codec.
+        """
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("callback_tokens.legacy_accepted")
+        if CallbackTokens._legacy_until is None:
+            doc = await DataManager.store().get(META_KEY)
+            if doc is None:
+                doc = {"legacy_until": time.time() + CALLBACK_TOKEN_TTL}
+                await DataManager.store().put(META_KEY, doc)
+            CallbackTokens._legacy_until = doc["legacy_until"]
+        return time.time() < CallbackTokens._legacy_until
+
+
+class CallbackCodec:
+    """
+    Inline button payloads. Version 1 is "1|<action code>|<token>" (16 bytes
+    for any TXID length); the token is resolved through CallbackTokens.
+    The older formats (approve|uid|txid, note_uid_txid, cancel_note_uid_txid)
+    embed the TXID directly; they are decoded only until buttons sent with
+    them would have expired (see CallbackTokens.legacy_accepted).
+    """
+
+    @staticmethod
+    async def encode(user_id, txid, *actions):
+        """{action: callback_data} for buttons acting on one transaction (a single registry write)"""
+        token = await CallbackTokens.issue(user_id, txid)
+        return {action: f"{VERSION}|{ACTION_CODES[action]}|{token}" for action in actions}
+
+    @staticmethod
+    async def decode(data):
+        """(action, user_id, txid), or None for malformed data and expired or unknown tokens"""
+        if data.startswith(f"{VERSION}|"):
+            parts = data.split("|")
+            if len(parts) != 3 or parts[1] not in CODE_ACTIONS:
+                return None
+            target = await CallbackTokens.resolve(parts[2])
+            return (CODE_ACTIONS[parts[1]], *target) if target else None
+        if not await CallbackTokens.legacy_accepted():
+            return None
+        return CallbackCodec._decode_legacy(data)
+
+    @staticmethod
+    def _decode_legacy(data):
+        if data.startswith("cancel_note_"):
+            action, rest = "cancel_note", data[len("cancel_note_"):].split("_", 1)
+        elif "|" in data:
+            action, *rest = data.split("|")[:3]
+        else:
+            action, *rest = data.split("_", 2)  # TXIDs may contain underscores, user ids can't
+        if action not in ACTION_CODES or len(rest) != 2 or not rest[0].isdigit():
+            return None
+        return action, rest[0], rest[1]
+
+
+Shards.register("callback_tokens.issue", CallbackTokens.issue)
+Shards.register("callback_tokens.resolve", CallbackTokens.resolve)
+Shards.register("callback_tokens.legacy_accepted", CallbackTokens.legacy_accepted)
@@ -2,13 +2,19 @@
 from telegram import Update, InlineKeyboardMarkup, InlineKeyboardButton
 from telegram.ext import ContextTypes
 from data_manager import DataManager
-from datetime import datetime
+from ledger import Ledger
+from pending_queue import PendingQueue
+from notifier import Notifier
+from shards import Shards
+from callback_codec import CallbackCodec
+from referrals import Referrals
+from purchases import Purchases
 from config import ADMINS  # Import admin list for notifications
 from enum import Enum
+import asyncio
+import html
 import logging
 
-# Configure logging
-logging.basicConfig(format='%(asctime)s - %(name)s - %(levelname)s - %(message)s', level=logging.INFO)
 logger = logging.getLogger(__name__)
 
 class TransactionStatus(Enum):
@@ -25,81 +31,130 @@ class CallbackAction(Enum):
 class CallbackHandlers:
     @staticmethod
     async def handle_callback(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Every transaction button: decode the payload (see CallbackCodec) and dispatch on its action"""
         query = update.callback_query
         await query.answer()
-        
-        # Parse callback data
-        callback_parts = query.data.split("_", 2)  # Split only on first two underscores
-        
-        if len(callback_parts) < 2:
-            await query.edit_message_text("⚠️ Invalid callback data format")
-            return
-            
-        action = callback_parts[0]
-        
-        # Handle cancel note action separately as it has a different format
-        if action == CallbackAction.CANCEL_NOTE.value:
-            return await CallbackHandlers._handle_cancel_note(query, context)
-            
-        if len(callback_parts) != 3:
-            await query.edit_message_text("⚠️ Invalid callback data")
-            return
-            
-        user_id = callback_parts[1]
-        txid = callback_parts[2]  # Keep txid intact with any underscores it might contain
-        
-        # Load data
-        try:
-            data = DataManager.load()
-        except Exception as e:
-            logger.error(f"Failed to load data: {e}")
-            await query.edit_message_text("⚠️ Error loading transaction data")
-            return
-            
-        # Get transaction
-        transaction = CallbackHandlers._get_transaction(data, user_id, txid)
-        if not transaction:
-            await query.edit_message_text("⚠️ Transaction not found!")
+        # Every transaction button is an admin action; the alerts only go to admins, but anyone can send callback data
+        if query.from_user.id not in ADMINS:
             return
-            
-        # Check transaction status
-        if transaction["status"] != TransactionStatus.PENDING.value:
-            await query.edit_message_text(f"⚠️ Transaction already {transaction['status']}")
+
+        decoded = await CallbackCodec.decode(query.data)
+        if decoded is None:
+            await query.edit_message_text("⚠️ This button has expired or is invalid")
             return
-            
-        # Handle different actions
+        action, user_id, txid = decoded
+        handler = CALLBACK_ACTIONS[action]
+
+        # Approve/reject check the status atomically in settle_transaction, so no separate lookup here
         try:
-            if action == CallbackAction.APPROVE.value:
-                await CallbackHandlers._handle_approval(query, context, data, user_id, txid, transaction)
-            elif action == CallbackAction.REJECT.value:
-                await CallbackHandlers._handle_rejection(query, context, data, user_id, txid, transaction)
-            elif action == CallbackAction.NOTE.value:
-                await CallbackHandlers._handle_note_request(query, context, user_id, txid)
-            else:
-                await query.edit_message_text("⚠️ Unknown action")
+            await handler(query, context, user_id, txid)
         except Exception as e:
             logger.error(f"Error processing callback: {e}")
             await query.edit_message_text("⚠️ An error occurred while processing the request")
 
     @staticmethod
-    def _get_transaction(data, user_id, txid):
-        """Helper method to find a transaction by user_id and txid"""
-        user_data = data['balances'].get(user_id, {"transactions": []})
-        return next((t for t in user_data.get("transactions", []) if t["txid"] == txid), None)
+    async def handle_purchase(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """Buy/Cancel under a product offer (callback data: buy|ok|<item> or buy|no|<item>, see Inventory.item)"""
+        query = update.callback_query
+        await query.answer()
+        _, action, item = query.data.split("|", 2)
+        user_id = str(query.from_user.id)
+        if action == "no":
+            return await query.edit_message_text("❌ Purchase cancelled.")
+
+        # A code is only reserved once the user confirms, so browsing the offers never takes stock off sale
+        try:
+            result, order = await Purchases.buy(user_id, item)
+        except Exception as e:
+            logger.error(f"Error processing purchase of {item} for {user_id}: {e}")
+            return await query.edit_message_text("⚠️ An error occurred while processing your purchase")
+
+        if result == "sold_out":
+            await query.edit_message_text("😔 Sorry, this product just sold out. Please check back later.")
+        elif result == "expired":
+            await query.edit_message_text("⌛ This reservation has expired. Please choose the product again.")
+        elif result == "insufficient":
+            await query.edit_message_text(
+                f"❌ Insufficient balance (${order['balance']:.2f}).\n"
+                "Top up from 💸 Balance Top Ups and try again."
+            )
+        else:
+            await query.edit_message_text(
+                f"✅ Purchase complete!\n"
+                f"• {html.escape(order['product'])}: <code>{html.escape(order['code'])}</code>\n"
+                f"• Paid: ${order['price']:.2f}\n"
+                f"• New balance: ${order['balance']:.2f}",
+                parse_mode="HTML"
+            )
+
+    @staticmethod
+    async def find_transaction(user_id, txid):
+        """Read a transaction from the ledger, asking the owning shard if it is not local"""
+        if not Shards.is_local(user_id):
+            return await Shards.call_owner(user_id, "callbacks.find_transaction", user_id, txid)
+        return await Ledger.find(user_id, txid)
+
+    @staticmethod
+    async def settle_transaction(user_id, txid, status):
+        """
+        Atomically move a pending transaction to approved/rejected, crediting the
+        balance (and the referrer's bonus) on approval. Returns (transaction,
+        balance, settled); settled is False when the transaction is missing or
+        was already processed.
+        """
+        if not Shards.is_local(user_id):
+            return await Shards.call_owner(user_id, "callbacks.settle_transaction", user_id, txid, status)
+        transaction, balance, settled = await Ledger.settle(user_id, txid, status.value)
+        if not settled:
+            return transaction, balance, False
+
+        await PendingQueue.remove(txid)
+        DataManager.log_transaction(f"Transaction {status.value.capitalize()}", user_id, txid, transaction["amount"], status.value)
+        if status == TransactionStatus.APPROVED:
+            await Referrals.reward([(user_id, txid, transaction["amount"])])
+        return transaction, balance, True
 
     @staticmethod
-    async def _handle_approval(query, context, data, user_id, txid, transaction):
+    async def settle_many(items, status):
+        """
+        settle_transaction() for a list of (user_id, txid) pairs: one ledger append
+        per shard and one pending-queue write. Returns one (transaction, balance,
+        settled) triple per pair, in order.
+        """
+        by_shard = {}
+        for position, (user_id, _) in enumerate(items):
+            by_shard.setdefault(Shards.owner(user_id), []).append(position)
+        replies = await asyncio.gather(*(
+            Shards.call(shard, "callbacks.settle_local", [items[i] for i in positions], status.value)
+            for shard, positions in by_shard.items()
+        ))
+
+        results = [None] * len(items)
+        for positions, reply in zip(by_shard.values(), replies):
+            for position, result in zip(positions, reply):
+                results[position] = result
+        await PendingQueue.remove_many([txid for (_, txid), (_, _, settled) in zip(items, results) if settled])
+        return results
+
+    @staticmethod
+    async def settle_local(items, status):
+        """Settle pairs owned by this shard in one ledger append (see settle_many)"""
+        results = await Ledger.settle_many(items, status)
+        approved = []
+        for (user_id, txid), (transaction, _, settled) in zip(items, results):
+            if settled:
+                DataManager.log_transaction(f"Transaction {status.capitalize()}", user_id, txid, transaction["amount"], status)
+                approved.append((user_id, txid, transaction["amount"]))
+        if status == TransactionStatus.APPROVED.value:
+            await Referrals.reward(approved)
+        return results
+
+    @staticmethod
+    async def _handle_approval(query, context, user_id, txid):
         """Handle transaction approval"""
-        # Update transaction
-        transaction["status"] = TransactionStatus.APPROVED.value
-        transaction["processed_at"] = datetime.now().isoformat()
-        
-        # Update user balance
-        user_data = data['balances'].setdefault(user_id, {"transactions": [], "total_confirmed": 0})
-        user_data["total_confirmed"] += transaction["amount"]
-        
-        # Save data
-        DataManager.save(data)
+        transaction, balance, settled = await CallbackHandlers.settle_transaction(user_id, txid, TransactionStatus.APPROVED)
+        if not settled:
+            return await CallbackHandlers._report_unsettled(query, transaction)
         
         # Update admin message
         await query.edit_message_text(
@@ -108,28 +163,28 @@ class CallbackHandlers:
             f"• User: {user_id}\n"
             f"• TXID: {txid[:10]}...",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📝 Add Note", callback_data=f"note_{user_id}_{txid}")]
+                [InlineKeyboardButton("📝 Add Note", callback_data=(await CallbackCodec.encode(user_id, txid, "note"))["note"])]
             ])
         )
         
         # Notify user
-        await CallbackHandlers._notify_user(
-            context, 
-            user_id, 
+        await CallbackHandlers._notify_user(context, user_id, CallbackHandlers._approval_notice(transaction, balance))
+
+    @staticmethod
+    def _approval_notice(transaction, balance):
+        """Message telling a user their deposit was credited (manual, bulk and automatic approvals)"""
+        return (
             f"🎉 Your transaction has been approved!\n"
             f"• Amount: ${transaction['amount']}\n"
-            f"• New balance: ${user_data['total_confirmed']:.2f}"
+            f"• New balance: ${balance:.2f}"
         )
 
     @staticmethod
-    async def _handle_rejection(query, context, data, user_id, txid, transaction):
+    async def _handle_rejection(query, context, user_id, txid):
         """Handle transaction rejection"""
-        # Update transaction
-        transaction["status"] = TransactionStatus.REJECTED.value
-        transaction["processed_at"] = datetime.now().isoformat()
-        
-        # Save data
-        DataManager.save(data)
+        transaction, _, settled = await CallbackHandlers.settle_transaction(user_id, txid, TransactionStatus.REJECTED)
+        if not settled:
+            return await CallbackHandlers._report_unsettled(query, transaction)
         
         # Update admin message
         await query.edit_message_text(
@@ -138,7 +193,7 @@ class CallbackHandlers:
             f"• User: {user_id}\n"
             f"• TXID: {txid[:10]}...",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("📝 Add Reason", callback_data=f"note_{user_id}_{txid}")]
+                [InlineKeyboardButton("📝 Add Reason", callback_data=(await CallbackCodec.encode(user_id, txid, "note"))["note"])]
             ])
         )
         
@@ -150,19 +205,30 @@ class CallbackHandlers:
             "Please contact support if you believe this was a mistake."
         )
 
+    @staticmethod
+    async def _report_unsettled(query, transaction):
+        """Tell the admin why a decision was not applied (lost a race with another admin, or stale button)"""
+        if not transaction:
+            await query.edit_message_text("⚠️ Transaction not found!")
+        else:
+            await query.edit_message_text(f"⚠️ Transaction already {transaction['status']}")
+
     @staticmethod
     async def _handle_note_request(query, context, user_id, txid):
         """Handle request to add a note to a transaction"""
+        if not await CallbackHandlers.find_transaction(user_id, txid):
+            await query.edit_message_text("⚠️ Transaction not found!")
+            return
         context.user_data['awaiting_note_for'] = f"{user_id}_{txid}"
         await query.edit_message_text(
             "✏️ Please reply with your note for this transaction:",
             reply_markup=InlineKeyboardMarkup([
-                [InlineKeyboardButton("Cancel", callback_data=f"cancel_note_{user_id}_{txid}")]
+                [InlineKeyboardButton("Cancel", callback_data=(await CallbackCodec.encode(user_id, txid, "cancel_note"))["cancel_note"])]
             ])
         )
 
     @staticmethod
-    async def _handle_cancel_note(query, context):
+    async def _handle_cancel_note(query, context, user_id, txid):
         """Handle cancellation of note addition"""
         if 'awaiting_note_for' in context.user_data:
             del context.user_data['awaiting_note_for']
@@ -170,11 +236,21 @@ class CallbackHandlers:
 
     @staticmethod
     async def _notify_user(context, user_id, message):
-        """Helper method to notify a user with error handling"""
-        try:
-            await context.bot.send_message(chat_id=user_id, text=message)
-        except Exception as e:
-            logger.error(f"Failed to notify user {user_id}: {e}")
+        """Queue a notification for a user; delivery, retries and rate limits are handled by the Notifier"""
+        Notifier.send(context.bot, user_id, message)
+
+    @staticmethod
+    async def add_note(user_id, txid, note):
+        """Attach an admin note to a transaction; returns the transaction or None if it doesn't exist"""
+        if not Shards.is_local(user_id):
+            return await Shards.call_owner(user_id, "callbacks.add_note", user_id, txid, note)
+        transaction = await Ledger.find(user_id, txid)
+        if transaction:
+            # Notes are free text, so they live in the user's record rather than the fixed-width ledger
+            async with DataManager.transaction(user_id) as data:
+                data.setdefault("notes", {})[txid] = note
+            transaction["admin_note"] = note
+        return transaction
 
     @staticmethod
     async def handle_note_reply(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -192,19 +268,10 @@ class CallbackHandlers:
         note = update.message.text
         
         try:
-            # Load data
-            data = DataManager.load()
-            
-            # Find transaction
-            transaction = CallbackHandlers._get_transaction(data, user_id, txid)
+            transaction = await CallbackHandlers.add_note(user_id, txid, note)
             if not transaction:
                 await update.message.reply_text("⚠️ Transaction not found")
-                del context.user_data['awaiting_note_for']
                 return
-                
-            # Add note
-            transaction["admin_note"] = note
-            DataManager.save(data)
             
             # Notify user if transaction was already processed
             if transaction["status"] in (TransactionStatus.APPROVED.value, TransactionStatus.REJECTED.value):
@@ -221,4 +288,18 @@ class CallbackHandlers:
             logger.error(f"Error adding note: {e}")
             await update.message.reply_text("⚠️ Error adding note")
         finally:
-            del context.user_data['awaiting_note_for']
\ No newline at end of file
+            del context.user_data['awaiting_note_for']
+
+
+# Callback action prefix -> handler(query, context, user_id, txid)
+CALLBACK_ACTIONS = {
+    CallbackAction.APPROVE.value: CallbackHandlers._handle_approval,
+    CallbackAction.REJECT.value: CallbackHandlers._handle_rejection,
+    CallbackAction.NOTE.value: CallbackHandlers._handle_note_request,
+    CallbackAction.CANCEL_NOTE.value: CallbackHandlers._handle_cancel_note,
+}
+
+Shards.register("callbacks.find_transaction", CallbackHandlers.find_transaction)
+Shards.register("callbacks.settle_transaction", CallbackHandlers.settle_transaction)
+Shards.register("callbacks.add_note", CallbackHandlers.add_note)
+Shards.register("callbacks.settle_local", CallbackHandlers.settle_local)
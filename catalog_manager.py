@@ -0,0 +1,155 @@
+# catalog_manager.py
+import asyncio
+import json
+import os
+from dataclasses import dataclass, replace, asdict
+from types import MappingProxyType
+
+from data_manager import DataManager
+from shards import Shards
+
+CATALOG_KEY = "catalog"
+LEGACY_DATA_FILE = "data.json"  # Pre-split global data file, used to seed the catalog once
+
+DEFAULT_CATALOG = {
+    "giftcards": ["Amazon", "Google"],
+    "services": ["Netflix", "Prime Video"],
+    "topups": [
+        "Bitcoin (BTC) Deposit",
+        "Ethereum (ETH) Deposit",
+        "USDT (TRC20) Deposit",
+        "Litecoin (LTC) Deposit",
+        "Tron (TRX) Deposit",
+        "Cash App Deposit"
+    ],
+    "wallets": {},
+    "main_menu": [
+        ["🎁 Gift Card", "🏷️ Apply Coupon"],
+        ["💸 Balance Top Ups", "👥 Referrals"],
+        ["🎬 Streaming Service"]
+    ]
+}
+
+
+@dataclass(frozen=True)
+class CatalogSnapshot:
+    """Immutable view of the global catalog. Admin edits build a new snapshot with a bumped version."""
+    version: int
+    giftcards: tuple
+    services: tuple
+    topups: tuple
+    wallets: MappingProxyType
+    main_menu: tuple
+
+    @staticmethod
+    def from_doc(doc):
+        return CatalogSnapshot(
+            version=doc.get("version", 1),
+            giftcards=tuple(doc.get("giftcards", ())),
+            services=tuple(doc.get("services", ())),
+            topups=tuple(doc.get("topups", ())),
+            wallets=MappingProxyType(dict(doc.get("wallets", {}))),
+            main_menu=tuple(tuple(row) for row in doc.get("main_menu", ())),
+        )
+
+    def to_doc(self):
+        doc = asdict(replace(self, wallets={}))
+        doc["wallets"] = dict(self.wallets)
+        return json.loads(json.dumps(doc))  # tuples -> lists
+
+
+class CatalogManager:
+    _snapshot = None
+    _lock = asyncio.Lock()  # serializes admin edits and the first load; readers of a loaded snapshot never wait
+
+    @staticmethod
+    async def get():
+        """Return the current catalog snapshot, loading it on first use"""
+        if CatalogManager._snapshot is None:
+            async with CatalogManager._lock:
+                if CatalogManager._snapshot is None:
+                    await CatalogManager.load()
+        return CatalogManager._snapshot
+
+    @staticmethod
+    async def load():
+        if not Shards.is_coordinator():
+            return CatalogManager.install(await Shards.call_coordinator("catalog.doc"))
+        doc = await DataManager.store().get(CATALOG_KEY)
+        if doc is None:
+            doc = CatalogManager._seed()
+            await DataManager.store().put(CATALOG_KEY, doc)
+        CatalogManager._snapshot = CatalogSnapshot.from_doc(doc)
+        return CatalogManager._snapshot
+
+    @staticmethod
+    async def doc():
+        """Serializable form of the current snapshot (what other shards load)"""
+        return (await CatalogManager.get()).to_doc()
+
+    @staticmethod
+    def install(doc):
+        """Replace the local snapshot with one published by the coordinator shard"""
+        CatalogManager._snapshot = CatalogSnapshot.from_doc(doc)
+        return CatalogManager._snapshot
+
+    @staticmethod
+    def _seed():
+        """Build the first catalog from the defaults plus anything in the legacy data.json"""
+        doc = json.loads(json.dumps(DEFAULT_CATALOG))
+        if os.path.exists(LEGACY_DATA_FILE):
+            with open(LEGACY_DATA_FILE, "r", encoding="utf-8") as f:
+                legacy = json.load(f)
+            for field in DEFAULT_CATALOG:
+                if field in legacy:
+                    doc[field] = legacy[field]
+        doc["version"] = 1
+        return doc
+
+    @staticmethod
+    async def update(**changes):
+        """Persist a new snapshot with the given fields replaced and swap it in atomically"""
+        if not Shards.is_coordinator():
+            return CatalogManager.install(await Shards.call_coordinator("catalog.update", changes))
+        async with CatalogManager._lock:
+            return await CatalogManager._swap(CatalogManager._snapshot or await CatalogManager.load(), changes)
+
+    @staticmethod
+    async def add_item(field, item):
+        """Append an item to one of the catalog lists (giftcards, services, topups)"""
+        if not Shards.is_coordinator():
+            return CatalogManager.install(await Shards.call_coordinator("catalog.add_item", field, item))
+        async with CatalogManager._lock:
+            current = CatalogManager._snapshot or await CatalogManager.load()
+            if item in getattr(current, field):
+                return current
+            return await CatalogManager._swap(current, {field: getattr(current, field) + (item,)})
+
+    @staticmethod
+    async def _swap(current, changes):
+        if "wallets" in changes:
+            changes["wallets"] = MappingProxyType(dict(changes["wallets"]))
+        updated = replace(current, version=current.version + 1, **changes)
+        await DataManager.store().put(CATALOG_KEY, updated.to_doc())
+        CatalogManager._snapshot = updated
+        if Shards.count > 1:
+            await Shards.gather("catalog.install", updated.to_doc())
+        return updated
+
+
+async def _install_remote(doc):
+    CatalogManager.install(doc)
+
+
+async def _update_remote(changes):
+    return (await CatalogManager.update(**changes)).to_doc()
+
+
+async def _add_item_remote(field, item):
+    return (await CatalogManager.add_item(field, item)).to_doc()
+
+
+Shards.register("catalog.doc", CatalogManager.doc)
+Shards.register("catalog.install", _install_remote)
+Shards.register("catalog.update", _update_remote)
+Shards.register("catalog.add_item", _add_item_remote)
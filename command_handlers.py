@@ -1,10 +1,24 @@
 # command_handlers.py
-from telegram import Update, ReplyKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from data_manager import DataManager
+from catalog_manager import CatalogManager
+from pending_queue import PendingQueue
+from callback_handlers import CallbackHandlers, TransactionStatus
+from notifier import Notifier
+from audit_log import AuditLog
+from reconciliation import Reconciler
 from menu_manager import MenuManager
-from config import ADMINS
-from telegram import ReplyKeyboardMarkup
+from ledger import Ledger
+from referrals import Referrals
+from coupons import Coupons
+from inventory import Inventory
+from config import ADMINS, PENDING_PAGE_SIZE
+import io
+import time
+
+# Most coupons one /addcoupons may create
+MAX_COUPON_BATCH = 10000
 
 
 
@@ -12,18 +26,27 @@ class CommandHandlers:
     @staticmethod
     async def start(update: Update, context: ContextTypes.DEFAULT_TYPE):
         context.user_data['menu'] = 'main'
-        data = DataManager.load()
-        await update.message.reply_text("👋 Welcome!", reply_markup=ReplyKeyboardMarkup(MenuManager.main_menu(data), resize_keyboard=True))
+        referrer = Referrals.parse_payload(context.args)
+        if referrer:
+            await CommandHandlers._attribute_referral(context, referrer, update.message.from_user.id)
+        catalog = await CatalogManager.get()
+        await update.message.reply_text("👋 Welcome!", reply_markup=MenuManager.markup("main", catalog))
+
+    @staticmethod
+    async def _attribute_referral(context, referrer, user_id):
+        """Credit a referral link (/start ref_<id>) to its owner; only users without any deposits yet count"""
+        if await Ledger.transactions(user_id):
+            return
+        if await Referrals.record(referrer, user_id):
+            Notifier.send(context.bot, referrer, "👥 A friend joined with your referral link!")
 
     @staticmethod
     async def add_giftcard(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.message.from_user.id not in ADMINS:
             return await update.message.reply_text("⛔ Unauthorized")
         if context.args:
-            data = DataManager.load()
             new_card = " ".join(context.args)
-            data["giftcards"].append(new_card)
-            DataManager.save(data)
+            await CatalogManager.add_item("giftcards", new_card)
             await update.message.reply_text(f"✅ Gift card '{new_card}' added!")
 
     @staticmethod
@@ -31,70 +54,262 @@ class CommandHandlers:
         if update.message.from_user.id not in ADMINS:
             return await update.message.reply_text("⛔ Unauthorized")
         if context.args:
-            data = DataManager.load()
             new_service = " ".join(context.args)
-            data["services"].append(new_service)
-            DataManager.save(data)
+            await CatalogManager.add_item("services", new_service)
             await update.message.reply_text(f"✅ Streaming service '{new_service}' added!")
 
     @staticmethod
     async def show_pending(update: Update, context: ContextTypes.DEFAULT_TYPE):
         if update.message.from_user.id not in ADMINS:
             return await update.message.reply_text("⛔ Unauthorized")
-        data = DataManager.load()
-        msg = "📥 Pending Transactions:\n"
-        for user_id, info in data["balances"].items():
-            for txn in info.get("transactions", []):
-                if txn["status"] == "pending":
-                    msg += f"User: {user_id}\nCrypto: {txn['crypto']}\nTXID: {txn['txid']}\nAmount: ${txn['amount']}\n\n"
-        await update.message.reply_text(msg or "✅ No pending transactions.")
+        context.user_data["pending_cursor"] = [0, None]
+        context.user_data["pending_selected"] = []
+        msg, keyboard = await CommandHandlers._render_pending_page(after=0)
+        await update.message.reply_text(msg, reply_markup=keyboard)
 
-    
     @staticmethod
-    async def handle_admin_action(update: Update, context: ContextTypes.DEFAULT_TYPE):
+    async def show_pending_page(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """
+        Handle the buttons under /showpending (callback data: pending|<action>|<arg>):
+        next/prev page from a seq cursor, pick toggles one entry, approve/reject settle the picked ones.
+        """
         query = update.callback_query
         await query.answer()
-        data = DataManager.load()
-        parts = query.data.split("|")
-        action = parts[0]
-        user_id = parts[1]
-        txid = parts[2]
-        
-        user_data = data["balances"].get(user_id, {})
-        note = parts[3] if len(parts) > 3 else None
-
-        for txn in user_data.get("transactions", []):
-            if txn["txid"] == txid:
-                if action == "approve":
-                    txn["status"] = "approved"
-                    user_data["total_confirmed"] += txn["amount"]
-                    await query.edit_message_text(
-                        f"✅ Approved TXID: `{txid}`\n"
-                        f"📝 Note: {note or 'No note provided'}",
-                        parse_mode="Markdown"
-                    )
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=f"🎉 Your transaction has been approved!\n"
-                            f"Amount: ${txn['amount']} added to your balance.\n"
-                            f"Note: {note or 'No note provided'}"
-                    )
-                elif action == "reject":
-                    txn["status"] = "rejected"
-                    await query.edit_message_text(
-                        f"❌ Rejected TXID: `{txid}`\n"
-                        f"📝 Note: {note or 'No note provided'}",
-                        parse_mode="Markdown"
-                    )
-                    await context.bot.send_message(
-                        chat_id=user_id,
-                        text=f"⚠️ Your transaction was rejected.\n"
-                            f"Reason: {note or 'No reason provided'}\n"
-                            f"Please contact support if you have questions."
-                    )
-                break
-
-        DataManager.save(data)
+        if query.from_user.id not in ADMINS:
+            return
+        _, action, arg = query.data.split("|")
+        after, before = context.user_data.get("pending_cursor", [0, None])
+        selected = context.user_data.setdefault("pending_selected", [])
+        summary = None
+
+        if action == "next":
+            after, before = int(arg), None
+        elif action == "prev":
+            after, before = 0, int(arg)
+        elif action == "pick":
+            seq = int(arg)
+            if seq in selected:
+                selected.remove(seq)
+            else:
+                selected.append(seq)
+        elif action == "clear":
+            selected.clear()
+        elif action in ("approve", "reject"):
+            status = TransactionStatus.APPROVED if action == "approve" else TransactionStatus.REJECTED
+            entries = await PendingQueue.select(seqs=selected)
+            summary = await CommandHandlers._settle_bulk(context, entries, status)
+            selected.clear()
+
+        context.user_data["pending_cursor"] = [after, before]
+        msg, keyboard = await CommandHandlers._render_pending_page(after, before, selected)
+        await query.edit_message_text(f"{summary}\n\n{msg}" if summary else msg, reply_markup=keyboard)
+
+    @staticmethod
+    async def approve_many(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/approve <txid> [<txid> ...]"""
+        await CommandHandlers._settle_txids(update, context, TransactionStatus.APPROVED, "approve")
+
+    @staticmethod
+    async def reject_many(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/reject <txid> [<txid> ...]"""
+        await CommandHandlers._settle_txids(update, context, TransactionStatus.REJECTED, "reject")
+
+    @staticmethod
+    async def _settle_txids(update, context, status, command):
+        if update.message.from_user.id not in ADMINS:
+            return await update.message.reply_text("⛔ Unauthorized")
+        if not context.args:
+            return await update.message.reply_text(f"Usage: /{command} <txid> [<txid> ...]")
+        entries = await PendingQueue.select(txids=context.args)
+        summary = await CommandHandlers._settle_bulk(context, entries, status)
+        missing = len(set(context.args)) - len(entries)
+        if missing:
+            summary += f"\n⚠️ {missing} TXIDs are not pending."
+        await update.message.reply_text(summary)
+
+    @staticmethod
+    async def approve_all(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/approveall [max_amount]: approve every pending deposit, or only those of at most max_amount"""
+        if update.message.from_user.id not in ADMINS:
+            return await update.message.reply_text("⛔ Unauthorized")
+        try:
+            max_amount = float(context.args[0].lstrip("$")) if context.args else None
+        except ValueError:
+            return await update.message.reply_text("Usage: /approveall [max_amount]")
+        entries = await PendingQueue.select(max_amount=max_amount)
+        await update.message.reply_text(await CommandHandlers._settle_bulk(context, entries, TransactionStatus.APPROVED))
+
+    @staticmethod
+    async def _settle_bulk(context, entries, status):
+        """Settle pending entries in one batch, queue the user notifications and alert edits; returns a summary"""
+        if not entries:
+            return "✅ Nothing to process."
+        results = await CallbackHandlers.settle_many([(entry["user_id"], entry["txid"]) for entry in entries], status)
+
+        done, total = 0, 0
+        for entry, (txn, balance, settled) in zip(entries, results):
+            if not settled:
+                continue
+            done += 1
+            total += txn["amount"]
+            if status == TransactionStatus.APPROVED:
+                Notifier.send(context.bot, entry["user_id"], CallbackHandlers._approval_notice(txn, balance))
+                alert = f"✅ Approved TXID: `{entry['txid']}`"
+            else:
+                Notifier.send(
+                    context.bot,
+                    entry["user_id"],
+                    "⚠️ Your transaction was rejected.\n"
+                    "Please contact support if you believe this was a mistake."
+                )
+                alert = f"❌ Rejected TXID: `{entry['txid']}`"
+            for chat_id, message_id in entry.get("alerts", []):
+                Notifier.edit(context.bot, chat_id, message_id, alert, parse_mode="Markdown")
+
+        icon = "✅" if status == TransactionStatus.APPROVED else "❌"
+        summary = f"{icon} {status.value.capitalize()} {done} transactions (${total:.2f} total)."
+        if done < len(entries):
+            summary += f"\n⚠️ {len(entries) - done} were already processed."
+        return summary
+
+    @staticmethod
+    async def _render_pending_page(after=0, before=None, selected=()):
+        entries, prev_cursor, next_cursor = await PendingQueue.page(after=after, before=before, limit=PENDING_PAGE_SIZE)
+        # A bulk decision can empty the page on screen while earlier ones still have entries:
+        # show the page ending at the cursor (it was that page's last entry), else the first one
+        if not entries and after:
+            entries, prev_cursor, next_cursor = await PendingQueue.page(before=after + 1, limit=PENDING_PAGE_SIZE)
+        if not entries and (after or before is not None):
+            entries, prev_cursor, next_cursor = await PendingQueue.page(after=0, limit=PENDING_PAGE_SIZE)
+        if not entries:
+            return "✅ No pending transactions.", None
+
+        lines = [f"📥 Pending Transactions ({await PendingQueue.count()} total):\n"]
+        for txn in entries:
+            lines.append(f"User: {txn['user_id']}\nCrypto: {txn['crypto']}\nTXID: {txn['txid']}\nAmount: ${txn['amount']}\n")
+
+        # One toggle per entry; the picked ones can then be approved or rejected together
+        rows = [
+            [InlineKeyboardButton(
+                f"{'☑️' if txn['seq'] in selected else '⬜'} ${txn['amount']} {txn['crypto']} {txn['txid'][:12]}",
+                callback_data=f"pending|pick|{txn['seq']}"
+            )]
+            for txn in entries
+        ]
+        buttons = []
+        if prev_cursor is not None:
+            buttons.append(InlineKeyboardButton("⬅️ Prev", callback_data=f"pending|prev|{prev_cursor}"))
+        if next_cursor is not None:
+            buttons.append(InlineKeyboardButton("Next ➡️", callback_data=f"pending|next|{next_cursor}"))
+        if buttons:
+            rows.append(buttons)
+        if selected:
+            rows.append([
+                InlineKeyboardButton(f"✅ Approve {len(selected)}", callback_data="pending|approve|0"),
+                InlineKeyboardButton(f"❌ Reject {len(selected)}", callback_data="pending|reject|0"),
+                InlineKeyboardButton("✖️ Clear", callback_data="pending|clear|0"),
+            ])
+        return "\n".join(lines), InlineKeyboardMarkup(rows)
+
+    @staticmethod
+    async def audit(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/audit <txid> or /audit user <user_id>: recent audit entries from the indexed log"""
+        if update.message.from_user.id not in ADMINS:
+            return await update.message.reply_text("⛔ Unauthorized")
+        if len(context.args) == 2 and context.args[0] == "user":
+            entries = await AuditLog.history(user_id=context.args[1])
+        elif len(context.args) == 1:
+            entries = await AuditLog.history(txid=context.args[0])
+        else:
+            return await update.message.reply_text("Usage: /audit <txid> or /audit user <user_id>")
+
+        if not entries:
+            return await update.message.reply_text("🔍 No audit entries found.")
+        lines = [f"🔍 Audit history ({len(entries)} entries):\n"]
+        for entry in entries:
+            lines.append(f"{entry['ts']} | {entry['action']} | User {entry['user_id']} | TXID: {entry['txid']} | ${entry['amount']} | {entry['status']}")
+        await update.message.reply_text("\n".join(lines))
+
+    @staticmethod
+    async def reconcile(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/reconcile: check every balance against the ledger now"""
+        if update.message.from_user.id not in ADMINS:
+            return await update.message.reply_text("⛔ Unauthorized")
+        drift = await Reconciler.run_all()
+        await update.message.reply_text(Reconciler.format_report(drift))
+
+    @staticmethod
+    async def add_codes(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/addcodes <price> <product> with one code per line below: put gift card / service codes on sale"""
+        if update.message.from_user.id not in ADMINS:
+            return await update.message.reply_text("⛔ Unauthorized")
+        first, *lines = update.message.text.split("\n")
+        parts = first.split(maxsplit=2)
+        codes = [line.strip() for line in lines if line.strip()]
+        try:
+            price, product = float(parts[1].lstrip("$")), parts[2].strip()
+        except (IndexError, ValueError):
+            price, product = None, None
+        if not product or price <= 0 or not codes:
+            return await update.message.reply_text("Usage: /addcodes <price> <product>\nCODE1\nCODE2\n...")
+        catalog = await CatalogManager.get()
+        if product not in catalog.giftcards and product not in catalog.services:
+            return await update.message.reply_text(f"⚠️ '{product}' is not a gift card or service. Add it with /addgift or /addservice first.")
+
+        added = await Inventory.add_codes(product, price, codes)
+        stock = await Inventory.stock(product)
+        reply = f"✅ Added {added} codes to {product} at ${price:.2f} ({stock['available']} in stock)."
+        if added < len(codes):
+            reply += f"\n⚠️ {len(codes) - added} were duplicates."
+        await update.message.reply_text(reply)
+
+    @staticmethod
+    async def stock(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/stock: price, available, reserved and sold codes per product"""
+        if update.message.from_user.id not in ADMINS:
+            return await update.message.reply_text("⛔ Unauthorized")
+        catalog = await CatalogManager.get()
+        lines = ["📦 Stock:"]
+        for product in catalog.giftcards + catalog.services:
+            stock = await Inventory.stock(product)
+            if stock is None:
+                lines.append(f"{product}: no codes")
+            else:
+                lines.append(f"{product}: ${stock['price']:.2f} | {stock['available']} available | {stock['reserved']} reserved | {stock['sold']} sold")
+        await update.message.reply_text("\n".join(lines))
+
+    @staticmethod
+    async def add_coupons(update: Update, context: ContextTypes.DEFAULT_TYPE):
+        """/addcoupons <amount> <max_uses> <days> <count=N | CODE ...>: generate N codes or add the given ones (days 0 = no expiry)"""
+        if update.message.from_user.id not in ADMINS:
+            return await update.message.reply_text("⛔ Unauthorized")
+        usage = "Usage: /addcoupons <amount> <max_uses> <days> <count=N | CODE ...>"
+        try:
+            amount, max_uses, days = float(context.args[0].lstrip("$")), int(context.args[1]), float(context.args[2])
+            codes = context.args[3:]
+            # count=N is spelled out so that a numeric code can still be added on its own
+            generated = len(codes) == 1 and codes[0].lower().startswith("count=")
+            if generated:
+                codes = Coupons.generate(int(codes[0][len("count="):]))
+        except (IndexError, ValueError):
+            return await update.message.reply_text(usage)
+        if not codes or amount <= 0 or max_uses < 1 or len(codes) > MAX_COUPON_BATCH:
+            return await update.message.reply_text(f"{usage}\n(at most {MAX_COUPON_BATCH} codes at a time)")
+
+        expires = time.time() + days * 86400 if days > 0 else 0
+        created = await Coupons.create(codes, amount, max_uses, expires)
+        summary = f"🏷️ Added {created} coupons worth ${amount:.2f}, {max_uses} uses each"
+        summary += f", valid for {days:g} days." if expires else ", no expiry."
+        if created < len(codes):
+            summary += f"\n⚠️ {len(codes) - created} codes already existed."
+        if not generated:
+            return await update.message.reply_text(summary)
+        # Only hashes are stored, so this is the one chance to see the generated codes
+        if len(codes) <= 20:
+            return await update.message.reply_text(summary + "\n\n" + "\n".join(codes))
+        await update.message.reply_document(
+            document=io.BytesIO("\n".join(codes).encode("utf-8")), filename="coupons.txt", caption=summary
+        )
 
     @staticmethod
     async def admin(update: Update, context: ContextTypes.DEFAULT_TYPE):
@@ -102,11 +317,7 @@ class CommandHandlers:
         if user_id not in ADMINS:
             return await update.message.reply_text("⛔ You are not authorized to access the admin panel.")
 
-        keyboard = [
-            ["📥 View Orders", "✅ Approve", "❌ Reject"],
-            ["🏠 Main Menu"]
-        ]
-        reply_markup = ReplyKeyboardMarkup(keyboard, resize_keyboard=True)
+        reply_markup = MenuManager.markup("admin", await CatalogManager.get())
 
         await update.message.reply_text("👮 Welcome to the Admin Panel:", reply_markup=reply_markup)
         context.user_data["menu"] = "admin"
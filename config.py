@@ -1,2 +1,110 @@
 # config.py
-ADMINS = [123456789, 987654321, 1188902990]
\ No newline at end of file
+import os
+
+ADMINS = [123456789, 987654321, 1188902990]
+
+# Storage backend for DataManager: "json" (one file per user) or "sqlite" (requires aiosqlite)
+STORAGE_BACKEND = os.environ.get("STORAGE_BACKEND", "json")
+DATA_DIRECTORY = os.environ.get("DATA_DIRECTORY", "user_data")
+SQLITE_PATH = os.environ.get("SQLITE_PATH", os.path.join(DATA_DIRECTORY, "telebot.db"))
+
+# Append-only transaction ledger: its directory, seconds between fsyncs of appended records,
+# records between balance checkpoints, and superseded records that trigger a compaction
+LEDGER_DIRECTORY = os.environ.get("LEDGER_DIRECTORY", os.path.join(DATA_DIRECTORY, "ledger"))
+LEDGER_SYNC_INTERVAL = float(os.environ.get("LEDGER_SYNC_INTERVAL", "1.0"))
+LEDGER_CHECKPOINT_RECORDS = int(os.environ.get("LEDGER_CHECKPOINT_RECORDS", "1000"))
+LEDGER_COMPACT_MIN_RECORDS = int(os.environ.get("LEDGER_COMPACT_MIN_RECORDS", "10000"))
+
+# Balance reconciliation against the ledger: seconds between runs (0 disables the background job),
+# worker processes for large ledgers, and records summed per worker task
+RECONCILE_INTERVAL = float(os.environ.get("RECONCILE_INTERVAL", "3600"))
+RECONCILE_WORKERS = int(os.environ.get("RECONCILE_WORKERS", "2"))
+RECONCILE_CHUNK_RECORDS = int(os.environ.get("RECONCILE_CHUNK_RECORDS", "200000"))
+
+# Write-back cache in front of the store: max records kept in memory and seconds between flushes
+CACHE_MAX_ENTRIES = int(os.environ.get("CACHE_MAX_ENTRIES", "10000"))
+CACHE_FLUSH_INTERVAL = float(os.environ.get("CACHE_FLUSH_INTERVAL", "2.0"))
+
+# Transaction audit trail: directory of JSON-lines segments plus their index, segment size
+# before rotating to the next file, and most entries written between two fsyncs
+AUDIT_DIRECTORY = os.environ.get("AUDIT_DIRECTORY", "audit")
+AUDIT_MAX_BYTES = int(os.environ.get("AUDIT_MAX_BYTES", str(64 * 1024 * 1024)))
+AUDIT_FSYNC_BATCH = int(os.environ.get("AUDIT_FSYNC_BATCH", "256"))
+
+# Automatic deposit verification. VERIFY_PROVIDERS maps coins to providers ("Bitcoin=mock,Litecoin=mock");
+# coins without a provider or without a wallet in the catalog stay manual. Then: confirmations required,
+# parallel lookups, waiting TXIDs, first and longest seconds between polls of an unconfirmed TXID,
+# and seconds after which it is left to the admins
+VERIFY_PROVIDERS = os.environ.get("VERIFY_PROVIDERS", "")
+VERIFY_CONFIRMATIONS = int(os.environ.get("VERIFY_CONFIRMATIONS", "3"))
+VERIFY_WORKERS = int(os.environ.get("VERIFY_WORKERS", "4"))
+VERIFY_QUEUE_SIZE = int(os.environ.get("VERIFY_QUEUE_SIZE", "1000"))
+VERIFY_POLL_INTERVAL = float(os.environ.get("VERIFY_POLL_INTERVAL", "15"))
+VERIFY_MAX_BACKOFF = float(os.environ.get("VERIFY_MAX_BACKOFF", "300"))
+VERIFY_TIMEOUT = float(os.environ.get("VERIFY_TIMEOUT", str(6 * 3600)))
+# Payments known to the mock provider: {"<txid>": {"amount": 100, "confirmations": 6, "address": "..."}}
+VERIFY_MOCK_FILE = os.environ.get("VERIFY_MOCK_FILE", os.path.join(DATA_DIRECTORY, "mock_payments.json"))
+
+# Seconds an inline button keeps working after it was last sent (its transaction handle then expires)
+CALLBACK_TOKEN_TTL = float(os.environ.get("CALLBACK_TOKEN_TTL", str(30 * 24 * 3600)))
+
+# Transactions per page in /showpending
+PENDING_PAGE_SIZE = int(os.environ.get("PENDING_PAGE_SIZE", "10"))
+
+# Referral program: share of every approved deposit credited to the referrer (0 disables rewards)
+# and the number of referrers kept on the leaderboard
+REFERRAL_REWARD_RATE = float(os.environ.get("REFERRAL_REWARD_RATE", "0.05"))
+REFERRAL_LEADERBOARD_SIZE = int(os.environ.get("REFERRAL_LEADERBOARD_SIZE", "10"))
+
+# Coupons: Bloom filter bits for rejecting unknown codes (about 10 bits per code ever created keeps
+# false positives near 1%) and failed redemptions a user gets per hour before being told to wait
+COUPON_BLOOM_BITS = int(os.environ.get("COUPON_BLOOM_BITS", str(1 << 20)))
+COUPON_FAILURES_PER_HOUR = int(os.environ.get("COUPON_FAILURES_PER_HOUR", "10"))
+
+# Seconds a gift card or service code stays reserved for a buyer before it goes back on sale
+RESERVATION_TTL = float(os.environ.get("RESERVATION_TTL", "300"))
+
+# Outgoing notification dispatcher: parallel senders, bot-wide messages/second,
+# minimum seconds between messages to one chat, and delivery attempts per message
+NOTIFY_CONCURRENCY = int(os.environ.get("NOTIFY_CONCURRENCY", "8"))
+NOTIFY_GLOBAL_RATE = float(os.environ.get("NOTIFY_GLOBAL_RATE", "25"))
+NOTIFY_PER_CHAT_INTERVAL = float(os.environ.get("NOTIFY_PER_CHAT_INTERVAL", "1.0"))
+NOTIFY_MAX_ATTEMPTS = int(os.environ.get("NOTIFY_MAX_ATTEMPTS", "4"))
+
+# Bot API endpoint, e.g. a self-hosted telegram-bot-api server or benchmarks/stub_bot_api.py ("<url>/bot" form)
+BOT_API_URL = os.environ.get("BOT_API_URL")
+
+# Update source: "polling" (default) or "webhook"
+BOT_MODE = os.environ.get("BOT_MODE", "polling")
+WEBHOOK_HOST = os.environ.get("WEBHOOK_HOST", "0.0.0.0")
+WEBHOOK_PORT = int(os.environ.get("WEBHOOK_PORT", "8443"))
+WEBHOOK_PATH = os.environ.get("WEBHOOK_PATH", "/telegram")
+WEBHOOK_SECRET = os.environ.get("WEBHOOK_SECRET")
+WEBHOOK_URL = os.environ.get("WEBHOOK_URL")  # public base URL; when set, the webhook is registered on startup
+WEBHOOK_QUEUE_SIZE = int(os.environ.get("WEBHOOK_QUEUE_SIZE", "1000"))
+WEBHOOK_CONCURRENCY = int(os.environ.get("WEBHOOK_CONCURRENCY", "16"))
+
+# Worker processes behind one webhook (webhook mode only); users are sharded by id
+SHARDS = int(os.environ.get("SHARDS", "1"))
+
+# Log level for the bot and shard processes (DEBUG, INFO, WARNING, ...)
+LOG_LEVEL = os.environ.get("LOG_LEVEL", "INFO")
+
+# Local Prometheus endpoint (GET /metrics; port 0 disables it) and the fraction of text updates
+# whose route, state and latency are logged as a trace line (0 = none, 1 = all)
+METRICS_HOST = os.environ.get("METRICS_HOST", "127.0.0.1")
+METRICS_PORT = int(os.environ.get("METRICS_PORT", "0"))
+TRACE_SAMPLE_RATE = float(os.environ.get("TRACE_SAMPLE_RATE", "0"))
+
+# Flood control, applied before any handler runs: per-user updates/second and burst (rate 0 turns the
+# per-user limit off), seconds within which a repeated identical message or button press is dropped,
+# handlers running at once across all users, and updates that may wait for one before new ones are shed
+# (the last two only matter in webhook mode; polling processes one update at a time)
+FLOOD_USER_RATE = float(os.environ.get("FLOOD_USER_RATE", "1"))
+FLOOD_USER_BURST = int(os.environ.get("FLOOD_USER_BURST", "10"))
+FLOOD_DEBOUNCE = float(os.environ.get("FLOOD_DEBOUNCE", "1.0"))
+FLOOD_MAX_CONCURRENT = int(os.environ.get("FLOOD_MAX_CONCURRENT", "64"))
+FLOOD_MAX_WAITING = int(os.environ.get("FLOOD_MAX_WAITING", "256"))
+
+# Seconds between saves of conversation state (context.user_data) to the store
+PERSISTENCE_FLUSH_INTERVAL = float(os.environ.get("PERSISTENCE_FLUSH_INTERVAL", "10"))
@@ -0,0 +1,233 @@
+# coupons.py
+import asyncio
+import base64
+import datetime
+import hashlib
+import logging
+import re
+import secrets
+import time
+
+from config import COUPON_BLOOM_BITS, COUPON_FAILURES_PER_HOUR
+from data_manager import DataManager
+from ledger import Ledger
+from metrics import Metrics
+from rate_limit import TokenBucket
+from shards import Shards
+
+logger = logging.getLogger(__name__)
+
+BLOOM_KEY = "coupon_bloom"
+BLOOM_HASHES = 7
+COUPON_CRYPTO = "Coupon"
+CODE_ALPHABET = "ABCDEFGHJKLMNPQRSTUVWXYZ23456789"  # no 0/O or 1/I to misread
+CODE_LENGTH = 12
+# Fewest throttled users kept before the ones whose failed attempts have all refilled are forgotten
+FAILURES_PRUNE_MIN = 1024
+
+
+def _digest(code):
+    """Codes are stored and looked up by hash only; case, spaces and dashes don't matter"""
+    return hashlib.sha256(re.sub(r"[\s-]", "", code).upper().encode("utf-8")).hexdigest()
+
+
+def _positions(digest, bits):
+    # Seven disjoint 32-bit slices of the SHA-256 digest are independent enough for the filter
+    return [int(digest[i * 8:(i + 1) * 8], 16) % bits for i in range(BLOOM_HASHES)]
+
+
+class Coupons:
+    """
+    Coupon codes: create in bulk, redeem once per user up to max_uses.
+
+    Coupons are keyed by the SHA-256 of the normalized code and spread over
+    256 store documents by its first byte, so a lookup reads one small
+    document and the plain codes are never stored. A Bloom filter over every
+    digest ever created sits in front of the lookup: a guessed code is almost
+    always rejected from memory, without reading a document. Claims check
+    and bump the usage counter with no await in between, so concurrent
+    redemptions can't oversubscribe a code. When sharded, coupons live on
+    the coordinator shard; the redeeming user's shard credits the ledger.
+    """
+    _buckets = {}   # store key -> {digest: coupon}
+    _bloom = None   # bytearray of COUPON_BLOOM_BITS bits
+    _init_lock = asyncio.Lock()
+    _failures = {}  # user_id -> TokenBucket of failed attempts left, only while some are used up
+    _prune_at = FAILURES_PRUNE_MIN
+
+    @staticmethod
+    def generate(count):
+        """count new random codes, formatted XXXX-XXXX-XXXX"""
+        codes = []
+        for _ in range(count):
+            code = "".join(secrets.choice(CODE_ALPHABET) for _ in range(CODE_LENGTH))
+            codes.append("-".join(code[i:i + 4] for i in range(0, CODE_LENGTH, 4)))
+        return codes
+
+    @staticmethod
+    def _bucket_key(digest):
+        return f"coupon_{digest[:2]}"
+
+    @staticmethod
+    async def _bucket(key):
+        bucket = Coupons._buckets.get(key)
+        if bucket is None:
+            doc = await DataManager.store().get(key) or {}
+            # A concurrent caller may have loaded the same bucket while we were waiting
+            bucket = Coupons._buckets.setdefault(key, doc)
+        return bucket
+
+    @staticmethod
+    async def load():
+        """Load the Bloom filter, rebuilding it from the coupon documents if it is missing or resized"""
+        if Coupons._bloom is not None or not Shards.is_coordinator():
+            return
+        async with Coupons._init_lock:
+            if Coupons._bloom is not None:
+                return
+            doc = await DataManager.store().get(BLOOM_KEY)
+            if doc and doc["bits"] == COUPON_BLOOM_BITS:
+                Coupons._bloom = bytearray(base64.b64decode(doc["data"]))
+                return
+            bloom = bytearray((COUPON_BLOOM_BITS + 7) // 8)
+            for key in await DataManager.store().keys("coupon_"):
+                if key != BLOOM_KEY:
+                    for digest in await Coupons._bucket(key):
+                        Coupons._add(bloom, digest)
+            Coupons._bloom = bloom
+            await Coupons._persist_bloom()
+
+    @staticmethod
+    def _add(bloom, digest):
+        for bit in _positions(digest, COUPON_BLOOM_BITS):
+            bloom[bit >> 3] |= 1 << (bit & 7)
+
+    @staticmethod
+    def _may_exist(digest):
+        return all(Coupons._bloom[bit >> 3] & (1 << (bit & 7)) for bit in _positions(digest, COUPON_BLOOM_BITS))
+
+    @staticmethod
+    async def _persist_bloom():
+        data = base64.b64encode(bytes(Coupons._bloom)).decode("ascii")
+        await DataManager.store().put(BLOOM_KEY, {"bits": COUPON_BLOOM_BITS, "data": data})
+
+    @staticmethod
+    async def create(codes, amount, max_uses, expires):
+        """Add coupons worth `amount` each, usable max_uses times until `expires` (epoch). Returns how many were new."""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("coupons.create", codes, amount, max_uses, expires)
+        await Coupons.load()
+        dirty, created = set(), 0
+        for code in codes:
+            digest = _digest(code)
+            key = Coupons._bucket_key(digest)
+            bucket = await Coupons._bucket(key)
+            if digest in bucket:
+                continue
+            bucket[digest] = {"amount": amount, "max_uses": max_uses, "uses": 0, "expires": expires, "redeemed_by": []}
+            Coupons._add(Coupons._bloom, digest)
+            dirty.add(key)
+            created += 1
+
+        store = DataManager.store()
+        for key in dirty:
+            await store.put(key, Coupons._buckets[key])
+        if dirty:
+            await Coupons._persist_bloom()
+        return created
+
+    @staticmethod
+    async def claim(user_id, digest):
+        """
+        Take one use of a coupon for user_id. Returns (result, amount); result is
+        "ok", "invalid", "expired", "used_up" or "already_used".
+        """
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("coupons.claim", user_id, digest)
+        await Coupons.load()
+        if not Coupons._may_exist(digest):
+            return "invalid", None
+        key = Coupons._bucket_key(digest)
+        bucket = await Coupons._bucket(key)
+        # No await from the checks to the counter update, so two redemptions can't both take the last use
+        coupon = bucket.get(digest)
+        if coupon is None:
+            return "invalid", None
+        if coupon["expires"] and coupon["expires"] <= time.time():
+            return "expired", None
+        if str(user_id) in coupon["redeemed_by"]:
+            return "already_used", None
+        if coupon["uses"] >= coupon["max_uses"]:
+            return "used_up", None
+        coupon["uses"] += 1
+        coupon["redeemed_by"].append(str(user_id))
+        await DataManager.store().put(key, bucket)
+        return "ok", coupon["amount"]
+
+    @staticmethod
+    async def release(user_id, digest):
+        """Give back a use taken by claim() when the credit could not be recorded"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("coupons.release", user_id, digest)
+        key = Coupons._bucket_key(digest)
+        bucket = await Coupons._bucket(key)
+        coupon = bucket.get(digest)
+        if coupon and str(user_id) in coupon["redeemed_by"]:
+            coupon["uses"] -= 1
+            coupon["redeemed_by"].remove(str(user_id))
+            await DataManager.store().put(key, bucket)
+
+    @staticmethod
+    def _record_failure(user_id):
+        failures = Coupons._failures.get(user_id)
+        if failures is None:
+            if len(Coupons._failures) >= Coupons._prune_at:
+                Coupons._prune_failures()
+            failures = Coupons._failures[user_id] = TokenBucket(COUPON_FAILURES_PER_HOUR / 3600, COUPON_FAILURES_PER_HOUR)
+        failures.try_take()
+
+    @staticmethod
+    def _prune_failures():
+        """Forget users whose bucket has refilled: a full bucket is the same as none"""
+        for user_id in [user_id for user_id, bucket in Coupons._failures.items() if bucket.delay(bucket.capacity) == 0]:
+            del Coupons._failures[user_id]
+        # Sweep again once the dict has doubled, so pruning costs O(1) per failure
+        Coupons._prune_at = max(FAILURES_PRUNE_MIN, 2 * len(Coupons._failures))
+
+    @staticmethod
+    async def redeem(user_id, code):
+        """
+        Redeem a code for a user (on the user's shard) and credit its amount to
+        the balance. Returns (result, amount, balance); result is a claim()
+        result or "throttled" once the user has used up their failed attempts.
+        """
+        user_id = str(user_id)
+        failures = Coupons._failures.get(user_id)
+        if failures is not None and failures.delay() > 0:
+            COUPON_REDEMPTIONS.inc(result="throttled")
+            return "throttled", None, None
+
+        digest = _digest(code)
+        result, amount = await Coupons.claim(user_id, digest)
+        COUPON_REDEMPTIONS.inc(result=result)
+        if result != "ok":
+            if result == "invalid":
+                Coupons._record_failure(user_id)
+            return result, None, None
+
+        now = datetime.datetime.now().isoformat()
+        txn = {"crypto": COUPON_CRYPTO, "txid": f"coupon-{digest[:32]}-{user_id}", "amount": amount, "timestamp": now, "processed_at": now}
+        try:
+            balance, _ = await Ledger.credit(user_id, txn)
+        except Exception:
+            await Coupons.release(user_id, digest)
+            raise
+        DataManager.log_transaction("Coupon Redeemed", user_id, txn["txid"], amount, "approved")
+        return "ok", amount, balance
+
+
+Shards.register("coupons.create", Coupons.create)
+Shards.register("coupons.claim", Coupons.claim)
+Shards.register("coupons.release", Coupons.release)
+
+COUPON_REDEMPTIONS = Metrics.counter("telebot_coupon_redemptions_total", "Coupon redemption attempts by result")
@@ -1,143 +1,115 @@
-import logging
-import os
-import json
-
-DATA_DIRECTORY = "user_data"  # Directory to store user-specific JSON files
-LOG_FILE = "transaction_audit.log"
-
-# Set up logging configuration
-logging.basicConfig(
-    filename=LOG_FILE,
-    level=logging.INFO,
-    format="%(asctime)s - %(message)s",
-    datefmt="%Y-%m-%d %H:%M:%S"
-)
-
-# Ensure the user data directory exists
-if not os.path.exists(DATA_DIRECTORY):
-    os.makedirs(DATA_DIRECTORY)
+import asyncio
+import copy
+import weakref
+from contextlib import asynccontextmanager
+from config import STORAGE_BACKEND, DATA_DIRECTORY, SQLITE_PATH, CACHE_MAX_ENTRIES, CACHE_FLUSH_INTERVAL
+from storage import create_store
+from cache import CachedStore
+from audit_log import AuditLog
+from metrics import Metrics
 
 class DataManager:
-    @staticmethod
-    def load(user_id):
-        user_file = os.path.join(DATA_DIRECTORY, f"user_{user_id}.json")
-
-        # If the user's file doesn't exist, create default data
-        if not os.path.exists(user_file):
-            data = {
-                "giftcards": ["Amazon", "Google"],
-                "services": ["Netflix", "Prime Video"],
-                "balances": {},
-                "topups": [
-                    "Bitcoin (BTC) Deposit",
-                    "Ethereum (ETH) Deposit",
-                    "USDT (TRC20) Deposit",
-                    "Litecoin (LTC) Deposit",
-                    "Tron (TRX) Deposit",
-                    "Cash App Deposit"
-                ],
-                "main_menu": [
-                    ["🎁 Gift Card", "🏷️ Apply Coupon"],
-                    ["💸 Balance Top Ups", "👥 Referrals"],
-                    ["🎬 Streaming Service"]
-                ]
-            }
-            DataManager.save(user_id, data)
-            return data
-
-        with open(user_file, "r", encoding="utf-8") as f:
-            return json.load(f)
+    _store = None
+    _locks = weakref.WeakValueDictionary()  # user_id -> asyncio.Lock, dropped once nobody holds it
 
     @staticmethod
-    def save(user_id, data):
-        user_file = os.path.join(DATA_DIRECTORY, f"user_{user_id}.json")
-        with open(user_file, "w", encoding="utf-8") as f:
-            json.dump(data, f, indent=4)
+    def store():
+        """Return the active (cached) storage backend, creating the configured one on first use"""
+        if DataManager._store is None:
+            DataManager.use_store(create_store(STORAGE_BACKEND, DATA_DIRECTORY, SQLITE_PATH))
+        return DataManager._store
 
     @staticmethod
-    def log_transaction(action, user_id, txid, amount, status):
-        """Log transaction to the audit log."""
-        log_msg = f"User {user_id} | Action: {action} | TXID: {txid} | Amount: ${amount} | Status: {status}"
-        logging.info(log_msg)
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
-
+    def use_store(backend, cached=True):
+        """Swap in a different storage backend (benchmarks, alternative deployments)"""
+        if cached:
+            backend = CachedStore(backend, max_entries=CACHE_MAX_ENTRIES, flush_interval=CACHE_FLUSH_INTERVAL)
+        DataManager._store = backend
 
+    @staticmethod
+    def _default_data():
+        return {}
 
+    @staticmethod
+    def _migrate_legacy(user_id, data):
+        """Strip the catalog copy out of pre-split user files, keeping only this user's balance"""
+        record = data.get("balances", {}).get(str(user_id), {})
+        return {
+            "transactions": record.get("transactions", []),
+            "total_confirmed": record.get("total_confirmed", 0)
+        }
 
+    @staticmethod
+    async def load(user_id):
+        """Return the user's record. Users without one get a fresh record that is only stored once saved."""
+        with STORE_SECONDS.time(op="load"):
+            data = await DataManager.store().get(f"user_{user_id}")
+
+        if data is None:
+            return DataManager._default_data()
+        if "balances" in data:
+            data = DataManager._migrate_legacy(user_id, data)
+            await DataManager.save(user_id, data)
+        return data
 
+    @staticmethod
+    async def save(user_id, data):
+        with STORE_SECONDS.time(op="save"):
+            await DataManager.store().put(f"user_{user_id}", data)
 
+    @staticmethod
+    def lock(user_id):
+        """Return the per-user lock guarding read-modify-write cycles on that user's record"""
+        key = str(user_id)
+        lock = DataManager._locks.get(key)
+        if lock is None:
+            lock = asyncio.Lock()
+            DataManager._locks[key] = lock
+        return lock
 
+    @staticmethod
+    @asynccontextmanager
+    async def transaction(user_id):
+        """
+        Atomic read-modify-write on one user's record:
+
+            async with DataManager.transaction(user_id) as data:
+                data.setdefault("notes", {})[txid] = note
+
+        Only one transaction per user runs at a time. The block works on a copy
+        that replaces the stored record when it exits cleanly; if it raises,
+        nothing is written.
+        """
+        async with DataManager.lock(user_id):
+            data = copy.deepcopy(await DataManager.load(user_id))
+            yield data
+            await DataManager.save(user_id, data)
 
-# import logging
-# import os
-# import json
+    @staticmethod
+    async def user_ids():
+        """Return the ids of every user that has a stored record"""
+        with STORE_SECONDS.time(op="keys"):
+            keys = await DataManager.store().keys("user_")
+        return [key[len("user_"):] for key in keys]
 
-# DATA_FILE = "data.json"
-# LOG_FILE = "transaction_audit.log"
+    @staticmethod
+    async def flush():
+        """Write any cached changes to disk now"""
+        if isinstance(DataManager._store, CachedStore):
+            await DataManager._store.flush()
 
-# # Set up logging configuration
-# logging.basicConfig(
-#     filename=LOG_FILE,
-#     level=logging.INFO,
-#     format="%(asctime)s - %(message)s",
-#     datefmt="%Y-%m-%d %H:%M:%S"
-# )
+    @staticmethod
+    async def close():
+        """Flush pending writes and release the store (called on shutdown)"""
+        if DataManager._store is not None:
+            await DataManager._store.close()
+            DataManager._store = None
 
-# class DataManager:
-#     @staticmethod
-#     def load():
-#         if not os.path.exists(DATA_FILE):
-#             return {
-#                 "giftcards": ["Amazon", "Google"],
-#                 "services": ["Netflix", "Prime Video"],
-#                 "balances": {},
-#                 "topups": [
-#                     "Bitcoin (BTC) Deposit",
-#                     "Ethereum (ETH) Deposit",
-#                     "USDT (TRC20) Deposit",
-#                     "Litecoin (LTC) Deposit",
-#                     "Tron (TRX) Deposit",
-#                     "Cash App Deposit"
-#                 ],
-#                 "main_menu": [
-#                     ["🎁 Gift Card", "🏷️ Apply Coupon"],
-#                     ["💸 Balance Top Ups", "👥 Referrals"],
-#                     ["🎬 Streaming Service"]
-#                 ]
-#             }
-#         with open(DATA_FILE, "r", encoding="utf-8") as f:
-#             return json.load(f)
+    @staticmethod
+    def log_transaction(action, user_id, txid, amount, status):
+        """Log transaction to the audit log."""
+        AuditLog.record(action, user_id, txid, amount, status)
 
-#     @staticmethod
-#     def save(data):
-#         with open(DATA_FILE, "w", encoding="utf-8") as f:
-#             json.dump(data, f, indent=4)
 
-#     @staticmethod
-#     def log_transaction(action, user_id, txid, amount, status):
-#         """Log transaction to the audit log."""
-#         log_msg = f"User {user_id} | Action: {action} | TXID: {txid} | Amount: ${amount} | Status: {status}"
-#         logging.info(log_msg)
+# Reads and writes of user records through DataManager (the _count series are the operation counts)
+STORE_SECONDS = Metrics.histogram("telebot_store_seconds", "DataManager store operation latency")
@@ -0,0 +1,108 @@
+# flood_control.py
+import asyncio
+import functools
+import time
+from collections import OrderedDict
+
+from telegram.ext import ApplicationHandlerStop
+
+from config import ADMINS, FLOOD_USER_RATE, FLOOD_USER_BURST, FLOOD_DEBOUNCE, FLOOD_MAX_CONCURRENT, FLOOD_MAX_WAITING
+from metrics import Metrics
+from rate_limit import TokenBucket
+
+# Users whose bucket and last press are remembered; the least recently seen are forgotten first
+TRACKED_USERS = 100000
+# Toast shown for a button press that was dropped
+SLOW_DOWN = "⏳ Slow down a little"
+
+
+class FloodControl:
+    """
+    Load shedding in front of the handlers.
+
+    gate() runs before everything else (group -2), so a dropped update costs
+    a dict lookup and never reaches the stores or the Bot API: each user gets
+    a token bucket (admins are exempt) and a repeat of the same text or button
+    within FLOOD_DEBOUNCE seconds is dropped. limited() wraps the handlers so
+    at most FLOOD_MAX_CONCURRENT run at once; once FLOOD_MAX_WAITING updates
+    are queued for a slot, new ones are shed instead of piling up. Dropped
+    button presses are answered, so the client doesn't keep spinning.
+
+    The concurrency cap only comes into play in webhook mode, where the
+    server's workers process updates in parallel; run_polling handles one
+    update at a time (no concurrent_updates, which keeps each user's
+    updates in order), so there it never has more than one handler to hold.
+    """
+    _users = OrderedDict()  # user_id -> [TokenBucket or None, last payload, when]
+    _slots = asyncio.Semaphore(FLOOD_MAX_CONCURRENT)
+    _waiting = 0
+
+    @staticmethod
+    def _payload(update):
+        if update.callback_query is not None:
+            return update.callback_query.data
+        if update.message is not None:
+            return update.message.text
+        return None
+
+    @staticmethod
+    def _answer(update, context):
+        """Stop the button spinner of a dropped callback query; fire-and-forget so shedding stays cheap"""
+        if update.callback_query is not None:
+            context.application.create_task(update.callback_query.answer(SLOW_DOWN), update=update)
+
+    @staticmethod
+    def _shed(update, context, reason):
+        UPDATES_SHED.inc(reason=reason)
+        FloodControl._answer(update, context)
+        raise ApplicationHandlerStop
+
+    @staticmethod
+    async def gate(update, context):
+        """Drop the update if its user is over their rate or repeating themselves"""
+        user = update.effective_user
+        if user is None:
+            return
+        now = time.monotonic()
+        state = FloodControl._users.get(user.id)
+        if state is None:
+            limited = FLOOD_USER_RATE > 0 and user.id not in ADMINS
+            state = [TokenBucket(FLOOD_USER_RATE, FLOOD_USER_BURST) if limited else None, None, 0.0]
+            FloodControl._users[user.id] = state
+            if len(FloodControl._users) > TRACKED_USERS:
+                FloodControl._users.popitem(last=False)
+        else:
+            FloodControl._users.move_to_end(user.id)
+
+        payload = FloodControl._payload(update)
+        if payload is not None and payload == state[1] and now - state[2] < FLOOD_DEBOUNCE:
+            FloodControl._shed(update, context, "duplicate")
+        if state[0] is not None and not state[0].try_take():
+            FloodControl._shed(update, context, "rate_limited")
+        state[1], state[2] = payload, now
+
+    @staticmethod
+    def limited(callback):
+        """Wrap a handler callback so it runs under the global concurrency cap"""
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            if FloodControl._waiting >= FLOOD_MAX_WAITING:
+                UPDATES_SHED.inc(reason="overloaded")
+                FloodControl._answer(update, context)
+                return None
+            FloodControl._waiting += 1
+            try:
+                await FloodControl._slots.acquire()
+            finally:
+                FloodControl._waiting -= 1
+            try:
+                return await callback(update, context)
+            finally:
+                FloodControl._slots.release()
+        return wrapper
+
+
+UPDATES_SHED = Metrics.counter("telebot_updates_shed_total", "Updates dropped by flood control, by reason")
+HANDLER_SLOTS_WAITING = Metrics.gauge("telebot_handler_slots_waiting", "Updates waiting for a handler slot")
+HANDLER_SLOTS_WAITING.set_function(lambda: FloodControl._waiting)
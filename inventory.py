@@ -0,0 +1,213 @@
+# inventory.py
+import logging
+import secrets
+import time
+import zlib
+from collections import OrderedDict
+
+from config import RESERVATION_TTL
+from data_manager import DataManager
+from shards import Shards
+
+logger = logging.getLogger(__name__)
+
+
+def _key(product):
+    return f"inv_{zlib.crc32(product.encode('utf-8')):08x}"
+
+
+class Inventory:
+    """
+    Codes for sale per gift card / streaming service, with reservations.
+
+    Each product is its own store document: {"product", "price", "available":
+    [code, ...], "reserved": {reservation id: [user_id, code, expires, paying]},
+    "sold": count}. A reservation takes a code out of "available" for
+    RESERVATION_TTL seconds; unpaid ones are kept in expiry order and go back
+    on sale whenever their product is next touched. Every operation checks
+    and updates a document with no await in between, so two buyers never get
+    the same code and checkouts of different products never wait on each
+    other. Reservation ids start with the product's document key, so a
+    checkout finds its product without a lookup table. When sharded, the
+    inventory lives on the coordinator shard.
+    """
+    _docs = {}    # store key -> product document
+    _expiry = {}  # store key -> OrderedDict(reservation id -> expires), unpaid reservations oldest first
+
+    @staticmethod
+    async def _doc(key):
+        doc = Inventory._docs.get(key)
+        if doc is None:
+            doc = await DataManager.store().get(key)
+            if doc is None or key in Inventory._docs:
+                return Inventory._docs.get(key)
+            Inventory._docs[key] = doc
+            unpaid = sorted((entry[2], rid) for rid, entry in doc["reserved"].items() if not entry[3])
+            Inventory._expiry[key] = OrderedDict((rid, expires) for expires, rid in unpaid)
+            await Inventory._recover(key, doc)
+        return doc
+
+    @staticmethod
+    async def _recover(key, doc):
+        """
+        Finish checkouts that stopped while paying (the bot went down between the
+        hold and the commit): the code is sold if the buyer's buy-<id> debit made
+        it into the ledger, and goes back on sale otherwise.
+        """
+        interrupted = [(rid, entry) for rid, entry in doc["reserved"].items() if entry[3]]
+        for rid, (user_id, code, _, _) in interrupted:
+            try:
+                # Runs on the buyer's shard, which holds their ledger and orders (see purchases.py)
+                paid = await Shards.call_owner(user_id, "purchases.recover", user_id, rid, doc["product"], doc["price"], code)
+            except Exception as e:
+                logger.error(f"{doc['product']}: could not recover checkout {rid}: {e}")
+                continue
+            if doc["reserved"].pop(rid, None) is None:
+                continue
+            if paid:
+                doc["sold"] += 1
+            else:
+                doc["available"].append(code)
+            logger.warning(f"{doc['product']}: interrupted checkout {rid} {'completed' if paid else 'released'}")
+        if interrupted:
+            await DataManager.store().put(key, doc)
+
+    @staticmethod
+    def _expire(key, doc, now):
+        """Put the codes of expired unpaid reservations back on sale; returns True if any were"""
+        expiry = Inventory._expiry[key]
+        expired = False
+        while expiry:
+            rid, expires = next(iter(expiry.items()))
+            if expires > now:
+                break
+            del expiry[rid]
+            entry = doc["reserved"].pop(rid, None)
+            if entry is not None:
+                doc["available"].append(entry[1])
+                expired = True
+        return expired
+
+    @staticmethod
+    async def _touch(key):
+        """Load a product document and expire its stale reservations"""
+        doc = await Inventory._doc(key)
+        if doc is not None and Inventory._expire(key, doc, time.time()):
+            await DataManager.store().put(key, doc)
+        return doc
+
+    @staticmethod
+    async def add_codes(product, price, codes):
+        """Put codes on sale at `price` (which also reprices the ones in stock). Returns how many were new."""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("inventory.add_codes", product, price, codes)
+        key = _key(product)
+        doc = await Inventory._touch(key)
+        if doc is None:
+            doc = Inventory._docs.setdefault(key, {"product": product, "price": price, "available": [], "reserved": {}, "sold": 0})
+            Inventory._expiry.setdefault(key, OrderedDict())
+        known = set(doc["available"]) | {entry[1] for entry in doc["reserved"].values()}
+        added = [code for code in dict.fromkeys(codes) if code not in known]
+        doc["available"].extend(added)
+        doc["price"] = price
+        await DataManager.store().put(key, doc)
+        return len(added)
+
+    @staticmethod
+    async def stock(product):
+        """{"price", "available", "reserved", "sold"} for a product, or None if it never had codes"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("inventory.stock", product)
+        doc = await Inventory._touch(_key(product))
+        if doc is None:
+            return None
+        return {"price": doc["price"], "available": len(doc["available"]), "reserved": len(doc["reserved"]), "sold": doc["sold"]}
+
+    @staticmethod
+    def item(product):
+        """Short id of a product (8 hex characters) for callback data; reserve() takes it"""
+        return _key(product)[len("inv_"):]
+
+    @staticmethod
+    async def reserve(item, user_id):
+        """
+        Set a code of the product with id `item` aside for user_id. Returns
+        {"id", "product", "price", "expires"}, the user's existing reservation of
+        this product, or None when sold out.
+        """
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("inventory.reserve", item, user_id)
+        key = f"inv_{item}"
+        doc = await Inventory._touch(key)
+        if doc is None:
+            return None
+        user_id = str(user_id)
+        rid = next((rid for rid, entry in doc["reserved"].items() if entry[0] == user_id and not entry[3]), None)
+        if rid is None:
+            if not doc["available"]:
+                return None
+            rid = f"{item}{secrets.token_urlsafe(6)}"
+            expires = time.time() + RESERVATION_TTL
+            doc["reserved"][rid] = [user_id, doc["available"].pop(), expires, False]
+            Inventory._expiry[key][rid] = expires
+            await DataManager.store().put(key, doc)
+        return {"id": rid, "product": doc["product"], "price": doc["price"], "expires": doc["reserved"][rid][2]}
+
+    @staticmethod
+    async def _reservation(rid, user_id):
+        key = f"inv_{rid[:8]}"
+        doc = await Inventory._touch(key)
+        entry = doc["reserved"].get(rid) if doc is not None else None
+        if entry is None or entry[0] != str(user_id):
+            return key, doc, None
+        return key, doc, entry
+
+    @staticmethod
+    async def hold(rid, user_id):
+        """
+        Start paying for a reservation: it no longer expires. Returns (product,
+        price, code), or None if it expired, was never the user's or is already
+        being paid.
+        """
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("inventory.hold", rid, user_id)
+        key, doc, entry = await Inventory._reservation(rid, user_id)
+        if entry is None or entry[3]:
+            return None
+        entry[3] = True
+        Inventory._expiry[key].pop(rid, None)
+        await DataManager.store().put(key, doc)
+        return doc["product"], doc["price"], entry[1]
+
+    @staticmethod
+    async def commit(rid, user_id):
+        """The reservation was paid for: its code is sold"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("inventory.commit", rid, user_id)
+        key, doc, entry = await Inventory._reservation(rid, user_id)
+        if entry is not None:
+            del doc["reserved"][rid]
+            doc["sold"] += 1
+            await DataManager.store().put(key, doc)
+
+    @staticmethod
+    async def release(rid, user_id):
+        """Cancel a reservation (or a failed payment) and put its code back on sale; returns False if there was none"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("inventory.release", rid, user_id)
+        key, doc, entry = await Inventory._reservation(rid, user_id)
+        if entry is None:
+            return False
+        del doc["reserved"][rid]
+        Inventory._expiry[key].pop(rid, None)
+        doc["available"].append(entry[1])
+        await DataManager.store().put(key, doc)
+        return True
+
+
+Shards.register("inventory.add_codes", Inventory.add_codes)
+Shards.register("inventory.stock", Inventory.stock)
+Shards.register("inventory.reserve", Inventory.reserve)
+Shards.register("inventory.hold", Inventory.hold)
+Shards.register("inventory.commit", Inventory.commit)
+Shards.register("inventory.release", Inventory.release)
@@ -0,0 +1,487 @@
+# ledger.py
+import asyncio
+import datetime
+import json
+import logging
+import os
+import struct
+
+from config import LEDGER_DIRECTORY, LEDGER_SYNC_INTERVAL, LEDGER_CHECKPOINT_RECORDS, LEDGER_COMPACT_MIN_RECORDS
+from data_manager import DataManager
+from shards import Shards
+
+logger = logging.getLogger(__name__)
+
+# kind, status, crypto code, user_id, amount in cents, submitted at, processed at, txid
+RECORD = struct.Struct("<BBHqqdd88s4x")
+MAX_TXID_BYTES = 88
+
+SUBMIT = 1  # a transaction as submitted (or, after compaction, in its final state)
+STATUS = 2  # a later status change of a submitted transaction
+STATUSES = ("pending", "approved", "rejected")
+
+CODES_FILE = "codes.json"
+CHECKPOINT_FILE = "checkpoint.json"
+
+
+def _ledger_path(directory, generation):
+    return os.path.join(directory, f"ledger-{generation:06d}.bin")
+
+
+def _generations(directory):
+    return sorted(
+        int(name[len("ledger-"):-len(".bin")])
+        for name in os.listdir(directory)
+        if name.startswith("ledger-") and name.endswith(".bin")
+    )
+
+
+def _write_json(path, doc):
+    tmp_path = f"{path}.tmp"
+    with open(tmp_path, "w", encoding="utf-8") as f:
+        json.dump(doc, f)
+        f.flush()
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def _read_json(path, default):
+    try:
+        with open(path, "r", encoding="utf-8") as f:
+            return json.load(f)
+    except FileNotFoundError:
+        return default
+
+
+def _read_file(path):
+    with open(path, "rb") as f:
+        return f.read()
+
+
+def _write_file(path, payload):
+    with open(path, "wb") as f:
+        f.write(payload)
+        f.flush()
+        os.fsync(f.fileno())
+
+
+def _cents(amount):
+    return int(round(amount * 100))
+
+
+def _amount(cents):
+    return cents // 100 if cents % 100 == 0 else cents / 100
+
+
+def _epoch(timestamp):
+    return datetime.datetime.fromisoformat(timestamp).timestamp() if timestamp else 0.0
+
+
+def _iso(epoch):
+    return datetime.datetime.fromtimestamp(epoch).isoformat() if epoch else ""
+
+
+class Ledger:
+    """
+    Append-only transaction ledger, one per shard.
+
+    Every submission and every status change is a single fixed-width
+    RECORD appended to the current ledger file, so recording one costs one
+    small write no matter how long a user's history is. Crypto names are
+    interned into small integer codes (codes.json).
+
+    The ledger is replayed into memory on startup. Balances are kept up to
+    date as records are applied and are checkpointed (checkpoint.json)
+    together with the byte offset they cover, so a restart only replays
+    balance changes from the tail. Compaction rewrites the ledger as one
+    record per transaction in its current state into the next generation
+    file; the checkpoint names its generation, so a stale one is never
+    trusted.
+    """
+    _directory = LEDGER_DIRECTORY
+    _transactions = None  # txid -> transaction dict
+    _owners = {}          # txid -> user_id
+    _by_user = {}         # user_id -> [txid] in submission order
+    _balances = {}        # user_id -> confirmed balance
+    _codes = []           # crypto code -> name
+    _code_ids = {}        # name -> crypto code
+    _generation = 0
+    _fd = None
+    _size = 0
+    _checkpointed = 0     # byte offset covered by the last checkpoint
+    _superseded = 0       # STATUS records that compaction would fold away
+    _init_lock = asyncio.Lock()
+    _io_lock = asyncio.Lock()
+    _syncer = None
+    _unsynced = False
+
+    @staticmethod
+    def configure(directory):
+        """Use a different ledger directory (must be called before the first load)"""
+        Ledger._directory = directory
+
+    # ---------- Loading ----------
+
+    @staticmethod
+    async def load():
+        """Replay the ledger into memory, importing transactions from user records on first run"""
+        # The file descriptor is opened last, once the in-memory state is complete
+        if Ledger._fd is not None:
+            return
+        async with Ledger._init_lock:
+            if Ledger._fd is not None:
+                return
+            os.makedirs(Ledger._directory, exist_ok=True)
+            Ledger._codes = await asyncio.to_thread(_read_json, os.path.join(Ledger._directory, CODES_FILE), [])
+            Ledger._code_ids = {name: code for code, name in enumerate(Ledger._codes)}
+            generations = await asyncio.to_thread(_generations, Ledger._directory)
+            if generations:
+                await Ledger._replay(generations[-1])
+                for old in generations[:-1]:
+                    os.remove(_ledger_path(Ledger._directory, old))
+            else:
+                await Ledger._import_records()
+
+    @staticmethod
+    async def _replay(generation):
+        path = _ledger_path(Ledger._directory, generation)
+        payload = await asyncio.to_thread(_read_file, path)
+        torn = len(payload) % RECORD.size
+        if torn:
+            logger.warning(f"Dropping {torn} bytes of a partially written record at the end of {path}")
+            payload = payload[:-torn]
+            os.truncate(path, len(payload))
+
+        checkpoint = await asyncio.to_thread(_read_json, os.path.join(Ledger._directory, CHECKPOINT_FILE), {})
+        trusted = checkpoint.get("generation") == generation and checkpoint.get("offset", 0) <= len(payload)
+        start = checkpoint["offset"] if trusted else 0
+        balances = {user_id: balance for user_id, balance in checkpoint.get("balances", {}).items()} if trusted else {}
+
+        Ledger._transactions, Ledger._owners, Ledger._by_user, Ledger._superseded = {}, {}, {}, 0
+        for position, record in enumerate(RECORD.iter_unpack(payload)):
+            credit = Ledger._apply(record)
+            if credit and position * RECORD.size >= start:
+                user_id = str(record[3])
+                balances[user_id] = balances.get(user_id, 0) + credit
+        if not trusted:
+            logger.warning(f"No usable balance checkpoint for ledger generation {generation}, derived balances from the full ledger")
+
+        Ledger._balances = balances
+        Ledger._generation = generation
+        Ledger._fd = os.open(path, os.O_RDWR | os.O_APPEND | os.O_CREAT, 0o644)
+        Ledger._size = len(payload)
+        Ledger._checkpointed = start
+
+    @staticmethod
+    async def _import_records():
+        """First run: copy transactions and balances out of the per-user JSON records"""
+        transactions, balances = [], {}
+        for user_id in await DataManager.user_ids():
+            data = await DataManager.load(user_id)
+            transactions.extend((user_id, txn) for txn in data.get("transactions", []))
+            if data.get("total_confirmed"):
+                balances[user_id] = data["total_confirmed"]
+        transactions.sort(key=lambda item: item[1].get("timestamp") or "")
+
+        Ledger._transactions, Ledger._owners, Ledger._by_user, Ledger._superseded = {}, {}, {}, 0
+        records = []
+        for user_id, txn in transactions:
+            record = Ledger._record(SUBMIT, user_id, txn)
+            Ledger._apply(RECORD.unpack(record))
+            records.append(record)
+        payload = b"".join(records)
+
+        Ledger._generation = 1
+        path = _ledger_path(Ledger._directory, Ledger._generation)
+        # Same as _compact: a crash mid-write leaves no ledger, so the next start imports again
+        tmp_path = f"{path}.tmp"
+        await asyncio.to_thread(_write_file, tmp_path, payload)
+        os.replace(tmp_path, path)
+        Ledger._fd = os.open(path, os.O_RDWR | os.O_APPEND, 0o644)
+        Ledger._size = len(payload)
+        # Keep the balances users already see, even where they disagree with the imported history
+        Ledger._balances = balances
+        await Ledger._checkpoint()
+        if transactions:
+            logger.info(f"Imported {len(transactions)} transactions from user records into the ledger")
+
+    # ---------- Records ----------
+
+    @staticmethod
+    def _code(crypto):
+        code = Ledger._code_ids.get(crypto)
+        if code is None:
+            # New crypto names are rare (an admin adding a top-up method); persist the table before any record uses it
+            code = len(Ledger._codes)
+            Ledger._codes.append(crypto)
+            Ledger._code_ids[crypto] = code
+            _write_json(os.path.join(Ledger._directory, CODES_FILE), Ledger._codes)
+        return code
+
+    @staticmethod
+    def _record(kind, user_id, txn):
+        return RECORD.pack(
+            kind,
+            STATUSES.index(txn["status"]),
+            Ledger._code(txn["crypto"]),
+            int(user_id),
+            _cents(txn["amount"]),
+            _epoch(txn.get("timestamp")),
+            _epoch(txn.get("processed_at")),
+            txn["txid"].encode("utf-8"),
+        )
+
+    @staticmethod
+    def _apply(record):
+        """Apply one unpacked record to the in-memory state; returns the balance credit it carries"""
+        kind, status, code, user_id, cents, submitted, processed, txid = record
+        txid = txid.rstrip(b"\0").decode("utf-8")
+        status = STATUSES[status]
+        if kind == SUBMIT:
+            user_id = str(user_id)
+            txn = {"crypto": Ledger._codes[code], "txid": txid, "amount": _amount(cents), "status": status, "timestamp": _iso(submitted)}
+            if processed:
+                txn["processed_at"] = _iso(processed)
+            Ledger._transactions[txid] = txn
+            Ledger._owners[txid] = user_id
+            Ledger._by_user.setdefault(user_id, []).append(txid)
+            return txn["amount"] if status == "approved" else 0
+
+        txn = Ledger._transactions[txid]
+        txn["status"] = status
+        txn["processed_at"] = _iso(processed)
+        Ledger._superseded += 1
+        return txn["amount"] if status == "approved" else 0
+
+    @staticmethod
+    def _append(record):
+        os.write(Ledger._fd, record)
+        Ledger._size += len(record)
+        Ledger._unsynced = True
+        if Ledger._syncer is None or Ledger._syncer.done():
+            Ledger._syncer = asyncio.get_running_loop().create_task(Ledger._sync_loop())
+
+    # ---------- Public API ----------
+
+    @staticmethod
+    async def append(user_id, txn):
+        """Record a newly submitted transaction. Returns False if its txid is already in the ledger."""
+        await Ledger.load()
+        if txn["txid"] in Ledger._transactions:
+            return False
+        record = Ledger._record(SUBMIT, user_id, txn)
+        Ledger._append(record)
+        Ledger._apply(RECORD.unpack(record))
+        return True
+
+    @staticmethod
+    async def credit(user_id, txn):
+        """
+        Record a transaction that is approved from the start (e.g. a referral bonus)
+        and credit its amount. Returns (balance, credited); credited is False if
+        its txid is already in the ledger.
+        """
+        return (await Ledger.credit_many([(user_id, txn)]))[0]
+
+    @staticmethod
+    async def credit_many(items):
+        """credit() for a list of (user_id, txn) pairs, written as one append. Returns one pair per item, in order."""
+        await Ledger.load()
+        return Ledger._post(items)
+
+    @staticmethod
+    async def debit(user_id, txn):
+        """
+        Take txn["amount"] from the balance if it covers it, recorded as an approved
+        transaction of the negative amount (a purchase). Returns (balance, debited).
+        """
+        await Ledger.load()
+        user_id = str(user_id)
+        balance = Ledger._balances.get(user_id, 0)
+        # No await from the balance check to the append, so concurrent purchases can't overdraw
+        if txn["txid"] in Ledger._transactions or _cents(balance) < _cents(txn["amount"]):
+            return balance, False
+        return Ledger._post([(user_id, dict(txn, amount=-txn["amount"]))])[0]
+
+    @staticmethod
+    def _post(items):
+        """Append already-approved transactions as one write and apply them to the balances, without awaiting"""
+        records = {}  # position in items -> SUBMIT record
+        chosen = set()
+        for position, (user_id, txn) in enumerate(items):
+            if txn["txid"] not in Ledger._transactions and txn["txid"] not in chosen:
+                chosen.add(txn["txid"])
+                records[position] = Ledger._record(SUBMIT, user_id, dict(txn, status="approved"))
+        if records:
+            Ledger._append(b"".join(records.values()))
+
+        results = []
+        for position, (user_id, _) in enumerate(items):
+            user_id = str(user_id)
+            if position in records:
+                Ledger._balances[user_id] = Ledger._balances.get(user_id, 0) + Ledger._apply(RECORD.unpack(records[position]))
+            results.append((Ledger._balances.get(user_id, 0), position in records))
+        return results
+
+    @staticmethod
+    async def settle(user_id, txid, status):
+        """
+        Move a pending transaction to `status` ("approved"/"rejected"), crediting
+        the balance on approval. Returns (transaction, balance, settled); settled
+        is False when the transaction is missing or was already processed.
+        """
+        return (await Ledger.settle_many([(user_id, txid)], status))[0]
+
+    @staticmethod
+    async def settle_many(items, status):
+        """settle() for a list of (user_id, txid) pairs, written as one append. Returns one triple per pair, in order."""
+        await Ledger.load()
+        processed = datetime.datetime.now().timestamp()
+        records = {}  # position in items -> STATUS record
+        chosen = set()
+        # No await from the status checks to the append, so two admins can't both settle a transaction
+        for position, (user_id, txid) in enumerate(items):
+            txn = Ledger._transactions.get(txid) if Ledger._owners.get(txid) == str(user_id) else None
+            if txn and txn["status"] == "pending" and txid not in chosen:
+                chosen.add(txid)
+                # The amount is repeated so every record can be summed on its own (see reconciliation.py)
+                records[position] = RECORD.pack(
+                    STATUS, STATUSES.index(status), 0, int(user_id), _cents(txn["amount"]),
+                    0.0, processed, txid.encode("utf-8")
+                )
+        if records:
+            Ledger._append(b"".join(records.values()))
+
+        results = []
+        for position, (user_id, txid) in enumerate(items):
+            user_id = str(user_id)
+            if position in records:
+                credit = Ledger._apply(RECORD.unpack(records[position]))
+                if credit:
+                    Ledger._balances[user_id] = Ledger._balances.get(user_id, 0) + credit
+            txn = Ledger._transactions.get(txid) if Ledger._owners.get(txid) == user_id else None
+            results.append((dict(txn) if txn else None, Ledger._balances.get(user_id, 0), position in records))
+        return results
+
+    @staticmethod
+    async def find(user_id, txid):
+        """Return a copy of the user's transaction with this txid, or None"""
+        await Ledger.load()
+        if Ledger._owners.get(txid) != str(user_id):
+            return None
+        return dict(Ledger._transactions[txid])
+
+    @staticmethod
+    async def transactions(user_id):
+        """Copies of the user's transactions, oldest first"""
+        await Ledger.load()
+        return [dict(Ledger._transactions[txid]) for txid in Ledger._by_user.get(str(user_id), [])]
+
+    @staticmethod
+    async def balance(user_id):
+        await Ledger.load()
+        return Ledger._balances.get(str(user_id), 0)
+
+    @staticmethod
+    async def snapshot():
+        """Return (ledger path, byte size, balances) captured at one instant, so they describe the same records"""
+        await Ledger.load()
+        return _ledger_path(Ledger._directory, Ledger._generation), Ledger._size, dict(Ledger._balances)
+
+    @staticmethod
+    async def scan():
+        """Return (user_id, transaction) for every transaction in this shard's ledger"""
+        await Ledger.load()
+        return [(Ledger._owners[txid], dict(txn)) for txid, txn in Ledger._transactions.items()]
+
+    @staticmethod
+    async def all_transactions():
+        """scan() across every shard (used to rebuild the global indexes)"""
+        if Shards.count == 1:
+            return await Ledger.scan()
+        return [item for part in await Shards.gather("ledger.scan") for item in part]
+
+    # ---------- Durability and maintenance ----------
+
+    @staticmethod
+    async def _sync_loop():
+        while Ledger._unsynced:
+            await asyncio.sleep(LEDGER_SYNC_INTERVAL)
+            # Shielded so close() cancelling the loop never interrupts a checkpoint or compaction
+            await asyncio.shield(Ledger.sync())
+
+    @staticmethod
+    async def sync():
+        """fsync appended records, then checkpoint or compact when enough has accumulated"""
+        async with Ledger._io_lock:
+            if Ledger._fd is None:
+                return
+            Ledger._unsynced = False
+            await asyncio.to_thread(os.fsync, Ledger._fd)
+            if Ledger._superseded >= LEDGER_COMPACT_MIN_RECORDS and Ledger._superseded * 2 >= len(Ledger._transactions):
+                await Ledger._compact()
+            elif Ledger._size - Ledger._checkpointed >= LEDGER_CHECKPOINT_RECORDS * RECORD.size:
+                await Ledger._checkpoint()
+
+    @staticmethod
+    async def _checkpoint():
+        # Captured without awaiting, so the balances match exactly the records before the offset
+        doc = {"generation": Ledger._generation, "offset": Ledger._size, "balances": dict(Ledger._balances)}
+        await asyncio.to_thread(_write_json, os.path.join(Ledger._directory, CHECKPOINT_FILE), doc)
+        Ledger._checkpointed = doc["offset"]
+
+    @staticmethod
+    async def compact():
+        """Rewrite the ledger as one record per transaction, dropping superseded status records"""
+        await Ledger.load()
+        async with Ledger._io_lock:
+            await Ledger._compact()
+
+    @staticmethod
+    async def _compact():
+        snapshot_size = Ledger._size
+        payload = b"".join(Ledger._record(SUBMIT, Ledger._owners[txid], txn) for txid, txn in Ledger._transactions.items())
+        generation = Ledger._generation + 1
+        path = _ledger_path(Ledger._directory, generation)
+        tmp_path = f"{path}.tmp"
+        await asyncio.to_thread(_write_file, tmp_path, payload)
+
+        # Records appended while the snapshot was written are carried over verbatim; from here to the
+        # swap nothing awaits, so no append can land in the old file after it is copied. The new
+        # generation only gets its final name once it holds everything, so a crash leaves the old one in use.
+        old_path = _ledger_path(Ledger._directory, Ledger._generation)
+        old_fd = Ledger._fd
+        tail = os.pread(old_fd, Ledger._size - snapshot_size, snapshot_size)
+        Ledger._fd = os.open(tmp_path, os.O_RDWR | os.O_APPEND, 0o644)
+        if tail:
+            os.write(Ledger._fd, tail)
+            os.fsync(Ledger._fd)
+        os.replace(tmp_path, path)
+        os.close(old_fd)
+        Ledger._generation = generation
+        Ledger._size = len(payload) + len(tail)
+        Ledger._superseded = sum(1 for record in RECORD.iter_unpack(tail) if record[0] == STATUS)
+        await Ledger._checkpoint()
+        os.remove(old_path)
+        logger.info(f"Compacted ledger to generation {generation}: {snapshot_size} -> {len(payload)} bytes")
+
+    @staticmethod
+    async def close():
+        """fsync, checkpoint and close the ledger (called on shutdown)"""
+        if Ledger._syncer is not None:
+            Ledger._syncer.cancel()
+            try:
+                await Ledger._syncer
+            except asyncio.CancelledError:
+                pass
+            Ledger._syncer = None
+        async with Ledger._io_lock:
+            if Ledger._fd is None:
+                return
+            await asyncio.to_thread(os.fsync, Ledger._fd)
+            await Ledger._checkpoint()
+            os.close(Ledger._fd)
+            Ledger._fd = None
+
+
+Shards.register("ledger.scan", Ledger.scan)
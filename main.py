@@ -1,30 +1,144 @@
 # main.py
-from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, filters
+import os
+from startup import Startup  # first, so startup timing covers the imports below
+from dotenv import load_dotenv
+
+load_dotenv()  # before the project imports so config.py sees values from .env
+
+from telegram import Update
+from telegram.ext import ApplicationBuilder, CommandHandler, MessageHandler, TypeHandler, filters
 from command_handlers import CommandHandlers
 from message_handlers import MessageHandlers
 from telegram.ext import CallbackQueryHandler
-from telegram.ext import CallbackQueryHandler
 from callback_handlers import CallbackHandlers
-import os
-from dotenv import load_dotenv
-
-load_dotenv()
+from callback_codec import CALLBACK_PATTERN
+from data_manager import DataManager
+from ledger import Ledger
+from reconciliation import Reconciler
+from verification import Verifier
+from catalog_manager import CatalogManager
+from txid_index import TxidIndex
+from pending_queue import PendingQueue
+from coupons import Coupons
+from flood_control import FloodControl
+from notifier import Notifier
+from audit_log import AuditLog
+from store_persistence import StorePersistence
+from metrics import Metrics, InstrumentedRequest, UPDATE_QUEUE_DEPTH, configure_logging
+import config
 
 BOT_TOKEN = os.environ.get("BOT_TOKEN")
 
+Startup.mark("imports")
 
-if __name__ == "__main__":
-    app = ApplicationBuilder().token(BOT_TOKEN).build()
+
+async def warm_up(app):
+    """Load the stores and start the background jobs; runs after startup, ahead of the first update (see Startup)"""
+    await Ledger.load()
+    await CatalogManager.load()
+    await TxidIndex.load()
+    await PendingQueue.load()
+    await Coupons.load()
+    Reconciler.start(app.bot)
+    await Verifier.start(app.bot)
+
+
+async def on_startup(app):
+    UPDATE_QUEUE_DEPTH.set_function(app.update_queue.qsize)
+    await Metrics.start(config.METRICS_HOST, config.METRICS_PORT)
+    Startup.begin(warm_up(app))
+    Startup.mark("ready")
+
+
+async def on_stop(app):
+    # Flush notifications while the bot can still send; run_polling closes its HTTP client before post_shutdown
+    await Notifier.stop()
+
+
+async def on_shutdown(app):
+    await Startup.finish()
+    await Metrics.stop()
+    await Reconciler.stop()
+    await Verifier.stop()
+    await Notifier.stop()
+    await Ledger.close()
+    await DataManager.close()
+    AuditLog.stop()
+
+
+def build_application():
+    builder = (
+        ApplicationBuilder()
+        .token(BOT_TOKEN)
+        .request(InstrumentedRequest())
+        .persistence(StorePersistence(update_interval=config.PERSISTENCE_FLUSH_INTERVAL))
+        .post_init(on_startup)
+        .post_stop(on_stop)
+        .post_shutdown(on_shutdown)
+    )
+    if config.BOT_API_URL:
+        builder = builder.base_url(config.BOT_API_URL)
+    app = builder.build()
+    # Flood control sheds updates before anything else runs, including the warm-up wait
+    app.add_handler(TypeHandler(Update, FloodControl.gate), group=-2)
+    app.add_handler(TypeHandler(Update, Startup.gate), group=-1)
     app.add_handler(CommandHandler("start", CommandHandlers.start))
     app.add_handler(CommandHandler("addgift", CommandHandlers.add_giftcard))
     app.add_handler(CommandHandler("addservice", CommandHandlers.add_service))
     app.add_handler(CommandHandler("showpending", CommandHandlers.show_pending))
+    app.add_handler(CommandHandler("approve", CommandHandlers.approve_many))
+    app.add_handler(CommandHandler("reject", CommandHandlers.reject_many))
+    app.add_handler(CommandHandler("approveall", CommandHandlers.approve_all))
+    app.add_handler(CommandHandler("audit", CommandHandlers.audit))
+    app.add_handler(CommandHandler("reconcile", CommandHandlers.reconcile))
+    app.add_handler(CommandHandler("addcoupons", CommandHandlers.add_coupons))
+    app.add_handler(CommandHandler("addcodes", CommandHandlers.add_codes))
+    app.add_handler(CommandHandler("stock", CommandHandlers.stock))
+    # A single text handler; MessageHandlers.route picks the target from the user's state (admin notes included)
     app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, MessageHandlers.handle))
-    app.add_handler(CallbackQueryHandler(CommandHandlers.handle_admin_action))
-    app.add_handler(CallbackQueryHandler(CallbackHandlers.handle_callback))
-    app.add_handler(MessageHandler(filters.TEXT & ~filters.COMMAND, CallbackHandlers.handle_note_reply))
+    app.add_handler(CallbackQueryHandler(CommandHandlers.show_pending_page, pattern=r"^pending\|"))
+    app.add_handler(CallbackQueryHandler(CallbackHandlers.handle_purchase, pattern=r"^buy\|"))
+    # Every transaction button, current and legacy formats, is decoded by CallbackCodec in one handler
+    app.add_handler(CallbackQueryHandler(CallbackHandlers.handle_callback, pattern=CALLBACK_PATTERN))
     app.add_handler(CommandHandler("admin", CommandHandlers.admin))
+    for handler in app.handlers[0]:
+        handler.callback = FloodControl.limited(Metrics.timed(handler.callback))
+    return app
+
+
+if __name__ == "__main__":
+    configure_logging()
+    if config.BOT_MODE == "webhook" and config.SHARDS > 1:
+        from sharding import run_sharded
 
+        print(f"🤖 Bot is running ({config.SHARDS} shards behind webhook on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH})...")
+        run_sharded(
+            build_application,
+            config.SHARDS,
+            config.WEBHOOK_HOST,
+            config.WEBHOOK_PORT,
+            config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET,
+            public_url=config.WEBHOOK_URL,
+            bot_token=BOT_TOKEN,
+            queue_size=config.WEBHOOK_QUEUE_SIZE,
+            concurrency=config.WEBHOOK_CONCURRENCY,
+        )
+    elif config.BOT_MODE == "webhook":
+        import asyncio
+        from webhook import run_webhook
 
-    print("🤖 Bot is running...")
-    app.run_polling()
\ No newline at end of file
+        print(f"🤖 Bot is running (webhook on {config.WEBHOOK_HOST}:{config.WEBHOOK_PORT}{config.WEBHOOK_PATH})...")
+        asyncio.run(run_webhook(
+            build_application(),
+            config.WEBHOOK_HOST,
+            config.WEBHOOK_PORT,
+            config.WEBHOOK_PATH,
+            secret_token=config.WEBHOOK_SECRET,
+            public_url=config.WEBHOOK_URL,
+            queue_size=config.WEBHOOK_QUEUE_SIZE,
+            concurrency=config.WEBHOOK_CONCURRENCY,
+        ))
+    else:
+        print("🤖 Bot is running...")
+        build_application().run_polling()
\ No newline at end of file
@@ -1,12 +1,69 @@
 # menu_manager.py
+from telegram import ReplyKeyboardMarkup
+
+
 class MenuManager:
+    """
+    Builds the reply keyboards. Markups are immutable, so each menu is built
+    once per catalog version and the same object is reused for every reply;
+    /addgift and /addservice bump the version, which drops the cached set.
+    """
+    _markups = {}
+    _version = None
+
     @staticmethod
-    def main_menu(data):
-        return data.get("main_menu", [])
+    def main_menu(catalog):
+        return catalog.main_menu
 
     @staticmethod
-    def topup_menu(data):
-        topups = data.get("topups", [])
+    def topup_menu(catalog):
+        topups = catalog.topups
         buttons = [topups[i:i + 2] for i in range(0, len(topups), 2)]
         buttons.append(["Available balance", "Back ↩️"])
-        return buttons
\ No newline at end of file
+        return buttons
+
+    @staticmethod
+    def giftcard_menu(catalog):
+        cards = [catalog.giftcards[i:i + 2] for i in range(0, len(catalog.giftcards), 2)]
+        cards.append(["Back ↩️"])
+        return cards
+
+    @staticmethod
+    def services_menu(catalog):
+        services = [catalog.services[i:i + 2] for i in range(0, len(catalog.services), 2)]
+        services.append(["Back ↩️"])
+        return services
+
+    @staticmethod
+    def back_menu(catalog):
+        return [["Back ↩️"]]
+
+    @staticmethod
+    def admin_menu(catalog):
+        return [
+            ["📥 View Orders", "✅ Approve", "❌ Reject"],
+            ["🏠 Main Menu"]
+        ]
+
+    @staticmethod
+    def markup(menu, catalog):
+        """Return the ReplyKeyboardMarkup for `menu` ("main", "topups", ...), building it only on a cache miss"""
+        if MenuManager._version != catalog.version:
+            MenuManager._markups = {}
+            MenuManager._version = catalog.version
+        markup = MenuManager._markups.get(menu)
+        if markup is None:
+            markup = ReplyKeyboardMarkup(MENU_LAYOUTS[menu](catalog), resize_keyboard=True)
+            MenuManager._markups[menu] = markup
+        return markup
+
+
+# menu id -> function building its button rows from a catalog snapshot
+MENU_LAYOUTS = {
+    "main": MenuManager.main_menu,
+    "topups": MenuManager.topup_menu,
+    "giftcard": MenuManager.giftcard_menu,
+    "services": MenuManager.services_menu,
+    "back": MenuManager.back_menu,
+    "admin": MenuManager.admin_menu,
+}
@@ -1,129 +1,206 @@
-from telegram import Update, ReplyKeyboardMarkup, InlineKeyboardButton, InlineKeyboardMarkup
+from telegram import Update, InlineKeyboardButton, InlineKeyboardMarkup
 from telegram.ext import ContextTypes
 from data_manager import DataManager
+from ledger import Ledger, MAX_TXID_BYTES
+from catalog_manager import CatalogManager
+from txid_index import TxidIndex
+from pending_queue import PendingQueue
+from notifier import Notifier
 from menu_manager import MenuManager
-from config import ADMINS
-import re, datetime
+from callback_handlers import CallbackHandlers
+from callback_codec import CallbackCodec
+from metrics import Metrics
+from verification import Verifier
+from referrals import Referrals
+from coupons import Coupons
+from inventory import Inventory
+from config import ADMINS, REFERRAL_REWARD_RATE
+import re, datetime, html, logging, time
+
+logger = logging.getLogger(__name__)
 
 
 class MessageHandlers:
     @staticmethod
     async def handle(update: Update, context: ContextTypes.DEFAULT_TYPE):
         text = update.message.text
-        user_id = str(update.message.from_user.id)
-        data = DataManager.load()
-        menu = context.user_data.get("menu", "main")
-
-        # DEBUG: Show current user state
-        print(f"DEBUG: Received text: {text}")
-        print(f"DEBUG: context.user_data: {context.user_data}")
-
-        # 🔥 Handle expected transaction submission first
-        if context.user_data.get("expecting_tx"):
-            return await MessageHandlers._handle_transaction_submission(update, context, data, user_id, text)
-
-        # Back or Main Menu
-        if text == "Back ↩️" or text == "🏠 Main Menu":
-            return await MessageHandlers._go_to_main_menu(update, context, data)
-
-        # Menu route dispatcher
-        if menu == "main":
-            return await MessageHandlers._handle_main_menu(update, context, data, text, user_id)
-        elif menu == "giftcard":
-            return await MessageHandlers._handle_giftcard(update, context, data, text)
-        elif menu == "topups":
-            return await MessageHandlers._handle_topups(update, context, data, text, user_id)
-        elif menu == "referrals":
-            return await MessageHandlers._handle_referrals(update, context)
-        elif menu == "services":
-            return await MessageHandlers._handle_services(update, context, data, text)
+        handler = MessageHandlers.route(context.user_data, text)
+        # Sampled trace line instead of dumping user_data on every message
+        state = MessageHandlers.state(context.user_data) if Metrics.sampled() else None
+        started = time.perf_counter()
+        try:
+            return await handler(update, context)
+        finally:
+            elapsed = time.perf_counter() - started
+            ROUTE_SECONDS.observe(elapsed, route=handler.__qualname__)
+            if state is not None:
+                logger.info(f"trace user={update.effective_user.id} state={state} route={handler.__qualname__} took {elapsed * 1000:.2f} ms")
+
+    @staticmethod
+    def state(user_data):
+        """Current conversation state: a pending admin note or deposit TXID takes precedence over the menu"""
+        if user_data.get("awaiting_note_for"):
+            return "note"
+        if user_data.get("expecting_tx"):
+            return "deposit"
+        return user_data.get("menu", "main")
+
+    @staticmethod
+    def route(user_data, text):
+        """Pick the handler for a text message: one lookup in TEXT_ROUTES, else the state's fallback"""
+        state = MessageHandlers.state(user_data)
+        return TEXT_ROUTES.get((state, text)) or STATE_FALLBACKS.get(state, MessageHandlers._ignore)
+
+    @staticmethod
+    async def _ignore(update, context):
+        """Fallback for text that means nothing in the current state"""
+        return None
 
 
     # ---------- Menu Handlers ----------
 
     @staticmethod
-    async def _go_to_main_menu(update, context, data):
+    async def _go_to_main_menu(update, context):
         context.user_data['menu'] = 'main'
-        return await update.message.reply_text("🏠 Back to main menu:", reply_markup=ReplyKeyboardMarkup(MenuManager.main_menu(data), resize_keyboard=True))
+        catalog = await CatalogManager.get()
+        return await update.message.reply_text("🏠 Back to main menu:", reply_markup=MenuManager.markup("main", catalog))
+
+    @staticmethod
+    async def _open_giftcards(update, context):
+        context.user_data['menu'] = 'giftcard'
+        catalog = await CatalogManager.get()
+        return await update.message.reply_text("🎁 Choose Gift Card:", reply_markup=MenuManager.markup("giftcard", catalog))
+
+    @staticmethod
+    async def _open_topups(update, context):
+        context.user_data['menu'] = 'topups'
+        catalog = await CatalogManager.get()
+        return await update.message.reply_text("💰 Choose top-up method:", reply_markup=MenuManager.markup("topups", catalog))
 
     @staticmethod
-    async def _handle_main_menu(update, context, data, text, user_id):
-        if text == "🎁 Gift Card":
-            context.user_data['menu'] = 'giftcard'
-            cards = [data['giftcards'][i:i + 2] for i in range(0, len(data['giftcards']), 2)]
-            cards.append(["Back ↩️"])
-            return await update.message.reply_text("🎁 Choose Gift Card:", reply_markup=ReplyKeyboardMarkup(cards, resize_keyboard=True))
+    async def _open_referrals(update, context):
+        context.user_data['menu'] = 'referrals'
+        return await MessageHandlers._handle_referrals(update, context)
 
-        if text == "💸 Balance Top Ups":
-            context.user_data['menu'] = 'topups'
-            return await update.message.reply_text("💰 Choose top-up method:", reply_markup=ReplyKeyboardMarkup(MenuManager.topup_menu(data), resize_keyboard=True))
+    @staticmethod
+    async def _open_coupon(update, context):
+        context.user_data['menu'] = 'coupon'
+        catalog = await CatalogManager.get()
+        return await update.message.reply_text("🏷️ Send your coupon code:", reply_markup=MenuManager.markup("back", catalog))
 
-        if text == "👥 Referrals":
-            context.user_data['menu'] = 'referrals'
-            return await update.message.reply_text("👥 Referral menu (coming soon)", reply_markup=ReplyKeyboardMarkup([["Back ↩️"]], resize_keyboard=True))
+    @staticmethod
+    async def _open_services(update, context):
+        context.user_data['menu'] = 'services'
+        catalog = await CatalogManager.get()
+        return await update.message.reply_text("🎬 Choose a streaming service:", reply_markup=MenuManager.markup("services", catalog))
 
-        if text == "🎬 Streaming Service":
-            context.user_data['menu'] = 'services'
-            services = [data['services'][i:i + 2] for i in range(0, len(data['services']), 2)]
-            services.append(["Back ↩️"])
-            return await update.message.reply_text("🎬 Choose a streaming service:", reply_markup=ReplyKeyboardMarkup(services, resize_keyboard=True))
+    @staticmethod
+    async def _handle_giftcard(update, context):
+        text = update.message.text
+        if text in (await CatalogManager.get()).giftcards:
+            await MessageHandlers._offer(update, text)
 
     @staticmethod
-    async def _handle_giftcard(update, context, data, text):
-        if text in data['giftcards']:
-            await update.message.reply_text(f"✅ You selected {text}. Purchase flow coming soon!")
+    async def _handle_services(update, context):
+        text = update.message.text
+        if text in (await CatalogManager.get()).services:
+            await MessageHandlers._offer(update, text)
 
     @staticmethod
-    async def _handle_services(update, context, data, text):
-        if text in data['services']:
-            await update.message.reply_text(f"🎬 You selected {text}. More features coming soon!")
+    async def _offer(update, product):
+        """Show the product's price and stock; a code is reserved only when the user taps ✅ Buy"""
+        user_id = str(update.message.from_user.id)
+        stock = await Inventory.stock(product)
+        if not stock or not stock["available"]:
+            return await update.message.reply_text(f"😔 {product} is out of stock right now. Please check back later.")
+        balance = await Ledger.balance(user_id)
+        item = Inventory.item(product)
+        await update.message.reply_text(
+            f"🛒 {product}\n"
+            f"• Price: ${stock['price']:.2f}\n"
+            f"• Your balance: ${balance:.2f}",
+            reply_markup=InlineKeyboardMarkup([[
+                InlineKeyboardButton("✅ Buy", callback_data=f"buy|ok|{item}"),
+                InlineKeyboardButton("❌ Cancel", callback_data=f"buy|no|{item}"),
+            ]])
+        )
 
     @staticmethod
     async def _handle_referrals(update, context):
-        await update.message.reply_text("👥 Referral feature is under development.", reply_markup=ReplyKeyboardMarkup([["Back ↩️"]], resize_keyboard=True))
+        """The user's referral link and counters plus the leaderboard (both kept up to date by Referrals)"""
+        user_id = str(update.message.from_user.id)
+        stats = await Referrals.stats(user_id)
+        leaders = await Referrals.leaderboard()
+        lines = [
+            "👥 Invite friends with your referral link:",
+            Referrals.link(context.bot.username, user_id),
+            "",
+            f"• Friends joined: {stats['referees']}",
+            f"• Their approved deposits: {stats['deposits']}",
+            f"• Bonus earned: ${stats['rewards']:.2f} ({REFERRAL_REWARD_RATE:.0%} of each approved deposit)",
+        ]
+        if leaders:
+            lines += ["", "🏆 Top referrers:"]
+            lines += [
+                f"{rank}. {'You' if referrer == user_id else f'User …{referrer[-4:]}'}: {referees} friends, ${rewards:.2f}"
+                for rank, (referrer, referees, rewards) in enumerate(leaders, 1)
+            ]
+        catalog = await CatalogManager.get()
+        await update.message.reply_text("\n".join(lines), reply_markup=MenuManager.markup("back", catalog))
+
+    @staticmethod
+    async def _handle_coupon(update, context):
+        """Redeem the code the user sent; they stay in the coupon menu to try another one"""
+        result, amount, balance = await Coupons.redeem(update.message.from_user.id, update.message.text.strip())
+        catalog = await CatalogManager.get()
+        if result == "ok":
+            context.user_data['menu'] = 'main'
+            return await update.message.reply_text(
+                f"✅ Coupon applied!\n• Amount: ${amount:.2f}\n• New balance: ${balance:.2f}",
+                reply_markup=MenuManager.markup("main", catalog)
+            )
+        await update.message.reply_text(COUPON_ERRORS[result], reply_markup=MenuManager.markup("back", catalog))
 
     @staticmethod
-    async def _handle_topups(update, context, data, text, user_id):
+    async def _handle_topups(update, context):
+        text = update.message.text
+        user_id = str(update.message.from_user.id)
         if "Deposit" in text:
             match = re.match(r"^(.*?)\s*(\(|Deposit)", text)
             coin = match.group(1).strip() if match else text.replace(" Deposit", "").strip()
-            wallet_address = data.get("wallets", {}).get(coin, f"(dummy_wallet_address_for_{coin.lower()})")
+            catalog = await CatalogManager.get()
+            wallet_address = catalog.wallets.get(coin, f"(dummy_wallet_address_for_{coin.lower()})")
 
+            # One reply: the deposit instructions carry the "Made a Deposit?" hint themselves
             await update.message.reply_text(
-                f"Send only {coin} to the address below and then send your transaction ID by typing it here.\n\n"
+                f"Send only {html.escape(coin)} to the address below and then send your transaction ID by typing it here.\n\n"
                 f"💵 Minimum deposit: $100\n"
-                f"🔗 Wallet Address: `{wallet_address}`\n\n"
-                f"Once sent, click on Available Balance and then reply with your transaction hash/ID to submit.",
-                parse_mode="Markdown"
+                f"🔗 Wallet Address: <code>{html.escape(wallet_address)}</code>\n\n"
+                f"Once sent, click on Available Balance and then reply with your transaction hash/ID to submit.\n\n"
+                f"{DEPOSIT_HINT}",
+                parse_mode='HTML',
+                disable_web_page_preview=True
             )
             context.user_data['expecting_tx'] = coin
 
         elif text == "Available balance":
-            balance = data["balances"].get(user_id, {}).get("total_confirmed", 0)
+            balance = await Ledger.balance(user_id)
             await update.message.reply_text(f"Balance: 💲{balance:.2f}")
 
-        await update.message.reply_text(
-            "🗒\nMade a Deposit? Enter transaction ID here.\n\n"
-            "To obtain a <a href='https://youtu.be/yh6Oy-nkPd8?si=dhd_BSiE78-QIBsP'>transaction ID</a>, you can typically find it in your wallet or on the exchange platform.",
-            parse_mode='HTML',
-            disable_web_page_preview=True
-        )
+        else:
+            await update.message.reply_text(DEPOSIT_HINT, parse_mode='HTML', disable_web_page_preview=True)
 
     @staticmethod
-    async def _handle_transaction_submission(update, context, data, user_id, text):
+    async def _handle_transaction_submission(update, context):
+        user_id = str(update.message.from_user.id)
         coin = context.user_data['expecting_tx']
-        txid = text.strip()
+        txid = update.message.text.strip()
 
-        if not txid or len(txid) < 10:
+        if not txid or len(txid) < 10 or len(txid.encode("utf-8")) > MAX_TXID_BYTES:
             return await update.message.reply_text("⚠️ Invalid transaction ID format. Please check and try again.")
 
-        for uid, info in data["balances"].items():
-            for txn in info.get("transactions", []):
-                if txn["txid"] == txid:
-                    return await update.message.reply_text("⚠️ This transaction ID was already submitted.")
-
-        if user_id not in data['balances']:
-            data['balances'][user_id] = {"transactions": [], "total_confirmed": 0}
+        if not await TxidIndex.claim(txid, user_id):
+            return await update.message.reply_text("⚠️ This transaction ID was already submitted.")
 
         transaction = {
             "crypto": coin,
@@ -133,15 +210,32 @@ class MessageHandlers:
             "timestamp": datetime.datetime.now().isoformat()
         }
 
-        data['balances'][user_id]['transactions'].append(transaction)
+        # The claim is only kept if the ledger took the transaction; otherwise the TXID could never be submitted again
+        try:
+            appended = await Ledger.append(user_id, transaction)
+        except Exception as e:
+            logger.error(f"Error recording transaction {txid} for {user_id}: {e}")
+            appended = None
+        if not appended:
+            await TxidIndex.release(txid)
+            if appended is None:
+                return await update.message.reply_text("⚠️ Could not record your transaction. Please try again later.")
+            return await update.message.reply_text("⚠️ This transaction ID was already submitted.")
         DataManager.log_transaction("Transaction Submitted", user_id, txid, 100, "pending")
-        DataManager.save(data)
+        await PendingQueue.add(user_id, transaction)
         context.user_data['expecting_tx'] = None
+        verifying = await Verifier.submit(user_id, txid, coin)
 
-        await update.message.reply_text(
-            "📝 Transaction submitted for admin review. You'll be notified when processed.\n\n"
-            "⚠️ Note: Processing may take up to 24 hours."
-        )
+        if verifying:
+            await update.message.reply_text(
+                "📝 Transaction submitted. It will be approved automatically once it is confirmed on-chain; "
+                "you'll be notified when processed."
+            )
+        else:
+            await update.message.reply_text(
+                "📝 Transaction submitted for admin review. You'll be notified when processed.\n\n"
+                "⚠️ Note: Processing may take up to 24 hours."
+            )
 
         user = update.message.from_user
         username = f"@{user.username}" if user.username else "No username"
@@ -154,23 +248,63 @@ class MessageHandlers:
             f"💵 Amount: $100\n"
             f"🕐 Submitted: {datetime.datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
             f"📊 Status: Pending"
+            + ("\n🤖 Verifying on-chain, approves automatically once confirmed" if verifying else "")
         )
 
+        data = await CallbackCodec.encode(user_id, txid, "approve", "reject", "note")
         keyboard = InlineKeyboardMarkup([
             [
-                InlineKeyboardButton("✅ Approve", callback_data=f"approve|{user.id}|{txid}"),
-                InlineKeyboardButton("❌ Reject", callback_data=f"reject|{user.id}|{txid}")
+                InlineKeyboardButton("✅ Approve", callback_data=data["approve"]),
+                InlineKeyboardButton("❌ Reject", callback_data=data["reject"])
             ],
-            [InlineKeyboardButton("📝 Add Note", callback_data=f"note|{user.id}|{txid}")]
+            [InlineKeyboardButton("📝 Add Note", callback_data=data["note"])]
         ])
 
+        async def remember_alert(message):
+            # Lets bulk approvals edit this alert once the transaction is settled
+            await PendingQueue.remember_alert(txid, message.chat_id, message.message_id)
+
         for admin_id in ADMINS:
-            try:
-                await context.bot.send_message(
-                    chat_id=admin_id,
-                    text=msg,
-                    parse_mode="Markdown",
-                    reply_markup=keyboard
-                )
-            except Exception as e:
-                print(f"Failed to notify admin {admin_id}: {e}")
+            Notifier.send(context.bot, admin_id, msg, on_sent=remember_alert, parse_mode="Markdown", reply_markup=keyboard)
+
+
+# Every menu a user can be in; "Back ↩️" and "🏠 Main Menu" lead home from all of them
+MENUS = ("main", "giftcard", "topups", "referrals", "coupon", "services", "admin")
+
+# (state, button text) -> handler for the fixed buttons
+TEXT_ROUTES = {
+    ("main", "🎁 Gift Card"): MessageHandlers._open_giftcards,
+    ("main", "💸 Balance Top Ups"): MessageHandlers._open_topups,
+    ("main", "👥 Referrals"): MessageHandlers._open_referrals,
+    ("main", "🏷️ Apply Coupon"): MessageHandlers._open_coupon,
+    ("main", "🎬 Streaming Service"): MessageHandlers._open_services,
+    **{(menu, text): MessageHandlers._go_to_main_menu for menu in MENUS for text in ("Back ↩️", "🏠 Main Menu")},
+}
+
+# state -> handler for free text and catalog-driven buttons (gift cards, services, deposit methods)
+STATE_FALLBACKS = {
+    "note": CallbackHandlers.handle_note_reply,
+    "deposit": MessageHandlers._handle_transaction_submission,
+    "giftcard": MessageHandlers._handle_giftcard,
+    "topups": MessageHandlers._handle_topups,
+    "referrals": MessageHandlers._handle_referrals,
+    "coupon": MessageHandlers._handle_coupon,
+    "services": MessageHandlers._handle_services,
+}
+
+DEPOSIT_HINT = (
+    "🗒\nMade a Deposit? Enter transaction ID here.\n\n"
+    "To obtain a <a href='https://youtu.be/yh6Oy-nkPd8?si=dhd_BSiE78-QIBsP'>transaction ID</a>, you can typically find it in your wallet or on the exchange platform."
+)
+
+# Coupons.redeem result -> reply
+COUPON_ERRORS = {
+    "invalid": "❌ Invalid coupon code.",
+    "expired": "⌛ This coupon has expired.",
+    "used_up": "⚠️ This coupon has already been fully redeemed.",
+    "already_used": "⚠️ You have already used this coupon.",
+    "throttled": "⏳ Too many invalid codes. Please try again later.",
+}
+
+# Latency of each text route (MessageHandlers.handle as a whole is timed with the other handlers)
+ROUTE_SECONDS = Metrics.histogram("telebot_route_seconds", "Time spent in the handler a text message was routed to")
@@ -0,0 +1,256 @@
+# metrics.py
+import bisect
+import functools
+import logging
+import math
+import random
+import time
+from contextlib import contextmanager
+
+from telegram.request import HTTPXRequest
+
+from config import TRACE_SAMPLE_RATE, LOG_LEVEL
+from shards import Shards
+
+logger = logging.getLogger(__name__)
+
+LOG_FORMAT = "%(asctime)s - %(name)s - %(levelname)s - %(message)s"
+
+# Seconds; covers an in-memory cache hit up to a slow Bot API call
+LATENCY_BUCKETS = (0.0005, 0.001, 0.0025, 0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0)
+
+
+def configure_logging():
+    """Process-wide log setup, called by the entry points (main.py and each shard process), never on import"""
+    logging.basicConfig(format=LOG_FORMAT, level=LOG_LEVEL)
+    # httpx logs every request URL at INFO, and those URLs contain the bot token
+    logging.getLogger("httpx").setLevel(logging.WARNING)
+
+
+def _key(labels):
+    return tuple(sorted((name, str(value)) for name, value in labels.items()))
+
+
+def _format_value(value):
+    if value == math.inf:
+        return "+Inf"
+    return repr(float(value)) if isinstance(value, float) else str(value)
+
+
+def _escape(value):
+    return value.replace("\\", "\\\\").replace('"', '\\"').replace("\n", "\\n")
+
+
+def _format_labels(labels):
+    if not labels:
+        return ""
+    return "{" + ",".join(f'{name}="{_escape(value)}"' for name, value in labels) + "}"
+
+
+class Counter:
+    kind = "counter"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+
+    def inc(self, amount=1, **labels):
+        key = _key(labels)
+        self.values[key] = self.values.get(key, 0) + amount
+
+    def samples(self):
+        return [(self.name, key, value) for key, value in self.values.items()]
+
+
+class Gauge:
+    kind = "gauge"
+
+    def __init__(self, name, help):
+        self.name = name
+        self.help = help
+        self.values = {}
+        self.function = None
+
+    def set(self, value, **labels):
+        self.values[_key(labels)] = value
+
+    def set_function(self, function):
+        """Read the unlabelled value from function() at scrape time (None means no value)"""
+        self.function = function
+
+    def samples(self):
+        values = dict(self.values)
+        if self.function is not None:
+            value = self.function()
+            if value is not None:
+                values[()] = value
+        return [(self.name, key, value) for key, value in values.items()]
+
+
+class Histogram:
+    kind = "histogram"
+
+    def __init__(self, name, help, buckets=LATENCY_BUCKETS):
+        self.name = name
+        self.help = help
+        self.buckets = tuple(buckets)
+        self.series = {}  # labels -> [count per bucket..., count above the last bucket, sum]
+
+    def observe(self, value, **labels):
+        key = _key(labels)
+        series = self.series.get(key)
+        if series is None:
+            series = self.series[key] = [0] * (len(self.buckets) + 1) + [0.0]
+        series[bisect.bisect_left(self.buckets, value)] += 1
+        series[-1] += value
+
+    @contextmanager
+    def time(self, **labels):
+        started = time.perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(time.perf_counter() - started, **labels)
+
+    def samples(self):
+        samples = []
+        for key, series in self.series.items():
+            total = 0
+            for bound, count in zip(self.buckets + (math.inf,), series[:-1]):
+                total += count
+                samples.append((f"{self.name}_bucket", key + (("le", _format_value(bound)),), total))
+            samples.append((f"{self.name}_sum", key, series[-1]))
+            samples.append((f"{self.name}_count", key, total))
+        return samples
+
+
+class Metrics:
+    """
+    In-process metrics in the Prometheus text format, served on a local
+    /metrics endpoint. Modules create their metrics at import time with
+    Metrics.counter/gauge/histogram and update them inline; nothing is
+    computed until a scrape. Under sharding the coordinator serves the
+    endpoint and collects every shard's samples with a shard label.
+    """
+    _registry = {}
+    _runner = None
+
+    @staticmethod
+    def _register(metric):
+        return Metrics._registry.setdefault(metric.name, metric)
+
+    @staticmethod
+    def counter(name, help):
+        return Metrics._register(Counter(name, help))
+
+    @staticmethod
+    def gauge(name, help):
+        return Metrics._register(Gauge(name, help))
+
+    @staticmethod
+    def histogram(name, help, buckets=LATENCY_BUCKETS):
+        return Metrics._register(Histogram(name, help, buckets))
+
+    @staticmethod
+    def timed(callback):
+        """Wrap a handler callback so its latency and failures are recorded under its qualified name"""
+        name = getattr(callback, "__qualname__", repr(callback))
+
+        @functools.wraps(callback)
+        async def wrapper(update, context):
+            started = time.perf_counter()
+            try:
+                return await callback(update, context)
+            except Exception:
+                HANDLER_ERRORS.inc(handler=name)
+                raise
+            finally:
+                HANDLER_SECONDS.observe(time.perf_counter() - started, handler=name)
+        return wrapper
+
+    @staticmethod
+    def sampled():
+        """True for about TRACE_SAMPLE_RATE of calls; gates per-update trace logging"""
+        return TRACE_SAMPLE_RATE > 0 and random.random() < TRACE_SAMPLE_RATE
+
+    @staticmethod
+    async def local_samples():
+        """[(kind, name, help, samples)] for this process"""
+        return [(metric.kind, metric.name, metric.help, metric.samples()) for metric in Metrics._registry.values()]
+
+    @staticmethod
+    async def render():
+        if Shards.count == 1:
+            families = await Metrics.local_samples()
+        else:
+            families = {}
+            for shard, part in enumerate(await Shards.gather("metrics.samples")):
+                for kind, name, help, samples in part:
+                    family = families.setdefault(name, (kind, name, help, []))
+                    family[3].extend((sample, (("shard", str(shard)),) + key, value) for sample, key, value in samples)
+            families = list(families.values())
+
+        lines = []
+        for kind, name, help, samples in families:
+            lines.append(f"# HELP {name} {help}")
+            lines.append(f"# TYPE {name} {kind}")
+            for sample, key, value in samples:
+                lines.append(f"{sample}{_format_labels(key)} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+    @staticmethod
+    async def _handle(request):
+        from aiohttp import web
+
+        return web.Response(text=await Metrics.render(), content_type="text/plain", charset="utf-8",
+                            headers={"X-Content-Type-Options": "nosniff"})
+
+    @staticmethod
+    async def start(host, port):
+        """Serve GET /metrics on host:port (port 0 disables it; only the coordinator serves under sharding)"""
+        if not port or not Shards.is_coordinator() or Metrics._runner is not None:
+            return
+        from aiohttp import web  # only needed when the endpoint is enabled
+
+        app = web.Application()
+        app.router.add_get("/metrics", Metrics._handle)
+        Metrics._runner = web.AppRunner(app, access_log=None)
+        await Metrics._runner.setup()
+        await web.TCPSite(Metrics._runner, host, port).start()
+        logger.info(f"Metrics on http://{host}:{port}/metrics")
+
+    @staticmethod
+    async def stop():
+        if Metrics._runner is not None:
+            await Metrics._runner.cleanup()
+            Metrics._runner = None
+
+
+class InstrumentedRequest(HTTPXRequest):
+    """HTTPXRequest that records Bot API call latency, failures and 429 (flood control) responses per method"""
+
+    async def do_request(self, url, *args, **kwargs):
+        method = url.rsplit("/", 1)[-1]
+        started = time.perf_counter()
+        try:
+            code, payload = await super().do_request(url, *args, **kwargs)
+        except Exception:
+            API_ERRORS.inc(method=method)
+            raise
+        finally:
+            API_SECONDS.observe(time.perf_counter() - started, method=method)
+        if code == 429:
+            API_THROTTLED.inc(method=method)
+        return code, payload
+
+
+HANDLER_SECONDS = Metrics.histogram("telebot_handler_seconds", "Time spent in update handlers")
+HANDLER_ERRORS = Metrics.counter("telebot_handler_errors_total", "Update handlers that raised")
+STARTUP_SECONDS = Metrics.gauge("telebot_startup_seconds", "Seconds from process start to each startup phase")
+UPDATE_QUEUE_DEPTH = Metrics.gauge("telebot_update_queue_depth", "Updates received but not yet processed")
+API_SECONDS = Metrics.histogram("telebot_telegram_api_seconds", "Bot API call latency")
+API_ERRORS = Metrics.counter("telebot_telegram_api_errors_total", "Bot API calls that failed without a response")
+API_THROTTLED = Metrics.counter("telebot_telegram_api_throttled_total", "Bot API calls answered with 429 Too Many Requests")
+
+Shards.register("metrics.samples", Metrics.local_samples)
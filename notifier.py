@@ -0,0 +1,177 @@
+# notifier.py
+import asyncio
+import logging
+import time
+from collections import deque
+
+from telegram.error import RetryAfter, Forbidden, BadRequest
+
+from config import NOTIFY_CONCURRENCY, NOTIFY_GLOBAL_RATE, NOTIFY_PER_CHAT_INTERVAL, NOTIFY_MAX_ATTEMPTS
+from rate_limit import TokenBucket
+from shards import Shards
+
+logger = logging.getLogger(__name__)
+
+MAX_MESSAGE_LENGTH = 4096
+
+
+class Notifier:
+    """
+    Background fan-out for outgoing bot messages.
+
+    Handlers call Notifier.send() or Notifier.edit() and return immediately. A fixed pool of
+    workers drains per-chat queues while respecting Telegram's global and
+    per-chat limits, honours RetryAfter, and merges bursts of plain text
+    messages to the same chat into a single message.
+    """
+    _chats = {}         # chat_id -> deque of pending messages
+    _scheduled = set()  # chats currently waiting in _ready or being worked on
+    _next_allowed = {}  # chat_id -> monotonic time of the next permitted send
+    _ready = None
+    _workers = []
+    _bucket = None
+    _paused_until = 0.0
+
+    @staticmethod
+    def send(bot, chat_id, text, on_sent=None, **kwargs):
+        """Queue a message for delivery; never blocks the caller. `await on_sent(message)` runs once it is delivered."""
+        Notifier._queue(chat_id, {"bot": bot, "method": "send_message", "text": text, "kwargs": kwargs, "on_sent": on_sent})
+
+    @staticmethod
+    def edit(bot, chat_id, message_id, text, **kwargs):
+        """Queue an edit of a message sent earlier, under the same rate limits as send()"""
+        Notifier._queue(chat_id, {"bot": bot, "method": "edit_message_text", "text": text, "kwargs": dict(kwargs, message_id=message_id), "on_sent": None})
+
+    @staticmethod
+    def _queue(chat_id, message):
+        Notifier._ensure_started()
+        message["attempts"] = 0
+        Notifier._chats.setdefault(chat_id, deque()).append(message)
+        Notifier._schedule(chat_id)
+
+    @staticmethod
+    def pending():
+        """Number of messages still waiting to be sent"""
+        return sum(len(messages) for messages in Notifier._chats.values())
+
+    @staticmethod
+    def _ensure_started():
+        if Notifier._workers and not all(worker.done() for worker in Notifier._workers):
+            return
+        loop = asyncio.get_running_loop()
+        Notifier._ready = asyncio.Queue()
+        # The Bot API limit is per token, so sharded workers split it between them
+        Notifier._bucket = TokenBucket(NOTIFY_GLOBAL_RATE / Shards.count)
+        Notifier._scheduled = set()
+        Notifier._workers = [loop.create_task(Notifier._worker()) for _ in range(NOTIFY_CONCURRENCY)]
+        for chat_id, messages in Notifier._chats.items():
+            if messages:
+                Notifier._schedule(chat_id)
+
+    @staticmethod
+    def _schedule(chat_id, delay=0.0):
+        if chat_id in Notifier._scheduled:
+            return
+        Notifier._scheduled.add(chat_id)
+        if delay > 0:
+            asyncio.get_running_loop().call_later(delay, Notifier._ready.put_nowait, chat_id)
+        else:
+            Notifier._ready.put_nowait(chat_id)
+
+    @staticmethod
+    def _coalesce(messages):
+        """Pop the next message, merging following plain-text messages that share its formatting"""
+        first = messages.popleft()
+        if first["method"] != "send_message" or first["on_sent"] or first["kwargs"].get("reply_markup") is not None:
+            return first
+        text = first["text"]
+        while messages:
+            candidate = messages[0]
+            if candidate["method"] != "send_message" or candidate["on_sent"]:
+                break
+            if candidate["kwargs"] != first["kwargs"] or candidate["bot"] is not first["bot"]:
+                break
+            if len(text) + 2 + len(candidate["text"]) > MAX_MESSAGE_LENGTH:
+                break
+            text = f"{text}\n\n{messages.popleft()['text']}"
+        return dict(first, text=text)
+
+    @staticmethod
+    async def _worker():
+        while True:
+            chat_id = await Notifier._ready.get()
+            Notifier._scheduled.discard(chat_id)
+            messages = Notifier._chats.get(chat_id)
+            if not messages:
+                Notifier._chats.pop(chat_id, None)
+                continue
+
+            wait = max(Notifier._next_allowed.get(chat_id, 0.0), Notifier._paused_until) - time.monotonic()
+            if wait > 0:
+                Notifier._schedule(chat_id, wait)
+                continue
+
+            Notifier._scheduled.add(chat_id)  # keep other workers off this chat while we send
+            message = Notifier._coalesce(messages)
+            await Notifier._bucket.acquire()
+            delay = await Notifier._deliver(chat_id, message, messages)
+            Notifier._next_allowed[chat_id] = time.monotonic() + max(NOTIFY_PER_CHAT_INTERVAL, delay)
+            Notifier._scheduled.discard(chat_id)
+
+            if messages:
+                Notifier._schedule(chat_id, Notifier._next_allowed[chat_id] - time.monotonic())
+            else:
+                Notifier._chats.pop(chat_id, None)
+                Notifier._next_allowed.pop(chat_id, None)
+
+    @staticmethod
+    async def _deliver(chat_id, message, messages):
+        """Send one message; on failure requeue it and return how long this chat should back off"""
+        try:
+            sent = await getattr(message["bot"], message["method"])(chat_id=chat_id, text=message["text"], **message["kwargs"])
+        except RetryAfter as e:
+            retry_after = getattr(e.retry_after, "total_seconds", lambda: e.retry_after)()
+            # Flood control applies to the whole bot, so every chat pauses
+            Notifier._paused_until = time.monotonic() + retry_after
+            messages.appendleft(message)
+            logger.warning(f"Rate limited by Telegram, pausing sends for {retry_after}s")
+            return retry_after
+        except (Forbidden, BadRequest) as e:
+            logger.error(f"Failed to notify {chat_id}: {e}")
+            return 0.0
+        except Exception as e:
+            message["attempts"] += 1
+            if message["attempts"] >= NOTIFY_MAX_ATTEMPTS:
+                logger.error(f"Giving up notifying {chat_id} after {message['attempts']} attempts: {e}")
+                return 0.0
+            messages.appendleft(message)
+            return 2 ** message["attempts"]
+
+        if message["on_sent"] is not None:
+            try:
+                await message["on_sent"](sent)
+            except Exception as e:
+                logger.error(f"on_sent callback failed for a message to {chat_id}: {e}")
+        return 0.0
+
+    @staticmethod
+    async def stop(timeout=10.0):
+        """
+        Give queued messages up to `timeout` seconds to go out, then stop the
+        workers and drop what is left. Calling it again is a no-op.
+        """
+        if not Notifier._workers:
+            return
+        deadline = time.monotonic() + timeout
+        while Notifier.pending() and time.monotonic() < deadline:
+            await asyncio.sleep(0.05)
+        for worker in Notifier._workers:
+            worker.cancel()
+        await asyncio.gather(*Notifier._workers, return_exceptions=True)
+        Notifier._workers = []
+        dropped = Notifier.pending()
+        Notifier._chats = {}
+        Notifier._scheduled = set()
+        Notifier._next_allowed = {}
+        if dropped:
+            logger.warning(f"Dropped {dropped} undelivered notifications on shutdown")
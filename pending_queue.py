@@ -0,0 +1,206 @@
+# pending_queue.py
+import asyncio
+from bisect import bisect_left, bisect_right
+
+from data_manager import DataManager
+from ledger import Ledger
+from metrics import Metrics
+from shards import Shards
+
+PENDING_KEY = "pending"
+
+
+class PendingQueue:
+    """
+    Status index of transactions waiting for an admin decision.
+
+    Entries are ordered by a monotonically increasing sequence number, which
+    doubles as the pagination cursor. Removals leave a tombstone in the
+    sorted sequence list that is compacted away once they pile up; the ends
+    of the list are trimmed straight away, so they are always the oldest and
+    newest live entries and a page knows in O(1) whether more lie on either
+    side. The persisted document holds every live entry, so each write
+    re-serializes the whole queue; the write-back cache coalesces those
+    into one per flush. When sharded, the queue lives on the coordinator shard.
+    """
+    _doc = None      # persisted form: {"next_seq": int, "items": {str(seq): entry}}
+    _entries = None  # seq -> entry
+    _by_txid = {}    # txid -> seq
+    _seqs = []       # sorted seqs, may contain removed ones
+    _init_lock = asyncio.Lock()
+
+    @staticmethod
+    async def load():
+        if PendingQueue._entries is not None or not Shards.is_coordinator():
+            return
+        async with PendingQueue._init_lock:
+            if PendingQueue._entries is not None:
+                return
+            doc = await DataManager.store().get(PENDING_KEY)
+            rebuilt = doc is None
+            if rebuilt:
+                doc = await PendingQueue._rebuild_doc()
+            PendingQueue._doc = doc
+            PendingQueue._entries = {entry["seq"]: entry for entry in doc["items"].values()}
+            PendingQueue._by_txid = {entry["txid"]: entry["seq"] for entry in doc["items"].values()}
+            PendingQueue._seqs = sorted(PendingQueue._entries)
+            if rebuilt:
+                await PendingQueue._persist()
+
+    @staticmethod
+    async def _rebuild_doc():
+        """Collect pending transactions from the ledger (first run or lost index)"""
+        found = [
+            (txn.get("timestamp", ""), user_id, txn)
+            for user_id, txn in await Ledger.all_transactions()
+            if txn["status"] == "pending"
+        ]
+        found.sort(key=lambda item: item[0])
+        items = {str(seq): PendingQueue._entry(seq, user_id, txn) for seq, (_, user_id, txn) in enumerate(found, 1)}
+        return {"next_seq": len(items) + 1, "items": items}
+
+    @staticmethod
+    def _entry(seq, user_id, txn):
+        return {
+            "seq": seq,
+            "user_id": str(user_id),
+            "txid": txn["txid"],
+            "crypto": txn["crypto"],
+            "amount": txn["amount"],
+            "timestamp": txn.get("timestamp")
+        }
+
+    @staticmethod
+    async def _persist():
+        # The write-back cache only marks the document dirty; serialization happens once per flush
+        await DataManager.store().put(PENDING_KEY, PendingQueue._doc)
+
+    @staticmethod
+    async def add(user_id, txn):
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("pending.add", user_id, txn)
+        await PendingQueue.load()
+        if txn["txid"] in PendingQueue._by_txid:
+            return
+        seq = PendingQueue._doc["next_seq"]
+        PendingQueue._doc["next_seq"] += 1
+        entry = PendingQueue._entry(seq, user_id, txn)
+        PendingQueue._doc["items"][str(seq)] = entry
+        PendingQueue._entries[seq] = entry
+        PendingQueue._by_txid[txn["txid"]] = seq
+        PendingQueue._seqs.append(seq)  # seqs only grow, so the list stays sorted
+        await PendingQueue._persist()
+
+    @staticmethod
+    async def remove(txid):
+        """Drop a transaction once it has been approved or rejected"""
+        await PendingQueue.remove_many([txid])
+
+    @staticmethod
+    async def remove_many(txids):
+        """Drop several settled transactions with a single write; returns the entries that were removed"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("pending.remove_many", txids)
+        await PendingQueue.load()
+        removed = []
+        for txid in txids:
+            seq = PendingQueue._by_txid.pop(txid, None)
+            if seq is None:
+                continue
+            removed.append(PendingQueue._entries.pop(seq))
+            del PendingQueue._doc["items"][str(seq)]
+        if not removed:
+            return removed
+        seqs, entries = PendingQueue._seqs, PendingQueue._entries
+        while seqs and seqs[-1] not in entries:
+            seqs.pop()
+        start = 0
+        while start < len(seqs) and seqs[start] not in entries:
+            start += 1
+        del seqs[:start]
+        if len(seqs) > 2 * len(entries) + 64:
+            PendingQueue._seqs = [s for s in seqs if s in entries]
+        await PendingQueue._persist()
+        return removed
+
+    @staticmethod
+    async def select(txids=None, seqs=None, max_amount=None):
+        """
+        Copies of pending entries picked by txid or by seq (default: all, oldest
+        first), optionally only those of at most max_amount.
+        """
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("pending.select", txids, seqs, max_amount)
+        await PendingQueue.load()
+        entries = PendingQueue._entries
+        if txids is not None:
+            seqs = [PendingQueue._by_txid[txid] for txid in txids if txid in PendingQueue._by_txid]
+        found = [entries[seq] for seq in (PendingQueue._seqs if seqs is None else seqs) if seq in entries]
+        if max_amount is not None:
+            found = [entry for entry in found if entry["amount"] <= max_amount]
+        return [dict(entry) for entry in found]
+
+    @staticmethod
+    async def remember_alert(txid, chat_id, message_id):
+        """Record an admin alert message for a pending transaction so it can be edited once settled"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("pending.remember_alert", txid, chat_id, message_id)
+        await PendingQueue.load()
+        seq = PendingQueue._by_txid.get(txid)
+        if seq is None:
+            return
+        PendingQueue._entries[seq].setdefault("alerts", []).append([chat_id, message_id])
+        await PendingQueue._persist()
+
+    @staticmethod
+    async def count():
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("pending.count")
+        await PendingQueue.load()
+        return len(PendingQueue._entries)
+
+    @staticmethod
+    async def page(after=0, before=None, limit=10):
+        """
+        Return (entries, prev_cursor, next_cursor) for one page.
+
+        Pass after=<seq> to page forward or before=<seq> to page backward.
+        A cursor is None when there is nothing further in that direction.
+        """
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("pending.page", after, before, limit)
+        await PendingQueue.load()
+        seqs, entries = PendingQueue._seqs, PendingQueue._entries
+        page = []
+        if before is None:
+            i = bisect_right(seqs, after)
+            while i < len(seqs) and len(page) < limit:
+                if seqs[i] in entries:
+                    page.append(entries[seqs[i]])
+                i += 1
+        else:
+            i = bisect_left(seqs, before) - 1
+            while i >= 0 and len(page) < limit:
+                if seqs[i] in entries:
+                    page.append(entries[seqs[i]])
+                i -= 1
+            page.reverse()
+
+        if not page:
+            return page, None, None
+        # Both ends of _seqs are live (see remove_many), so they bound what lies before and after the page
+        has_prev = seqs[0] < page[0]["seq"]
+        has_next = seqs[-1] > page[-1]["seq"]
+        return page, page[0]["seq"] if has_prev else None, page[-1]["seq"] if has_next else None
+
+
+Shards.register("pending.add", PendingQueue.add)
+Shards.register("pending.remove_many", PendingQueue.remove_many)
+Shards.register("pending.select", PendingQueue.select)
+Shards.register("pending.remember_alert", PendingQueue.remember_alert)
+Shards.register("pending.count", PendingQueue.count)
+Shards.register("pending.page", PendingQueue.page)
+
+# Only the coordinator holds the queue; other shards report no value
+PENDING_TRANSACTIONS = Metrics.gauge("telebot_pending_transactions", "Deposits waiting for admin review")
+PENDING_TRANSACTIONS.set_function(lambda: None if PendingQueue._entries is None else len(PendingQueue._entries))
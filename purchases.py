@@ -0,0 +1,89 @@
+# purchases.py
+import datetime
+
+from data_manager import DataManager
+from inventory import Inventory
+from ledger import Ledger
+from metrics import Metrics
+from shards import Shards
+
+PURCHASE_CRYPTO = "Purchase"
+
+
+class Purchases:
+    """
+    Checkout of a reserved gift card / service code, run on the buyer's shard:
+    hold the reservation, debit the balance (Ledger.debit checks and takes it
+    atomically), then mark the code sold, or put it back on sale if the
+    balance doesn't cover it.
+    """
+
+    @staticmethod
+    async def buy(user_id, item):
+        """
+        Reserve a code of the product with id `item` (see Inventory.item) and pay
+        for it. Returns checkout()'s (result, order), or ("sold_out", None).
+        """
+        reservation = await Inventory.reserve(item, user_id)
+        if reservation is None:
+            PURCHASES.inc(result="sold_out")
+            return "sold_out", None
+        return await Purchases.checkout(user_id, reservation["id"])
+
+    @staticmethod
+    async def checkout(user_id, rid):
+        """
+        Pay for reservation rid. Returns (result, order); result is "ok",
+        "expired" or "insufficient", and order has product, price, code and the
+        new balance (just the balance when it was insufficient).
+        """
+        user_id = str(user_id)
+        held = await Inventory.hold(rid, user_id)
+        if held is None:
+            PURCHASES.inc(result="expired")
+            return "expired", None
+        product, price, code = held
+
+        now = datetime.datetime.now().isoformat()
+        txn = {"crypto": PURCHASE_CRYPTO, "txid": f"buy-{rid}", "amount": price, "timestamp": now, "processed_at": now}
+        try:
+            balance, debited = await Ledger.debit(user_id, txn)
+        except Exception:
+            await Inventory.release(rid, user_id)
+            raise
+        if not debited:
+            await Inventory.release(rid, user_id)
+            PURCHASES.inc(result="insufficient")
+            return "insufficient", {"balance": balance}
+
+        await Inventory.commit(rid, user_id)
+        # Codes are free text, so the order lives in the user's record like admin notes
+        async with DataManager.transaction(user_id) as data:
+            data.setdefault("orders", []).append({"id": rid, "product": product, "price": price, "code": code, "timestamp": now})
+        DataManager.log_transaction("Purchase", user_id, txn["txid"], price, "approved")
+        PURCHASES.inc(result="ok")
+        return "ok", {"product": product, "price": price, "code": code, "balance": balance}
+
+    @staticmethod
+    async def recover(user_id, rid, product, price, code):
+        """
+        Settle a checkout the inventory found interrupted: if its debit is in the
+        ledger, make sure the order is in the user's record and return True;
+        return False if the user was never charged.
+        """
+        txn = await Ledger.find(user_id, f"buy-{rid}")
+        if txn is None:
+            return False
+        async with DataManager.transaction(user_id) as data:
+            orders = data.setdefault("orders", [])
+            recorded = any(order["id"] == rid for order in orders)
+            if not recorded:
+                orders.append({"id": rid, "product": product, "price": price, "code": code, "timestamp": txn["timestamp"]})
+        if not recorded:
+            DataManager.log_transaction("Purchase", user_id, txn["txid"], price, "approved")
+        return True
+
+
+PURCHASES = Metrics.counter("telebot_purchases_total", "Gift card and service checkouts by result")
+
+Shards.register("purchases.recover", Purchases.recover)
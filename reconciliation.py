@@ -0,0 +1,140 @@
+# reconciliation.py
+import asyncio
+import logging
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor
+
+from config import ADMINS, RECONCILE_INTERVAL, RECONCILE_WORKERS, RECONCILE_CHUNK_RECORDS
+from ledger import Ledger, RECORD, SUBMIT, STATUS, STATUSES
+from notifier import Notifier
+from shards import Shards
+
+logger = logging.getLogger(__name__)
+
+APPROVED = STATUSES.index("approved")
+REPORT_LIMIT = 20
+
+
+def _sum_approved(path, start, end):
+    """Sum approved amounts (in cents) per user over the records in path[start:end]. Runs in a worker process."""
+    totals = {}
+    with open(path, "rb") as f:
+        f.seek(start)
+        payload = f.read(end - start)
+    for kind, status, _, user_id, cents, _, _, _ in RECORD.iter_unpack(payload):
+        # A settled transaction is either a STATUS record or, once compacted, a SUBMIT record in its final state
+        if status == APPROVED and kind in (SUBMIT, STATUS):
+            totals[user_id] = totals.get(user_id, 0) + cents
+    return totals
+
+
+class Reconciler:
+    """
+    Periodically recomputes every balance from the approved transactions in
+    the ledger and compares it with the materialized balances reads are
+    served from. Large ledgers are split into record-aligned chunks summed
+    in a process pool. Drift is reported, never corrected automatically.
+    """
+    _task = None
+    _pool = None
+
+    @staticmethod
+    def start(bot):
+        """Start the background job (RECONCILE_INTERVAL seconds apart; 0 disables it)"""
+        if RECONCILE_INTERVAL > 0 and (Reconciler._task is None or Reconciler._task.done()):
+            Reconciler._task = asyncio.get_running_loop().create_task(Reconciler._loop(bot))
+
+    @staticmethod
+    async def _loop(bot):
+        while True:
+            await asyncio.sleep(RECONCILE_INTERVAL)
+            try:
+                drift = await Reconciler.run()
+            except Exception as e:
+                logger.error(f"Balance reconciliation failed: {e}")
+                continue
+            if drift:
+                for admin_id in ADMINS:
+                    Notifier.send(bot, admin_id, Reconciler.format_report(drift))
+
+    @staticmethod
+    async def run():
+        """
+        Reconcile this shard's ledger. Returns {user_id: (materialized, recomputed)}
+        for every user whose balance disagrees with the ledger.
+        """
+        path, size, balances = await Ledger.snapshot()
+        chunk = RECONCILE_CHUNK_RECORDS * RECORD.size
+        ranges = [(start, min(start + chunk, size)) for start in range(0, size, chunk)]
+
+        try:
+            if len(ranges) <= 1:
+                parts = [await asyncio.to_thread(_sum_approved, path, 0, size)]
+            else:
+                loop = asyncio.get_running_loop()
+                pool = Reconciler._executor()
+                parts = await asyncio.gather(*(loop.run_in_executor(pool, _sum_approved, path, start, end) for start, end in ranges))
+        except FileNotFoundError:
+            # Compaction replaced the ledger file after the snapshot; the next round picks up the new one
+            logger.info("Ledger was compacted during reconciliation, skipping this round")
+            return {}
+
+        recomputed = {}
+        for part in parts:
+            for user_id, cents in part.items():
+                recomputed[str(user_id)] = recomputed.get(str(user_id), 0) + cents
+
+        drift = {}
+        for user_id in set(balances) | set(recomputed):
+            materialized = balances.get(user_id, 0)
+            cents = recomputed.get(user_id, 0)
+            if round(materialized * 100) != cents:
+                drift[user_id] = (materialized, cents / 100)
+        if drift:
+            logger.warning(f"Balance drift for {len(drift)} users on shard {Shards.index}: {dict(list(drift.items())[:REPORT_LIMIT])}")
+        else:
+            logger.info(f"Balances on shard {Shards.index} match the ledger ({len(recomputed)} users with approved deposits)")
+        return drift
+
+    @staticmethod
+    async def run_all():
+        """run() on every shard, merged"""
+        if Shards.count == 1:
+            return await Reconciler.run()
+        drift = {}
+        for part in await Shards.gather("reconcile.run"):
+            drift.update(part)
+        return drift
+
+    @staticmethod
+    def format_report(drift):
+        if not drift:
+            return "✅ All balances match the ledger."
+        lines = [f"⚠️ Balance drift found for {len(drift)} users:\n"]
+        for user_id, (materialized, recomputed) in sorted(drift.items())[:REPORT_LIMIT]:
+            lines.append(f"User {user_id}: balance ${materialized:.2f} | ledger ${recomputed:.2f}")
+        if len(drift) > REPORT_LIMIT:
+            lines.append(f"... and {len(drift) - REPORT_LIMIT} more")
+        return "\n".join(lines)
+
+    @staticmethod
+    def _executor():
+        if Reconciler._pool is None:
+            Reconciler._pool = ProcessPoolExecutor(max_workers=RECONCILE_WORKERS, mp_context=multiprocessing.get_context("spawn"))
+        return Reconciler._pool
+
+    @staticmethod
+    async def stop():
+        if Reconciler._task is not None:
+            Reconciler._task.cancel()
+            try:
+                await Reconciler._task
+            except asyncio.CancelledError:
+                pass
+            Reconciler._task = None
+        if Reconciler._pool is not None:
+            await asyncio.to_thread(Reconciler._pool.shutdown)
+            Reconciler._pool = None
+
+
+Shards.register("reconcile.run", Reconciler.run)
@@ -0,0 +1,223 @@
+# referrals.py
+import asyncio
+import datetime
+import hashlib
+import logging
+import re
+import zlib
+
+from config import REFERRAL_REWARD_RATE, REFERRAL_LEADERBOARD_SIZE
+from data_manager import DataManager
+from ledger import Ledger
+from metrics import Metrics
+from shards import Shards
+
+logger = logging.getLogger(__name__)
+
+BUCKETS = 256
+TOP_KEY = "ref_top"
+BONUS_CRYPTO = "Referral bonus"
+
+# /start deep-link payload: t.me/<bot>?start=ref_<referrer id>
+PAYLOAD = re.compile(r"^ref_(\d{1,20})$")
+
+
+def _empty_stats():
+    return {"referees": [], "deposits": 0, "rewards": 0}
+
+
+class Referrals:
+    """
+    Referral attribution, per-referrer counters and the leaderboard.
+
+    referee -> referrer and referrer -> stats (referees, rewarded deposits,
+    reward total) are hash tables spread over BUCKETS store documents each,
+    so a /start or an approval touches one small document. The counters are
+    updated incrementally as referees join and deposits are approved, and
+    the top REFERRAL_LEADERBOARD_SIZE referrers are kept in one sorted
+    document. Scores only ever grow, so a referrer outside it can only get in
+    by passing the last entry and the leaderboard never needs a scan.
+    When sharded, everything lives on the coordinator shard.
+    """
+    _buckets = {}  # store key -> {user_id: referrer} or {user_id: stats}
+    _top = None    # [[referrer, referees, rewards], ...], best first
+
+    @staticmethod
+    def parse_payload(args):
+        """Referrer id from /start arguments, or None"""
+        match = PAYLOAD.match(args[0]) if args else None
+        return match.group(1) if match else None
+
+    @staticmethod
+    def link(bot_username, user_id):
+        return f"https://t.me/{bot_username}?start=ref_{user_id}"
+
+    @staticmethod
+    def _bucket_key(prefix, user_id):
+        return f"{prefix}_{zlib.crc32(str(user_id).encode('utf-8')) % BUCKETS:02x}"
+
+    @staticmethod
+    async def _bucket(key):
+        bucket = Referrals._buckets.get(key)
+        if bucket is None:
+            doc = await DataManager.store().get(key) or {}
+            # A concurrent caller may have loaded the same bucket while we were waiting
+            bucket = Referrals._buckets.setdefault(key, doc)
+        return bucket
+
+    @staticmethod
+    async def _leaderboard():
+        if Referrals._top is None:
+            top = (await DataManager.store().get(TOP_KEY) or {}).get("entries", [])
+            if Referrals._top is None:
+                Referrals._top = top
+        return Referrals._top
+
+    @staticmethod
+    def _score(stats):
+        return len(stats["referees"]), stats["rewards"]
+
+    @staticmethod
+    def rank_key(entry):
+        """Sort key for a (referrer, referees, rewards) entry, best last; ties go to the lower user id"""
+        return entry[1], entry[2], -int(entry[0])
+
+    @staticmethod
+    def _rank(referrer, stats):
+        """Move a referrer whose score just grew into place; returns True if the leaderboard changed"""
+        top = Referrals._top
+        entry = next((entry for entry in top if entry[0] == referrer), None)
+        if entry is None:
+            candidate = (referrer, *Referrals._score(stats))
+            if len(top) >= REFERRAL_LEADERBOARD_SIZE and Referrals.rank_key(candidate) <= Referrals.rank_key(top[-1]):
+                return False
+            entry = [referrer, 0, 0]
+            top.append(entry)
+        entry[1], entry[2] = Referrals._score(stats)
+        top.sort(key=Referrals.rank_key, reverse=True)
+        del top[REFERRAL_LEADERBOARD_SIZE:]
+        return True
+
+    @staticmethod
+    async def record(referrer, referee):
+        """Attribute referee to referrer. Returns False for self-referrals and users already attributed."""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("referrals.record", referrer, referee)
+        referrer, referee = str(referrer), str(referee)
+        if referrer == referee:
+            return False
+        by_key, stats_key = Referrals._bucket_key("ref_by", referee), Referrals._bucket_key("ref_stats", referrer)
+        by, stats_bucket = await Referrals._bucket(by_key), await Referrals._bucket(stats_key)
+        await Referrals._leaderboard()
+        # No await from the check to the updates, so concurrent /starts can't attribute a user twice
+        if referee in by:
+            return False
+        by[referee] = referrer
+        stats = stats_bucket.setdefault(referrer, _empty_stats())
+        stats["referees"].append(referee)
+        ranked = Referrals._rank(referrer, stats)
+
+        store = DataManager.store()
+        await store.put(by_key, by)
+        await store.put(stats_key, stats_bucket)
+        if ranked:
+            await store.put(TOP_KEY, {"entries": Referrals._top})
+        REFERRALS.inc(event="joined")
+        return True
+
+    @staticmethod
+    async def attribute_deposits(deposits):
+        """
+        Count approved deposits [(user_id, txid, amount)] towards their referrers'
+        totals. Returns the bonuses to pay as [(referrer, txid, reward)].
+        """
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("referrals.attribute_deposits", deposits)
+        found = []
+        for user_id, txid, amount in deposits:
+            referrer = (await Referrals._bucket(Referrals._bucket_key("ref_by", user_id))).get(str(user_id))
+            reward = round(amount * REFERRAL_REWARD_RATE, 2)
+            if referrer is not None and reward > 0:
+                found.append((referrer, txid, reward))
+        if not found:
+            return found
+
+        await Referrals._leaderboard()
+        dirty, ranked = set(), False
+        for referrer, _, reward in found:
+            key = Referrals._bucket_key("ref_stats", referrer)
+            stats = (await Referrals._bucket(key)).setdefault(referrer, _empty_stats())
+            stats["deposits"] += 1
+            stats["rewards"] = round(stats["rewards"] + reward, 2)
+            ranked = Referrals._rank(referrer, stats) or ranked
+            dirty.add(key)
+
+        store = DataManager.store()
+        for key in dirty:
+            await store.put(key, Referrals._buckets[key])
+        if ranked:
+            await store.put(TOP_KEY, {"entries": Referrals._top})
+        return found
+
+    @staticmethod
+    async def reward(deposits):
+        """
+        Pay referral bonuses for deposits [(user_id, txid, amount)] that were just
+        approved: one ledger append per shard holding referrers. Failures are
+        logged and never undo the approval.
+        """
+        if REFERRAL_REWARD_RATE <= 0 or not deposits:
+            return
+        try:
+            by_shard = {}
+            for bonus in await Referrals.attribute_deposits(deposits):
+                by_shard.setdefault(Shards.owner(bonus[0]), []).append(bonus)
+            await asyncio.gather(*(Shards.call(shard, "referrals.credit_local", bonuses) for shard, bonuses in by_shard.items()))
+        except Exception as e:
+            logger.error(f"Failed to pay referral bonuses for {len(deposits)} deposits: {e}")
+
+    @staticmethod
+    async def credit_local(bonuses):
+        """
+        Credit bonuses [(referrer, txid, reward)] for referrers on this shard. Each
+        bonus txid is derived from its deposit's, so a deposit pays out once.
+        """
+        now = datetime.datetime.now().isoformat()
+        items = [
+            (referrer, {
+                "crypto": BONUS_CRYPTO,
+                "txid": f"ref-{hashlib.blake2b(txid.encode('utf-8'), digest_size=16).hexdigest()}",
+                "amount": reward,
+                "timestamp": now,
+                "processed_at": now,
+            })
+            for referrer, txid, reward in bonuses
+        ]
+        for (referrer, bonus), (_, credited) in zip(items, await Ledger.credit_many(items)):
+            if credited:
+                DataManager.log_transaction("Referral Bonus", referrer, bonus["txid"], bonus["amount"], "approved")
+                REFERRALS.inc(event="rewarded")
+
+    @staticmethod
+    async def stats(referrer):
+        """{"referees": count, "deposits": count, "rewards": total} for one referrer"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("referrals.stats", referrer)
+        stats = (await Referrals._bucket(Referrals._bucket_key("ref_stats", referrer))).get(str(referrer), _empty_stats())
+        return {"referees": len(stats["referees"]), "deposits": stats["deposits"], "rewards": stats["rewards"]}
+
+    @staticmethod
+    async def leaderboard(limit=REFERRAL_LEADERBOARD_SIZE):
+        """Top referrers as [(referrer, referees, rewards)], best first"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("referrals.leaderboard", limit)
+        return [tuple(entry) for entry in (await Referrals._leaderboard())[:limit]]
+
+
+Shards.register("referrals.record", Referrals.record)
+Shards.register("referrals.attribute_deposits", Referrals.attribute_deposits)
+Shards.register("referrals.credit_local", Referrals.credit_local)
+Shards.register("referrals.stats", Referrals.stats)
+Shards.register("referrals.leaderboard", Referrals.leaderboard)
+
+REFERRALS = Metrics.counter("telebot_referrals_total", "Referred users who joined and referral bonuses paid")
@@ -0,0 +1,213 @@
+# sharding.py
+import asyncio
+import logging
+import multiprocessing
+import os
+import queue as queue_module
+import signal
+import threading
+
+from telegram import Update
+
+from config import STORAGE_BACKEND, DATA_DIRECTORY, AUDIT_DIRECTORY
+from metrics import UPDATE_QUEUE_DEPTH, configure_logging
+from shards import Shards, shard_for
+from webhook import WebhookServer, update_shard_key
+
+logger = logging.getLogger(__name__)
+
+STOP = ("stop",)
+
+
+class ShardPool:
+    """
+    N worker processes, each running its own Application over its own slice of users.
+
+    Every shard has a bounded update queue fed by route() and an unbounded
+    control queue carrying Shards RPC traffic. Shutdown is two-phase: all
+    shards first drain their updates (which may still call into each other),
+    and only then is the control channel closed.
+    """
+
+    def __init__(self, application_factory, shards, queue_size=1000, concurrency=16):
+        ctx = multiprocessing.get_context("spawn")
+        self.shards = shards
+        self.updates = [ctx.Queue(maxsize=max(1, queue_size // shards)) for _ in range(shards)]
+        self.controls = [ctx.Queue() for _ in range(shards)]
+        self.drained = ctx.Queue()
+        self.processes = [
+            ctx.Process(
+                target=_shard_main,
+                args=(index, shards, self.updates[index], self.controls, self.drained, application_factory, concurrency),
+                name=f"shard-{index}",
+            )
+            for index in range(shards)
+        ]
+
+    def start(self):
+        for process in self.processes:
+            process.start()
+
+    def route(self, data, block=False):
+        """Queue a raw update on the shard that owns its sender; False if that shard is full"""
+        try:
+            self.updates[shard_for(update_shard_key(data), self.shards)].put(data, block=block)
+        except queue_module.Full:
+            return False
+        return True
+
+    def stop(self):
+        """Blocking two-phase shutdown; returns the number of updates each shard processed"""
+        for updates in self.updates:
+            updates.put(None)
+        processed = {}
+        for _ in range(self.shards):
+            index, count = self.drained.get()
+            processed[index] = count
+        for controls in self.controls:
+            controls.put(STOP)
+        for process in self.processes:
+            process.join()
+        return [processed[index] for index in range(self.shards)]
+
+
+class ShardDispatcher(WebhookServer):
+    """Webhook endpoint that only routes updates to shard processes; it never runs handlers itself"""
+
+    def __init__(self, pool, host, port, path, secret_token=None):
+        super().__init__(None, host, port, path, secret_token, queue_size=1, concurrency=1)
+        self.pool = pool
+
+    def enqueue(self, data):
+        return self.pool.route(data)
+
+    async def start(self):
+        await self.start_http()
+
+    async def stop(self):
+        if self.runner is not None:
+            await self.runner.cleanup()
+
+
+def run_sharded(application_factory, shards, host, port, path, secret_token=None, public_url=None,
+                bot_token=None, queue_size=1000, concurrency=16):
+    """Run `shards` worker processes behind a single webhook until SIGINT/SIGTERM"""
+    pool = ShardPool(application_factory, shards, queue_size, concurrency)
+    pool.start()
+    try:
+        asyncio.run(_dispatch(pool, host, port, path, secret_token, public_url, bot_token))
+    finally:
+        processed = pool.stop()
+        logger.info(f"Shards stopped, updates processed per shard: {processed}")
+
+
+async def _dispatch(pool, host, port, path, secret_token, public_url, bot_token):
+    if public_url:
+        from telegram import Bot
+
+        async with Bot(bot_token) as bot:
+            await bot.set_webhook(url=f"{public_url.rstrip('/')}{path}", secret_token=secret_token)
+
+    server = ShardDispatcher(pool, host, port, path, secret_token)
+    await server.start()
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+
+
+# ---------- Worker process ----------
+
+def _shard_main(index, count, updates, controls, drained, application_factory, concurrency):
+    # The dispatcher owns shutdown; a Ctrl+C in the terminal must not kill shards mid-update
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+    configure_logging()
+
+    from audit_log import AuditLog
+    from data_manager import DataManager
+    from ledger import Ledger
+    from storage import create_store
+
+    shard_directory = os.path.join(DATA_DIRECTORY, f"shard_{index}")
+    DataManager.use_store(create_store(STORAGE_BACKEND, shard_directory, os.path.join(shard_directory, "telebot.db")))
+    Ledger.configure(os.path.join(shard_directory, "ledger"))
+    AuditLog.configure(os.path.join(AUDIT_DIRECTORY, f"shard_{index}"))
+    asyncio.run(_serve_shard(index, count, updates, controls, drained, application_factory, concurrency))
+
+
+async def _serve_shard(index, count, updates, controls, drained, application_factory, concurrency):
+    loop = asyncio.get_running_loop()
+    Shards.attach(index, count, controls, loop)
+    lanes = [asyncio.Queue(maxsize=64) for _ in range(concurrency)]
+    updates_done = asyncio.Event()
+    stopped = asyncio.Event()
+    processed = 0
+
+    def pump_control():
+        while True:
+            message = controls[index].get()
+            if message == STOP:
+                loop.call_soon_threadsafe(stopped.set)
+                return
+            loop.call_soon_threadsafe(Shards.receive, message)
+
+    def pump_updates():
+        while True:
+            data = updates.get()
+            if data is None:
+                loop.call_soon_threadsafe(updates_done.set)
+                return
+            # Users on this shard all share crc % count == index, so pick the lane from the quotient
+            lane = lanes[shard_for(update_shard_key(data), count * concurrency) // count]
+            asyncio.run_coroutine_threadsafe(lane.put(data), loop).result()
+
+    def queue_depth():
+        try:
+            backlog = updates.qsize()
+        except NotImplementedError:  # multiprocessing queues can't report their size on macOS
+            backlog = 0
+        return backlog + sum(lane.qsize() for lane in lanes)
+
+    async def lane_worker(lane):
+        nonlocal processed
+        while True:
+            data = await lane.get()
+            try:
+                await application.process_update(Update.de_json(data, application.bot))
+                processed += 1
+            except Exception as e:
+                logger.error(f"Shard {index} failed to process update {data.get('update_id')}: {e}")
+            finally:
+                lane.task_done()
+
+    # Control traffic must flow before startup: non-coordinator shards load the catalog over RPC
+    threading.Thread(target=pump_control, name=f"shard-{index}-control", daemon=True).start()
+    application = application_factory()
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    UPDATE_QUEUE_DEPTH.set_function(queue_depth)
+
+    workers = [asyncio.create_task(lane_worker(lane)) for lane in lanes]
+    threading.Thread(target=pump_updates, name=f"shard-{index}-updates", daemon=True).start()
+
+    await updates_done.wait()
+    await asyncio.gather(*(lane.join() for lane in lanes))
+    drained.put((index, processed))
+
+    # Keep answering other shards until every shard has drained
+    await stopped.wait()
+    for worker in workers:
+        worker.cancel()
+    await asyncio.gather(*workers, return_exceptions=True)
+    await application.stop()
+    if application.post_stop:
+        await application.post_stop(application)
+    await application.shutdown()
+    if application.post_shutdown:
+        await application.post_shutdown(application)
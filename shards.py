@@ -0,0 +1,113 @@
+# shards.py
+import asyncio
+import itertools
+import logging
+import zlib
+
+logger = logging.getLogger(__name__)
+
+COORDINATOR = 0  # shard that owns the global documents (catalog, txid index, pending queue)
+
+
+def shard_for(key, count):
+    """Stable key -> shard mapping shared by the dispatcher and the workers"""
+    return zlib.crc32(str(key).encode("utf-8")) % count
+
+
+class Shards:
+    """
+    This process's view of the shard layout, plus a tiny RPC bus between shards.
+
+    In the default single-process setup count is 1, every check below is
+    local and no message ever leaves the process. Under sharding.run_sharded
+    each worker process owns the users that hash to it; code that touches
+    another user's record or a global index forwards the call with
+    Shards.call(), and the receiving shard runs the operation registered
+    under that name.
+    """
+    count = 1
+    index = 0
+    _controls = []  # per-shard control queues (multiprocessing.Queue), indexed by shard
+    _ops = {}
+    _calls = {}     # call_id -> Future awaiting a reply
+    _call_ids = itertools.count(1)
+    _loop = None
+
+    @staticmethod
+    def owner(user_id):
+        return shard_for(user_id, Shards.count)
+
+    @staticmethod
+    def is_local(user_id):
+        return Shards.count == 1 or Shards.owner(user_id) == Shards.index
+
+    @staticmethod
+    def is_coordinator():
+        return Shards.index == COORDINATOR
+
+    @staticmethod
+    def register(name, func):
+        """Expose a coroutine function to other shards under name"""
+        Shards._ops[name] = func
+        return func
+
+    @staticmethod
+    async def call(shard, name, *args):
+        """Run a registered operation on the given shard and return its result"""
+        if shard == Shards.index:
+            return await Shards._ops[name](*args)
+        call_id = next(Shards._call_ids)
+        future = Shards._loop.create_future()
+        Shards._calls[call_id] = future
+        Shards._controls[shard].put(("call", call_id, Shards.index, name, args))
+        try:
+            return await future
+        finally:
+            Shards._calls.pop(call_id, None)
+
+    @staticmethod
+    async def call_owner(user_id, name, *args):
+        return await Shards.call(Shards.owner(user_id), name, *args)
+
+    @staticmethod
+    async def call_coordinator(name, *args):
+        return await Shards.call(COORDINATOR, name, *args)
+
+    @staticmethod
+    async def gather(name, *args):
+        """Run an operation on every shard and return the results in shard order"""
+        return await asyncio.gather(*(Shards.call(shard, name, *args) for shard in range(Shards.count)))
+
+    # ---------- Transport (used by sharding.py) ----------
+
+    @staticmethod
+    def attach(index, count, controls, loop):
+        Shards.index = index
+        Shards.count = count
+        Shards._controls = controls
+        Shards._loop = loop
+
+    @staticmethod
+    def receive(message):
+        """Handle a control message on the event loop thread"""
+        kind = message[0]
+        if kind == "call":
+            Shards._loop.create_task(Shards._answer(*message[1:]))
+        elif kind == "reply":
+            _, call_id, result, error = message
+            future = Shards._calls.get(call_id)
+            if future is None or future.done():
+                return
+            if error is not None:
+                future.set_exception(RuntimeError(f"Remote shard error: {error}"))
+            else:
+                future.set_result(result)
+
+    @staticmethod
+    async def _answer(call_id, reply_to, name, args):
+        try:
+            result, error = await Shards._ops[name](*args), None
+        except Exception as e:
+            logger.error(f"Shard {Shards.index} failed running {name}: {e}")
+            result, error = None, repr(e)
+        Shards._controls[reply_to].put(("reply", call_id, result, error))
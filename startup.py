@@ -0,0 +1,61 @@
+# startup.py
+import asyncio
+import logging
+import time
+
+logger = logging.getLogger(__name__)
+
+
+class Startup:
+    """
+    Cold-start timing and background warm-up.
+
+    main.py imports this module first, so `started` is taken before the
+    telegram imports. Store warm-up (ledger replay, catalog, indexes) runs as
+    a background task once the application is up, so update intake starts
+    right away; gate() runs ahead of every handler and makes the first
+    updates wait for whatever warm-up is left.
+    """
+    started = time.perf_counter()
+    phases = {}  # phase -> seconds since `started`
+    _warm_up = None
+
+    @staticmethod
+    def mark(phase):
+        """Record the first time a phase is reached"""
+        if phase not in Startup.phases:
+            Startup.phases[phase] = time.perf_counter() - Startup.started
+            from metrics import STARTUP_SECONDS  # imported here: this module loads before telegram
+
+            STARTUP_SECONDS.set(round(Startup.phases[phase], 6), phase=phase)
+
+    @staticmethod
+    def begin(warm_up):
+        """Run the warm-up coroutine in the background"""
+        Startup._warm_up = asyncio.get_running_loop().create_task(Startup._run(warm_up))
+
+    @staticmethod
+    async def _run(warm_up):
+        try:
+            await warm_up
+        except Exception as e:
+            # Everything warmed up here also loads on first use, so the bot keeps working
+            logger.error(f"Startup warm-up failed, loading on demand instead: {e}")
+        Startup.mark("warm")
+        logger.info("Startup: " + ", ".join(f"{phase} {seconds * 1000:.0f} ms" for phase, seconds in Startup.phases.items()))
+
+    @staticmethod
+    async def gate(update, context):
+        """Runs before the handlers of every update (group -1): waits for warm-up, times the first update"""
+        if Startup._warm_up is not None and not Startup._warm_up.done():
+            await asyncio.shield(Startup._warm_up)
+        if "first_update" not in Startup.phases:
+            Startup.mark("first_update")
+            logger.info(f"Startup: first update after {Startup.phases['first_update'] * 1000:.0f} ms")
+
+    @staticmethod
+    async def finish():
+        """Let a running warm-up complete before shutdown closes what it is loading"""
+        if Startup._warm_up is not None:
+            await asyncio.shield(Startup._warm_up)
+            Startup._warm_up = None
@@ -0,0 +1,160 @@
+# storage.py
+import abc
+import asyncio
+import json
+import logging
+import os
+import threading
+
+logger = logging.getLogger(__name__)
+
+
+class BaseStore(abc.ABC):
+    """Async document store used by DataManager. Documents are JSON-compatible dicts addressed by a string key."""
+
+    @abc.abstractmethod
+    async def get(self, key):
+        """Return the document stored under key, or None if it does not exist"""
+
+    @abc.abstractmethod
+    async def put(self, key, doc):
+        """Create or replace the document stored under key"""
+
+    @abc.abstractmethod
+    async def delete(self, key):
+        """Remove the document stored under key (no-op if missing)"""
+
+    @abc.abstractmethod
+    async def keys(self, prefix=""):
+        """Return all keys starting with prefix"""
+
+    async def close(self):
+        """Release any resources held by the store"""
+
+
+class JsonFileStore(BaseStore):
+    """Fallback store: one JSON file per key, with file I/O offloaded to a worker thread."""
+
+    def __init__(self, directory):
+        self.directory = directory
+        os.makedirs(directory, exist_ok=True)
+
+    def _path(self, key):
+        return os.path.join(self.directory, f"{key}.json")
+
+    def _read(self, key):
+        try:
+            with open(self._path(key), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except FileNotFoundError:
+            return None
+
+    def _write(self, key, doc):
+        # Write to a temp file and rename over the target so readers never see a partial file
+        path = self._path(key)
+        tmp_path = f"{path}.{os.getpid()}.{threading.get_ident()}.tmp"
+        with open(tmp_path, "w", encoding="utf-8") as f:
+            json.dump(doc, f, indent=4)
+            f.flush()
+            os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+
+    def _remove(self, key):
+        try:
+            os.remove(self._path(key))
+        except FileNotFoundError:
+            pass
+
+    def _list(self, prefix):
+        return [
+            name[:-len(".json")]
+            for name in os.listdir(self.directory)
+            if name.endswith(".json") and name.startswith(prefix)
+        ]
+
+    async def get(self, key):
+        return await asyncio.to_thread(self._read, key)
+
+    async def put(self, key, doc):
+        # Serialize on the event loop so the worker thread never sees a dict that is being mutated
+        payload = json.loads(json.dumps(doc))
+        await asyncio.to_thread(self._write, key, payload)
+
+    async def delete(self, key):
+        await asyncio.to_thread(self._remove, key)
+
+    async def keys(self, prefix=""):
+        return await asyncio.to_thread(self._list, prefix)
+
+
+class SQLiteStore(BaseStore):
+    """aiosqlite-backed store keeping every document as a row in a single table."""
+
+    def __init__(self, path):
+        self.path = path
+        self._db = None
+        self._connect_lock = asyncio.Lock()
+
+    async def _conn(self):
+        if self._db is None:
+            async with self._connect_lock:
+                if self._db is None:
+                    import aiosqlite
+
+                    os.makedirs(os.path.dirname(self.path) or ".", exist_ok=True)
+                    db = await aiosqlite.connect(self.path)
+                    await db.execute("PRAGMA journal_mode=WAL")
+                    await db.execute("PRAGMA synchronous=NORMAL")
+                    await db.execute("CREATE TABLE IF NOT EXISTS documents (key TEXT PRIMARY KEY, value TEXT NOT NULL)")
+                    await db.commit()
+                    self._db = db
+        return self._db
+
+    async def get(self, key):
+        db = await self._conn()
+        async with db.execute("SELECT value FROM documents WHERE key = ?", (key,)) as cursor:
+            row = await cursor.fetchone()
+        return json.loads(row[0]) if row else None
+
+    async def put(self, key, doc):
+        db = await self._conn()
+        await db.execute(
+            "INSERT INTO documents (key, value) VALUES (?, ?) ON CONFLICT(key) DO UPDATE SET value = excluded.value",
+            (key, json.dumps(doc)),
+        )
+        await db.commit()
+
+    async def delete(self, key):
+        db = await self._conn()
+        await db.execute("DELETE FROM documents WHERE key = ?", (key,))
+        await db.commit()
+
+    async def keys(self, prefix=""):
+        db = await self._conn()
+        async with db.execute("SELECT key FROM documents WHERE key LIKE ? ESCAPE '\\'", (_like_prefix(prefix),)) as cursor:
+            rows = await cursor.fetchall()
+        return [row[0] for row in rows]
+
+    async def close(self):
+        if self._db is not None:
+            await self._db.close()
+            self._db = None
+
+
+def _like_prefix(prefix):
+    escaped = prefix.replace("\\", "\\\\").replace("%", "\\%").replace("_", "\\_")
+    return f"{escaped}%"
+
+
+def create_store(backend, data_directory, sqlite_path):
+    """Build the configured store, falling back to JSON files when aiosqlite is unavailable"""
+    if backend == "sqlite":
+        try:
+            import aiosqlite  # noqa: F401
+        except ImportError:
+            logger.warning("aiosqlite is not installed, falling back to the JSON file store")
+        else:
+            return SQLiteStore(sqlite_path)
+    elif backend != "json":
+        raise ValueError(f"Unknown storage backend: {backend}")
+    return JsonFileStore(data_directory)
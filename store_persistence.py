@@ -0,0 +1,126 @@
+# store_persistence.py
+import json
+import zlib
+
+from telegram.ext import BasePersistence, PersistenceInput
+
+from data_manager import DataManager
+
+SESSION_BUCKETS = 64
+CONVERSATIONS_KEY = "conversations"
+
+
+def _session_key(user_id):
+    return f"sessions_{zlib.crc32(str(user_id).encode('utf-8')) % SESSION_BUCKETS:02x}"
+
+
+def _jsonable(data):
+    """Copy the values that survive a JSON round trip (menu, expecting_tx, awaiting_note_for, ...)"""
+    kept = {}
+    for key, value in data.items():
+        try:
+            # A copy, so later in-place changes to user_data (e.g. a list) still compare as changed
+            kept[str(key)] = json.loads(json.dumps(value))
+        except (TypeError, ValueError):
+            continue
+    return kept
+
+
+class StorePersistence(BasePersistence):
+    """
+    Persists context.user_data (the menu/deposit/note flow state) in the DataManager store as JSON.
+
+    Sessions are grouped into SESSION_BUCKETS documents by user id, so startup
+    reads a fixed number of documents and a flush rewrites only the buckets
+    that changed. The application already batches calls to update_user_data
+    every `update_interval` seconds; on top of that the write-back cache
+    coalesces the bucket writes, so nothing here runs per message.
+    """
+
+    def __init__(self, update_interval=60):
+        super().__init__(
+            store_data=PersistenceInput(bot_data=False, chat_data=False, user_data=True, callback_data=False),
+            update_interval=update_interval,
+        )
+        self._buckets = {}
+
+    async def _bucket(self, key):
+        bucket = self._buckets.get(key)
+        if bucket is None:
+            bucket = self._buckets.setdefault(key, await DataManager.store().get(key) or {})
+        return bucket
+
+    async def get_user_data(self):
+        user_data = {}
+        for key in await DataManager.store().keys("sessions_"):
+            for user_id, data in (await self._bucket(key)).items():
+                user_data[int(user_id)] = dict(data)
+        return user_data
+
+    async def update_user_data(self, user_id, data):
+        key = _session_key(user_id)
+        bucket = await self._bucket(key)
+        session = _jsonable(data)
+        if session == bucket.get(str(user_id), {}):
+            return
+        if session:
+            bucket[str(user_id)] = session
+        else:
+            bucket.pop(str(user_id), None)
+        await DataManager.store().put(key, bucket)
+
+    async def drop_user_data(self, user_id):
+        key = _session_key(user_id)
+        bucket = await self._bucket(key)
+        if bucket.pop(str(user_id), None) is not None:
+            await DataManager.store().put(key, bucket)
+
+    async def refresh_user_data(self, user_id, user_data):
+        # The in-memory copy is authoritative while the bot runs
+        pass
+
+    async def get_conversations(self, name):
+        doc = await DataManager.store().get(CONVERSATIONS_KEY) or {}
+        return {tuple(json.loads(key)): state for key, state in doc.get(name, {}).items()}
+
+    async def update_conversation(self, name, key, new_state):
+        doc = await DataManager.store().get(CONVERSATIONS_KEY) or {}
+        states = doc.setdefault(name, {})
+        encoded = json.dumps(list(key))
+        if new_state is None:
+            states.pop(encoded, None)
+        else:
+            states[encoded] = new_state
+        await DataManager.store().put(CONVERSATIONS_KEY, doc)
+
+    async def flush(self):
+        await DataManager.flush()
+
+    # chat_data, bot_data and callback_data are not persisted (disabled in store_data)
+
+    async def get_chat_data(self):
+        return {}
+
+    async def update_chat_data(self, chat_id, data):
+        pass
+
+    async def drop_chat_data(self, chat_id):
+        pass
+
+    async def refresh_chat_data(self, chat_id, chat_data):
+        pass
+
+    async def get_bot_data(self):
+        return {}
+
+    async def update_bot_data(self, data):
+        pass
+
+    async def refresh_bot_data(self, bot_data):
+        pass
+
+    async def get_callback_data(self):
+        return None
+
+    async def update_callback_data(self, data):
+        pass
@@ -0,0 +1,95 @@
+# txid_index.py
+import asyncio
+import zlib
+
+from data_manager import DataManager
+from ledger import Ledger
+from shards import Shards
+
+BUCKETS = 256
+META_KEY = "txidx_meta"
+
+
+class TxidIndex:
+    """
+    Global txid -> user_id index used to reject duplicate deposit submissions.
+
+    The index is an on-disk hash table: txids are spread over BUCKETS store
+    documents by crc32, so a lookup touches one small document and a flush
+    only rewrites the buckets that changed. When sharded, the index lives on
+    the coordinator shard and the other shards forward their calls to it.
+    """
+    _buckets = {}
+    _ready = False
+    _init_lock = asyncio.Lock()
+
+    @staticmethod
+    def _bucket_key(txid):
+        return f"txidx_{zlib.crc32(txid.encode('utf-8')) % BUCKETS:02x}"
+
+    @staticmethod
+    async def _bucket(key):
+        bucket = TxidIndex._buckets.get(key)
+        if bucket is None:
+            doc = await DataManager.store().get(key) or {}
+            # A concurrent caller may have loaded the same bucket while we were waiting
+            bucket = TxidIndex._buckets.setdefault(key, doc)
+        return bucket
+
+    @staticmethod
+    async def load():
+        """Make sure the index exists, rebuilding it from user records the first time"""
+        if TxidIndex._ready or not Shards.is_coordinator():
+            return
+        async with TxidIndex._init_lock:
+            if TxidIndex._ready:
+                return
+            if await DataManager.store().get(META_KEY) is None:
+                await TxidIndex.rebuild()
+            TxidIndex._ready = True
+
+    @staticmethod
+    async def rebuild():
+        """Recreate every bucket from the transactions in the ledger"""
+        buckets = {}
+        for user_id, txn in await Ledger.all_transactions():
+            buckets.setdefault(TxidIndex._bucket_key(txn["txid"]), {})[txn["txid"]] = user_id
+
+        store = DataManager.store()
+        for key in await store.keys("txidx_"):
+            if key != META_KEY and key not in buckets:
+                await store.delete(key)
+        for key, bucket in buckets.items():
+            await store.put(key, bucket)
+        await store.put(META_KEY, {"buckets": BUCKETS})
+        TxidIndex._buckets = buckets
+
+    @staticmethod
+    async def claim(txid, user_id):
+        """Register txid for user_id. Returns False if it was already submitted by anyone."""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("txid.claim", txid, user_id)
+        await TxidIndex.load()
+        key = TxidIndex._bucket_key(txid)
+        bucket = await TxidIndex._bucket(key)
+
+        # No await between the check and the insert, so concurrent claims can't both win
+        if txid in bucket:
+            return False
+        bucket[txid] = str(user_id)
+        await DataManager.store().put(key, bucket)
+        return True
+
+    @staticmethod
+    async def release(txid):
+        """Forget txid (used to roll back a claim whose submission did not go through)"""
+        if not Shards.is_coordinator():
+            return await Shards.call_coordinator("txid.release", txid)
+        key = TxidIndex._bucket_key(txid)
+        bucket = await TxidIndex._bucket(key)
+        if bucket.pop(txid, None) is not None:
+            await DataManager.store().put(key, bucket)
+
+
+Shards.register("txid.claim", TxidIndex.claim)
+Shards.register("txid.release", TxidIndex.release)
@@ -0,0 +1,244 @@
+# verification.py
+import abc
+import asyncio
+import datetime
+import json
+import logging
+import os
+import random
+import time
+from dataclasses import dataclass
+
+from callback_handlers import CallbackHandlers, TransactionStatus
+from catalog_manager import CatalogManager
+from metrics import Metrics
+from notifier import Notifier
+from pending_queue import PendingQueue
+from shards import Shards
+from config import (
+    ADMINS, VERIFY_PROVIDERS, VERIFY_CONFIRMATIONS, VERIFY_WORKERS, VERIFY_QUEUE_SIZE,
+    VERIFY_POLL_INTERVAL, VERIFY_MAX_BACKOFF, VERIFY_TIMEOUT, VERIFY_MOCK_FILE
+)
+
+logger = logging.getLogger(__name__)
+
+
+@dataclass(frozen=True)
+class Payment:
+    """What a provider knows about a TXID. amount is in USD, like the deposit it is checked against."""
+    confirmations: int
+    amount: float
+    address: str = None  # receiving address, when the provider reports one
+
+
+class PaymentProvider(abc.ABC):
+    """Looks up TXIDs for one coin (a block explorer, node or payment processor API)"""
+    confirmations = VERIFY_CONFIRMATIONS  # confirmations required before a deposit is approved
+
+    @abc.abstractmethod
+    async def lookup(self, txid, address):
+        """Return a Payment for txid, or None if the network hasn't seen it (yet)"""
+
+
+class MockProvider(PaymentProvider):
+    """
+    Local stand-in for a real provider, for testing. Payments are read from a
+    JSON file ({txid: {"amount": 100, "confirmations": 6, "address": "..."}})
+    that is re-read whenever it changes, or added in-process with confirm().
+    """
+
+    def __init__(self, path=VERIFY_MOCK_FILE):
+        self.path = path
+        self.payments = {}
+        self._mtime = None
+
+    def confirm(self, txid, amount, confirmations=VERIFY_CONFIRMATIONS, address=None):
+        self.payments[txid] = Payment(confirmations, amount, address)
+
+    def _reload(self):
+        try:
+            mtime = os.stat(self.path).st_mtime
+        except FileNotFoundError:
+            return
+        if mtime == self._mtime:
+            return
+        with open(self.path, "r", encoding="utf-8") as f:
+            doc = json.load(f)
+        self._mtime = mtime
+        for txid, payment in doc.items():
+            self.payments[txid] = Payment(payment.get("confirmations", 0), payment.get("amount", 0), payment.get("address"))
+
+    async def lookup(self, txid, address):
+        await asyncio.to_thread(self._reload)
+        return self.payments.get(txid)
+
+
+# VERIFY_PROVIDERS name -> provider class
+PROVIDER_TYPES = {
+    "mock": MockProvider,
+}
+
+
+class Verifier:
+    """
+    Approves deposits automatically once a provider reports enough confirmations.
+
+    Each submitted TXID becomes a job on a bounded queue drained by
+    VERIFY_WORKERS tasks. An unconfirmed TXID is polled again with
+    exponential backoff (VERIFY_POLL_INTERVAL doubling up to
+    VERIFY_MAX_BACKOFF) until VERIFY_TIMEOUT. Approval goes through
+    CallbackHandlers.settle_transaction, so an admin pressing Approve at the
+    same moment can't credit the deposit twice. Wrong amounts, wrong
+    addresses and timeouts are never rejected automatically; the admins are
+    told and decide as before.
+    """
+    _providers = {}  # coin -> PaymentProvider
+    _queue = None
+    _workers = []
+    _timers = {}     # txid -> TimerHandle of a scheduled re-check
+    _bot = None
+
+    @staticmethod
+    def register(coin, provider):
+        Verifier._providers[coin] = provider
+
+    @staticmethod
+    def configure(spec):
+        """Register providers from a "Coin=type,Coin=type" string (VERIFY_PROVIDERS)"""
+        for item in filter(None, (part.strip() for part in spec.split(","))):
+            coin, _, kind = item.rpartition("=")
+            if kind not in PROVIDER_TYPES or not coin:
+                raise ValueError(f"Unknown verification provider {item!r} (available: {', '.join(PROVIDER_TYPES)})")
+            Verifier.register(coin.strip(), PROVIDER_TYPES[kind]())
+
+    @staticmethod
+    def supports(coin):
+        return coin in Verifier._providers
+
+    @staticmethod
+    async def start(bot):
+        """Start the workers and pick up this shard's deposits that are still pending"""
+        if not Verifier._providers:
+            Verifier.configure(VERIFY_PROVIDERS)
+        if not Verifier._providers or Verifier._workers:
+            return
+        Verifier._bot = bot
+        Verifier._queue = asyncio.Queue(maxsize=VERIFY_QUEUE_SIZE)
+        Verifier._workers = [asyncio.create_task(Verifier._worker()) for _ in range(VERIFY_WORKERS)]
+
+        resumed = 0
+        for entry in await PendingQueue.select():
+            if not Shards.is_local(entry["user_id"]):
+                continue
+            try:
+                submitted = datetime.datetime.fromisoformat(entry["timestamp"]).timestamp()
+            except (TypeError, ValueError):
+                submitted = None
+            resumed += await Verifier.submit(entry["user_id"], entry["txid"], entry["crypto"], submitted)
+        logger.info(f"Deposit verification running for {', '.join(Verifier._providers)} ({resumed} pending deposits resumed)")
+
+    @staticmethod
+    async def submit(user_id, txid, coin, submitted=None):
+        """
+        Queue a pending deposit for verification; False if its coin isn't verified
+        automatically or it was submitted (epoch seconds) more than VERIFY_TIMEOUT ago.
+        """
+        if Verifier._queue is None or not Verifier.supports(coin):
+            return False
+        address = (await CatalogManager.get()).wallets.get(coin)
+        deadline = (submitted or time.time()) + VERIFY_TIMEOUT
+        if not address or deadline <= time.time():
+            return False
+        job = {"user_id": str(user_id), "txid": txid, "coin": coin, "address": address, "attempt": 0, "deadline": deadline}
+        return Verifier._enqueue(job)
+
+    @staticmethod
+    def _enqueue(job):
+        Verifier._timers.pop(job["txid"], None)
+        try:
+            Verifier._queue.put_nowait(job)
+        except asyncio.QueueFull:
+            logger.warning(f"Verification queue full, leaving {job['txid']} to the admins")
+            VERIFICATIONS.inc(result="dropped")
+            return False
+        return True
+
+    @staticmethod
+    def _retry(job):
+        """Check the job again later, or hand it to the admins once VERIFY_TIMEOUT has passed"""
+        delay = min(VERIFY_MAX_BACKOFF, VERIFY_POLL_INTERVAL * 2 ** job["attempt"]) * random.uniform(0.8, 1.2)
+        job["attempt"] += 1
+        if time.time() + delay > job["deadline"]:
+            VERIFICATIONS.inc(result="timeout")
+            return Verifier._escalate(job, f"not confirmed after {VERIFY_TIMEOUT / 3600:g}h")
+        Verifier._timers[job["txid"]] = asyncio.get_running_loop().call_later(delay, Verifier._enqueue, job)
+
+    @staticmethod
+    async def _worker():
+        while True:
+            job = await Verifier._queue.get()
+            try:
+                await Verifier._check(job)
+            except Exception as e:
+                logger.error(f"Verification of {job['txid']} failed: {e}")
+                Verifier._retry(job)
+            finally:
+                Verifier._queue.task_done()
+
+    @staticmethod
+    async def _check(job):
+        transaction = await CallbackHandlers.find_transaction(job["user_id"], job["txid"])
+        if not transaction or transaction["status"] != TransactionStatus.PENDING.value:
+            return  # an admin got there first
+
+        provider = Verifier._providers[job["coin"]]
+        payment = await provider.lookup(job["txid"], job["address"])
+        if payment is None or payment.confirmations < provider.confirmations:
+            return Verifier._retry(job)
+        if payment.address and payment.address != job["address"]:
+            VERIFICATIONS.inc(result="mismatch")
+            return Verifier._escalate(job, f"paid to {payment.address}, not our {job['coin']} wallet")
+        if payment.amount < transaction["amount"]:
+            VERIFICATIONS.inc(result="mismatch")
+            return Verifier._escalate(job, f"received ${payment.amount:.2f}, expected ${transaction['amount']:.2f}")
+        await Verifier._approve(job, payment)
+
+    @staticmethod
+    async def _approve(job, payment):
+        user_id, txid = job["user_id"], job["txid"]
+        entries = await PendingQueue.select(txids=[txid])
+        transaction, balance, settled = await CallbackHandlers.settle_transaction(user_id, txid, TransactionStatus.APPROVED)
+        if not settled:
+            return
+        VERIFICATIONS.inc(result="approved")
+        logger.info(f"Auto-approved {txid} for user {user_id} ({payment.confirmations} confirmations)")
+        Notifier.send(Verifier._bot, user_id, CallbackHandlers._approval_notice(transaction, balance))
+        for entry in entries:
+            for chat_id, message_id in entry.get("alerts", []):
+                Notifier.edit(Verifier._bot, chat_id, message_id,
+                              f"🤖 Auto-approved TXID: `{txid}` ({payment.confirmations} confirmations)", parse_mode="Markdown")
+
+    @staticmethod
+    def _escalate(job, reason):
+        logger.warning(f"Left {job['txid']} for manual review: {reason}")
+        for admin_id in ADMINS:
+            Notifier.send(
+                Verifier._bot,
+                admin_id,
+                f"⚠️ Could not auto-approve TXID `{job['txid']}` (user `{job['user_id']}`): {reason}. Please review it manually.",
+                parse_mode="Markdown"
+            )
+
+    @staticmethod
+    async def stop():
+        for timer in Verifier._timers.values():
+            timer.cancel()
+        Verifier._timers = {}
+        for worker in Verifier._workers:
+            worker.cancel()
+        await asyncio.gather(*Verifier._workers, return_exceptions=True)
+        Verifier._workers = []
+        Verifier._queue = None
+
+
+VERIFICATIONS = Metrics.counter("telebot_verifications_total", "Automatic deposit verification outcomes")
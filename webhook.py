@@ -0,0 +1,140 @@
+# webhook.py
+import asyncio
+import hmac
+import json
+import logging
+import signal
+
+from aiohttp import web
+from telegram import Update
+
+from metrics import UPDATE_QUEUE_DEPTH, Metrics
+from shards import shard_for
+
+logger = logging.getLogger(__name__)
+
+SECRET_HEADER = "X-Telegram-Bot-Api-Secret-Token"
+
+
+def update_shard_key(data):
+    """Pick the id that orders an update: the sender for messages/callbacks, else the update id"""
+    for field in ("message", "edited_message", "callback_query", "inline_query", "my_chat_member"):
+        sender = (data.get(field) or {}).get("from")
+        if sender:
+            return sender["id"]
+    return data.get("update_id", 0)
+
+
+class WebhookServer:
+    """
+    aiohttp endpoint that receives Telegram updates and feeds them to the application.
+
+    Updates are spread over `concurrency` workers by hashing the sender id, so
+    each worker processes one user's updates in order while different users run
+    in parallel. Every worker has a bounded queue; when it is full the request
+    gets a 503 and Telegram redelivers it later instead of us buffering without limit.
+    """
+
+    def __init__(self, application, host, port, path, secret_token=None, queue_size=1000, concurrency=16):
+        self.application = application
+        self.host = host
+        self.port = port
+        self.path = path
+        self.secret_token = secret_token
+        self.concurrency = concurrency
+        self.queues = [asyncio.Queue(maxsize=max(1, queue_size // concurrency)) for _ in range(concurrency)]
+        self.workers = []
+        self.runner = None
+        self.accepted = 0
+        self.rejected = 0
+
+    def queue_depth(self):
+        return sum(queue.qsize() for queue in self.queues)
+
+    async def handle(self, request):
+        if self.secret_token and not hmac.compare_digest(request.headers.get(SECRET_HEADER, ""), self.secret_token):
+            return web.Response(status=403)
+        try:
+            data = await request.json(loads=json.loads)
+        except ValueError:
+            return web.Response(status=400)
+
+        if not self.enqueue(data):
+            self.rejected += 1
+            WEBHOOK_REJECTED.inc()
+            return web.Response(status=503)
+        self.accepted += 1
+        return web.Response()
+
+    def enqueue(self, data):
+        """Hand a raw update to a worker; returns False when its queue is full"""
+        queue = self.queues[shard_for(update_shard_key(data), self.concurrency)]
+        try:
+            queue.put_nowait(data)
+        except asyncio.QueueFull:
+            return False
+        return True
+
+    async def _worker(self, queue):
+        while True:
+            data = await queue.get()
+            try:
+                update = Update.de_json(data, self.application.bot)
+                await self.application.process_update(update)
+            except Exception as e:
+                logger.error(f"Failed to process update {data.get('update_id')}: {e}")
+            finally:
+                queue.task_done()
+
+    async def start_http(self):
+        app = web.Application()
+        app.router.add_post(self.path, self.handle)
+        self.runner = web.AppRunner(app, access_log=None)
+        await self.runner.setup()
+        await web.TCPSite(self.runner, self.host, self.port).start()
+        logger.info(f"Webhook listening on http://{self.host}:{self.port}{self.path}")
+
+    async def start(self):
+        await self.start_http()
+        UPDATE_QUEUE_DEPTH.set_function(self.queue_depth)
+        self.workers = [asyncio.create_task(self._worker(queue)) for queue in self.queues]
+
+    async def stop(self):
+        """Stop accepting updates, finish the queued ones, then stop the workers"""
+        if self.runner is not None:
+            await self.runner.cleanup()
+        await asyncio.gather(*(queue.join() for queue in self.queues))
+        for worker in self.workers:
+            worker.cancel()
+        await asyncio.gather(*self.workers, return_exceptions=True)
+
+
+async def run_webhook(application, host, port, path, secret_token=None, public_url=None, queue_size=1000, concurrency=16):
+    """Run the bot behind WebhookServer until SIGINT/SIGTERM, mirroring Application.run_polling's lifecycle"""
+    await application.initialize()
+    if application.post_init:
+        await application.post_init(application)
+    await application.start()
+    if public_url:
+        await application.bot.set_webhook(url=f"{public_url.rstrip('/')}{path}", secret_token=secret_token)
+
+    server = WebhookServer(application, host, port, path, secret_token, queue_size, concurrency)
+    await server.start()
+
+    stop = asyncio.Event()
+    loop = asyncio.get_running_loop()
+    for sig in (signal.SIGINT, signal.SIGTERM):
+        loop.add_signal_handler(sig, stop.set)
+    try:
+        await stop.wait()
+    finally:
+        await server.stop()
+        await application.stop()
+        if application.post_stop:
+            await application.post_stop(application)
+        await application.shutdown()
+        if application.post_shutdown:
+            await application.post_shutdown(application)
+
+
+WEBHOOK_REJECTED = Metrics.counter("telebot_webhook_rejected_total", "Webhook deliveries refused with 503 because a worker queue was full")